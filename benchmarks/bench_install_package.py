@@ -0,0 +1,568 @@
+#!/usr/bin/python3
+
+"""
+Measure how the storpool-common install_package() handler scales with
+the size of the host.
+
+For each host size a synthetic /proc, sysfs, cgroupfs, dpkg database and
+cgconfig examples tree is built in a temporary directory, and the handler
+is run against it with txn, subprocess and templating stubbed out.
+The first ("cold") run installs everything; the following ("warm") runs
+should find everything up to date.
+
+The helper layer modules that this layer does not ship are taken from
+the unit tests' mock spcharms package, so run this from the top-level
+directory of the layer, e.g. via "tox -e bench".
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mock
+
+from charmhelpers.core import unitdata
+
+root_path = os.path.realpath('.')
+if root_path not in sys.path:
+    sys.path.insert(0, root_path)
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import blockdev as spblockdev
+from spcharms import cgapply as spcgapply
+from spcharms import cgroups as spcgroups
+from spcharms import config as spconfig
+from spcharms import drift as spdrift
+from spcharms import hugepages as sphugepages
+from spcharms import inventory as spinventory
+from spcharms import irqs as spirqs
+from spcharms import kmod as spkmod
+from spcharms import manifest as spmanifest
+from spcharms import mempolicy as spmempolicy
+from spcharms import netdev as spnetdev
+from spcharms import pkgcheck as sppkgcheck
+from spcharms import power as sppower
+from spcharms import repo as sprepo
+from spcharms import settings as spsettings
+from spcharms import timing as sptiming
+from spcharms import topology as sptopology
+from spcharms import txn
+from spcharms import utils as sputils
+
+from reactive import storpool_common as testee
+
+HOST_SIZES = (4, 16, 64, 256, 1024)
+MAX_NODES = 8
+SMALL_HOST = 16
+SPVER = '18.02'
+CGCONFIG_BASE = '/usr/share/doc/storpool/examples/cgconfig/ubuntu1604'
+CGCONFIG_TEMPLATES = (
+    'machine.slice.conf',
+    'storpool.slice.conf',
+    'system.slice.conf',
+    'user.slice.conf',
+    'machine-cgsetup.conf',
+)
+KERNEL_CMDLINE = 'BOOT_IMAGE=/vmlinuz root=/dev/sda1 ro swapaccount=1 ' \
+                 'nofb vga=normal nomodeset video=vesafb:off i915.modeset=0'
+
+
+class Host(object):
+    """
+    A synthetic host tree rooted at a temporary directory.
+    """
+
+    def __init__(self, cpus, backend):
+        self.cpus = cpus
+        self.backend = backend
+        self.nodes = max(1, min(MAX_NODES, cpus // 8))
+        self.cores = max(1, cpus // 2)
+        # The smallest hosts cannot fit all the StorPool services.
+        self.bypassed = set(['very_few_cpus']) if cpus < SMALL_HOST else set()
+        self.root = tempfile.mkdtemp(prefix='spbench-')
+        self.build()
+
+    def cleanup(self):
+        shutil.rmtree(self.root)
+
+    def path(self, path):
+        """
+        Map an absolute path on the host into the synthetic tree.
+        Temporary files and the layer's own files are left alone.
+        """
+        if path.startswith(self.root) or \
+           path.startswith(tempfile.gettempdir() + '/') or \
+           path.startswith(root_path + '/'):
+            return path
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def write(self, path, contents):
+        fname = self.path(path)
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, mode='w') as f:
+            f.write(contents)
+
+    def cpu_core(self, cpu):
+        return cpu % self.cores
+
+    def core_node(self, core):
+        return core * self.nodes // self.cores
+
+    def build(self):
+        self.build_proc()
+        self.build_sysfs()
+        self.build_cgroupfs()
+        self.build_packages()
+        self.build_cgconfig()
+        self.write('/etc/hostname', 'bench1\n')
+        self.write('/etc/storpool.conf',
+                   'SP_CLUSTER_ID=bench\n'
+                   'SP_CACHE_SIZE=8192\n'
+                   'SP_IFACE1_CFG=1:sp0:ens1:-:10.0.0.1:b:s:P\n'
+                   'SP_IFACE2_CFG=1:sp1:ens2:-:10.0.1.1:b:s:P\n')
+
+    def build_proc(self):
+        self.write('/proc/cmdline', KERNEL_CMDLINE + '\n')
+        self.write('/proc/cpuinfo', ''.join(
+            'processor\t: {cpu}\n'
+            'vendor_id\t: GenuineIntel\n'
+            'model name\t: Synthetic CPU @ 2.40GHz\n'
+            'physical id\t: {node}\n'
+            'core id\t\t: {core}\n'
+            'cpu cores\t: {cores}\n'
+            'flags\t\t: fpu vme de pse tsc msr pae mce cx8 apic sep mtrr\n'
+            '\n'.format(cpu=cpu, core=self.cpu_core(cpu),
+                        node=self.core_node(self.cpu_core(cpu)),
+                        cores=self.cores)
+            for cpu in range(self.cpus)))
+        # 4 GB per CPU, at least 16 GB.
+        total_kb = max(16, 4 * self.cpus) * 1024 * 1024
+        self.write('/proc/meminfo',
+                   'MemTotal:       {total} kB\n'
+                   'MemFree:        {free} kB\n'
+                   'HugePages_Total:       0\n'
+                   'HugePages_Free:        0\n'
+                   'Hugepagesize:       2048 kB\n'
+                   .format(total=total_kb, free=total_kb // 2))
+        self.write('/proc/mounts', '/dev/sda1 / ext4 rw 0 0\n'
+                                   'proc /proc proc rw 0 0\n')
+        self.write('/proc/swaps', 'Filename\tType\tSize\tUsed\tPriority\n')
+        self.write('/proc/sys/kernel/random/boot_id',
+                   '0f2a6c1e-5b7d-4e0a-9c3b-1d2e3f405162\n')
+        self.build_interrupts()
+
+    def build_interrupts(self):
+        """
+        Give each NVMe controller and StorPool NIC a queue interrupt per
+        CPU, up to 64.
+        """
+        names = ['nvme{idx}q{q}'.format(idx=idx, q=q)
+                 for idx in range(2 * self.nodes)
+                 for q in range(min(self.cpus, 64) + 1)] + \
+            ['{iface}-TxRx-{q}'.format(iface=iface, q=q)
+             for iface in ('ens1', 'ens2')
+             for q in range(min(self.cpus, 64))]
+        lines = [' '.join('CPU{cpu}'.format(cpu=cpu)
+                          for cpu in range(self.cpus))]
+        for (idx, name) in enumerate(names):
+            irq = 100 + idx
+            lines.append('{irq}: {counts} IR-PCI-MSI {irq}-edge {name}'
+                         .format(irq=irq, name=name,
+                                 counts=' '.join(['1000'] * self.cpus)))
+            self.write('/proc/irq/{irq}/smp_affinity_list'.format(irq=irq),
+                       '0-{last}\n'.format(last=self.cpus - 1))
+        self.write('/proc/interrupts', '\n'.join(lines) + '\n')
+
+    def build_sysfs(self):
+        self.write('/sys/devices/system/cpu/online',
+                   '0-{last}\n'.format(last=self.cpus - 1))
+        self.write('/sys/devices/system/node/online',
+                   '0-{last}\n'.format(last=self.nodes - 1))
+        for node in range(self.nodes):
+            cpus = [cpu for cpu in range(self.cpus)
+                    if self.core_node(self.cpu_core(cpu)) == node]
+            self.write('/sys/devices/system/node/node{node}/cpulist'
+                       .format(node=node),
+                       sptopology.format_cpulist(cpus) + '\n')
+            self.write(sphugepages.nr_path(node), '0\n')
+        self.write('/sys/kernel/mm/hugepages/hugepages-2048kB/nr_hugepages',
+                   '0\n')
+        for cpu in range(self.cpus):
+            core = self.cpu_core(cpu)
+            siblings = [sib for sib in (core, core + self.cores)
+                        if sib < self.cpus]
+            topodir = '/sys/devices/system/cpu/cpu{cpu}/topology/' \
+                .format(cpu=cpu)
+            self.write(topodir + 'thread_siblings_list',
+                       sptopology.format_cpulist(siblings) + '\n')
+            self.write(topodir + 'core_id', '{core}\n'.format(core=core))
+            self.write(topodir + 'physical_package_id',
+                       '{node}\n'.format(node=self.core_node(core)))
+            cpudir = '/sys/devices/system/cpu/cpu{cpu}/'.format(cpu=cpu)
+            self.write(cpudir + 'cpufreq/scaling_governor', 'powersave\n')
+            self.write(cpudir + 'cpufreq/scaling_available_governors',
+                       'performance powersave\n')
+            for state in range(4):
+                self.write(cpudir + 'cpuidle/state{state}/disable'
+                           .format(state=state), '0\n')
+
+        self.write('/sys/kernel/mm/transparent_hugepage/defrag',
+                   'always defer defer+madvise [madvise] never\n')
+        self.write('/sys/kernel/mm/transparent_hugepage/khugepaged/defrag',
+                   '1\n')
+        for (name, value) in (('run', '0'), ('pages_to_scan', '100'),
+                              ('sleep_millisecs', '20')):
+            self.write('/sys/kernel/mm/ksm/' + name, value + '\n')
+        self.write('/proc/sys/kernel/numa_balancing', '1\n')
+        self.write('/sys/block/sda/device/numa_node', '0\n')
+        self.write('/sys/block/sda/size', '1953525168\n')
+        os.makedirs(self.path('/sys/block/sda/sda1/holders'))
+        for idx in range(2 * self.nodes):
+            devdir = '/sys/block/nvme{idx}n1/'.format(idx=idx)
+            self.write(devdir + 'device/numa_node',
+                       '{node}\n'.format(node=idx % self.nodes))
+            self.write(devdir + 'size', '3750748848\n')
+            self.write(devdir + 'wwid', 'eui.{idx:016x}\n'.format(idx=idx))
+            for (attr, value) in (('rotational', '0'),
+                                  ('scheduler', '[mq-deadline] none'),
+                                  ('nr_requests', '256'),
+                                  ('read_ahead_kb', '128'),
+                                  ('rq_affinity', '1')):
+                self.write(devdir + 'queue/' + attr, value + '\n')
+        for iface in ('ens1', 'ens2'):
+            self.write('/sys/class/net/{iface}/device/numa_node'
+                       .format(iface=iface), '0\n')
+            for queue in range(min(self.cpus, 64)):
+                for (qtype, attr) in (('rx', 'rps_cpus'), ('tx', 'xps_cpus')):
+                    self.write('/sys/class/net/{iface}/queues/{qtype}-{q}/'
+                               '{attr}'.format(iface=iface, qtype=qtype,
+                                               q=queue, attr=attr),
+                               '00000000\n')
+
+    def build_cgroupfs(self):
+        """
+        Create the cgroups left over by a previous configuration, with
+        a couple of virtual machines per NUMA node running.
+        """
+        groups = ['storpool.slice', 'machine.slice', 'system.slice',
+                  'user.slice'] + \
+            ['machine.slice/machine-qemu-{idx}.scope'.format(idx=idx)
+             for idx in range(2 * self.nodes)]
+        allcpus = '0-{last}'.format(last=self.cpus - 1)
+        if self.backend == spcgroups.BACKEND_V2:
+            self.write('/sys/fs/cgroup/cgroup.controllers',
+                       'cpuset cpu io memory pids\n')
+            for group in groups:
+                cgdir = '/sys/fs/cgroup/' + group + '/'
+                for (attr, value) in (('cpuset.cpus', ''),
+                                      ('cpuset.mems', ''),
+                                      ('memory.min', '0'),
+                                      ('memory.high', 'max'),
+                                      ('memory.max', 'max'),
+                                      ('memory.swap.max', 'max'),
+                                      ('cpu.weight', '100'),
+                                      ('io.weight', 'default 100')):
+                    self.write(cgdir + attr, value + '\n')
+            return
+
+        for group in groups:
+            self.write('/sys/fs/cgroup/cpuset/' + group + '/cpuset.cpus',
+                       allcpus + '\n')
+            self.write('/sys/fs/cgroup/cpuset/' + group + '/cpuset.mems',
+                       '0\n')
+            memdir = '/sys/fs/cgroup/memory/' + group + '/'
+            self.write(memdir + 'memory.limit_in_bytes',
+                       '9223372036854771712\n')
+            self.write(memdir + 'memory.memsw.limit_in_bytes',
+                       '9223372036854771712\n')
+        for idx in range(2 * self.nodes):
+            for vcpu in range(4):
+                self.write('/sys/fs/cgroup/cpuset/machine.slice/'
+                           'machine-qemu-{idx}.scope/vcpu{vcpu}/cpuset.cpus'
+                           .format(idx=idx, vcpu=vcpu), allcpus + '\n')
+
+    def build_packages(self):
+        self.write('/usr/bin/networkd-dispatcher', '')
+        release = os.uname().release
+        kmod = 'kmod-storpool-' + release
+        self.write('/var/lib/dpkg/status', ''.join(
+            'Package: {name}\n'
+            'Status: install ok installed\n'
+            'Version: {ver}\n'
+            '\n'.format(name=name, ver=SPVER)
+            for name in ('storpool-cli', 'storpool-common',
+                         'storpool-etcfiles', kmod, 'python-storpool')))
+        modules = ['/lib/modules/{release}/extra/storpool_{name}.ko'
+                   .format(release=release, name=name)
+                   for name in ('rdma', 'disk', 'bd', 'beacon')]
+        self.write('/var/lib/dpkg/info/{kmod}.list'.format(kmod=kmod),
+                   ''.join(path + '\n' for path in modules))
+        for path in modules:
+            self.write(path, path * 1024)
+
+    def build_cgconfig(self):
+        for fname in CGCONFIG_TEMPLATES:
+            self.write(CGCONFIG_BASE + '/etc/cgconfig.d/' + fname,
+                       '# template\n')
+        self.write(CGCONFIG_BASE + '/etc/systemd/system/cgconfig.service',
+                   '[Service]\nType=oneshot\n')
+        self.write('/etc/cgconfig.d/.keep', '')
+
+
+class RootedOS(object):
+    """
+    The parts of the os module that the handler uses to look around
+    the host, redirected into the synthetic tree.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.path = RootedOSPath(host)
+        self.uname = os.uname
+
+    def mkdir(self, path, *args, **kwargs):
+        return os.mkdir(self.host.path(path), *args, **kwargs)
+
+    def makedirs(self, path, *args, **kwargs):
+        return os.makedirs(self.host.path(path), *args, **kwargs)
+
+    def stat(self, path):
+        return os.stat(self.host.path(path))
+
+    def walk(self, top):
+        prefix = self.host.path('/')
+        for (path, dirs, files) in os.walk(self.host.path(top)):
+            yield ('/' + os.path.relpath(path, prefix), dirs, files)
+
+
+class RootedOSPath(object):
+    """
+    The os.path functions used by the handler, redirected into
+    the synthetic tree.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.dirname = os.path.dirname
+
+    def isdir(self, path):
+        return os.path.isdir(self.host.path(path))
+
+    def exists(self, path):
+        return os.path.exists(self.host.path(path))
+
+
+def run_hook(host, kv):
+    """
+    Run install_package() once against the synthetic host.
+
+    Return the handler's timing record.
+    """
+    def stub_install(*args):
+        (src, dst) = args[-2:]
+        dst = host.path(dst)
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        shutil.copyfile(host.path(src), dst)
+
+    def stub_render(source, target, context, templates_dir=None):
+        return '# {source}\n{ctx}\n'.format(
+            source=source, ctx=json.dumps(context, sort_keys=True))
+
+    def stub_ethtool(args, program=None):
+        if args[0] == '-g':
+            return 'Pre-set maximums:\nRX:\t4096\nTX:\t4096\n' \
+                   'Current hardware settings:\nRX:\t4096\nTX:\t4096\n'
+        return ''
+
+    def rooted_open(path, *args, **kwargs):
+        return open(host.path(path), *args, **kwargs)
+
+    def err(msg):
+        raise RuntimeError('sputils.err() invoked: {msg}'.format(msg=msg))
+
+    def rooted(func, root):
+        return functools.partial(func, root=root)
+
+    cgroot = host.path('/sys/fs/cgroup')
+    patches = [
+        mock.patch('charmhelpers.core.unitdata.kv', new=lambda: kv),
+        mock.patch('charmhelpers.core.hookenv.log'),
+        mock.patch('charmhelpers.core.host.service_resume'),
+        mock.patch('charmhelpers.core.templating.render', new=stub_render),
+        mock.patch('charms.reactive.set_state'),
+        mock.patch('subprocess.check_call'),
+        mock.patch.object(testee, 'open', new=rooted_open, create=True),
+        mock.patch.object(testee, 'os', new=RootedOS(host)),
+        mock.patch.object(txn, 'install', side_effect=stub_install),
+        mock.patch.object(sprepo, 'install_packages',
+                          return_value=(None, [])),
+        mock.patch.object(sputils, 'err', new=err),
+        mock.patch.object(sputils, 'bypassed',
+                          new=lambda name: name in host.bypassed),
+        mock.patch.object(spconfig, 'm',
+                          return_value={'storpool_version': SPVER}),
+        mock.patch.object(spcgroups, 'detect_backend',
+                          new=rooted(spcgroups.detect_backend, host.root)),
+        mock.patch.object(sptopology, 'get_topology',
+                          new=rooted(sptopology.get_topology, host.root)),
+        mock.patch.object(sptopology, 'parse_storpool_conf',
+                          new=functools.partial(
+                              lambda orig, root='/', hostname=None:
+                              orig(host.root, hostname),
+                              sptopology.parse_storpool_conf)),
+        mock.patch.object(spcgapply, 'reconcile',
+                          new=rooted(spcgapply.reconcile, cgroot)),
+        mock.patch.object(sppkgcheck, 'verify',
+                          new=rooted(sppkgcheck.verify, host.root)),
+        mock.patch.object(sppkgcheck, 'record',
+                          new=rooted(sppkgcheck.record, host.root)),
+        mock.patch.object(spinventory, 'load',
+                          new=rooted(spinventory.load, host.root)),
+        mock.patch.object(sphugepages, 'total_mb',
+                          new=rooted(sphugepages.total_mb, host.root)),
+        mock.patch.object(sphugepages, 'apply',
+                          new=rooted(sphugepages.apply, host.root)),
+        mock.patch.object(spirqs, 'plan_irqs',
+                          new=rooted(spirqs.plan_irqs, host.root)),
+        mock.patch.object(spirqs, 'apply',
+                          new=rooted(spirqs.apply, host.root)),
+        mock.patch.object(spirqs, 'read_interrupts',
+                          new=functools.partial(
+                              lambda orig, root='/': orig(host.root),
+                              spirqs.read_interrupts)),
+        mock.patch.object(spblockdev, 'plan',
+                          new=rooted(spblockdev.plan, host.root)),
+        mock.patch.object(spblockdev, 'apply',
+                          new=rooted(spblockdev.apply, host.root)),
+        mock.patch.object(spdrift, 'hardware',
+                          new=rooted(spdrift.hardware, host.root)),
+        mock.patch.object(sppower, 'plan',
+                          new=rooted(sppower.plan, host.root)),
+        mock.patch.object(spmempolicy, 'node_role',
+                          new=rooted(spmempolicy.node_role, host.root)),
+        mock.patch.object(spmempolicy, 'plan',
+                          new=rooted(spmempolicy.plan, host.root)),
+        mock.patch.object(spsettings, 'apply',
+                          new=rooted(spsettings.apply, host.root)),
+        mock.patch.object(spnetdev, 'apply',
+                          new=rooted(spnetdev.apply, host.root)),
+        mock.patch.object(spnetdev, 'hooks',
+                          new=rooted(spnetdev.hooks, host.root)),
+        mock.patch.object(spnetdev, 'ethtool', new=stub_ethtool),
+        mock.patch.object(spkmod, 'depmod_needed',
+                          new=rooted(spkmod.depmod_needed, host.root)),
+        mock.patch.object(spmanifest, 'file_digest',
+                          new=functools.partial(
+                              lambda orig, path: orig(host.path(path)),
+                              spmanifest.file_digest)),
+    ]
+    for patcher in patches:
+        patcher.start()
+    try:
+        sptiming._timeline = None
+        with mock.patch('charmhelpers.core.hookenv.atexit'):
+            timeline = sptiming.timeline()
+        testee.install_package()
+        return timeline.handlers[0]
+    finally:
+        sptiming._timeline = None
+        for patcher in reversed(patches):
+            patcher.stop()
+
+
+def bench_host(cpus, backend, repeat):
+    """
+    Run the handler once from scratch and `repeat` more times with
+    everything already in place.
+    """
+    host = Host(cpus, backend)
+    try:
+        kv = unitdata.Storage(':memory:')
+        tracemalloc.start()
+        start = time.monotonic()
+        cold = run_hook(host, kv)
+        cold_wall = time.monotonic() - start
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        warm = []
+        for _ in range(repeat):
+            start = time.monotonic()
+            record = run_hook(host, kv)
+            warm.append(time.monotonic() - start)
+        return {
+            'cpus': cpus,
+            'nodes': host.nodes,
+            'backend': backend,
+            'cold': cold_wall,
+            'warm': statistics.median(warm) if warm else None,
+            'peak_kb': peak // 1024,
+            'phases': dict((phase['name'], phase['wall'])
+                           for phase in cold['phases']),
+            'warm_phases': dict((phase['name'], phase['wall'])
+                                for phase in record['phases'])
+            if warm else {},
+            'subprocesses': cold['subprocesses'],
+        }
+    finally:
+        host.cleanup()
+
+
+def report(results):
+    phases = []
+    for res in results:
+        phases.extend(name for name in res['phases'] if name not in phases)
+    print('{:>5} {:>5} {:>4} {:>9} {:>9} {:>9}  {}'.format(
+        'cpus', 'nodes', 'cg', 'cold ms', 'warm ms', 'peak KB',
+        ' '.join('{:>12}'.format(name) for name in phases)))
+    for res in results:
+        print('{:>5} {:>5} {:>4} {:>9.2f} {:>9} {:>9}  {}'.format(
+            res['cpus'], res['nodes'], res['backend'], res['cold'] * 1000,
+            '-' if res['warm'] is None
+            else '{:.2f}'.format(res['warm'] * 1000),
+            res['peak_kb'],
+            ' '.join('{:>12.2f}'.format(res['phases'].get(name, 0) * 1000)
+                     for name in phases)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the storpool-common install_package() '
+                    'handler on synthetic hosts')
+    parser.add_argument('-c', '--cpus', type=str,
+                        default=','.join(map(str, HOST_SIZES)),
+                        help='a comma-separated list of host CPU counts')
+    parser.add_argument('-b', '--backend', choices=[spcgroups.BACKEND_V1,
+                                                    spcgroups.BACKEND_V2],
+                        default=spcgroups.BACKEND_V1,
+                        help='the cgroup hierarchy to simulate')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='the number of warm runs per host size')
+    parser.add_argument('-j', '--json', action='store_true',
+                        help='output the results in JSON format')
+    args = parser.parse_args()
+
+    results = [bench_host(int(cpus), args.backend, args.repeat)
+               for cpus in args.cpus.split(',')]
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
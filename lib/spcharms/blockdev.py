@@ -0,0 +1,156 @@
+"""
+A StorPool Juju charm helper module: tune the block layer queues of the
+StorPool drives according to their device class.
+"""
+from __future__ import print_function
+
+import os
+
+from spcharms import sysutil as spsysutil
+
+UDEV_RULES = '/etc/udev/rules.d/61-storpool-common-block.rules'
+
+CLASS_NVME = 'nvme'
+CLASS_SSD = 'ssd'
+CLASS_HDD = 'hdd'
+
+# The queue parameters for each device class, in the order that they
+# must be set in: the number of requests depends on the scheduler.
+# The first available scheduler is used, the older kernels only have
+# the legacy single-queue ones.  Without a scheduler the number of
+# requests is the depth of the hardware queue and the kernel rejects
+# anything larger, so it is left alone.  The flash drives do not gain
+# anything from reading ahead, while the HDDs keep the kernel's default
+# read-ahead that their sequential reads benefit from.
+PROFILES = {
+    CLASS_NVME: [
+        ('scheduler', ['none', 'noop']),
+        ('nr_requests', '1023'),
+        ('read_ahead_kb', '0'),
+        ('rq_affinity', '2'),
+    ],
+    CLASS_SSD: [
+        ('scheduler', ['none', 'noop']),
+        ('nr_requests', '256'),
+        ('read_ahead_kb', '0'),
+        ('rq_affinity', '2'),
+    ],
+    CLASS_HDD: [
+        ('scheduler', ['mq-deadline', 'deadline']),
+        ('nr_requests', '128'),
+        ('read_ahead_kb', '128'),
+        ('rq_affinity', '1'),
+    ],
+}
+
+
+def queue_path(name, attr, root='/'):
+    """
+    Return the sysfs path of a queue parameter of a block device.
+    """
+    return os.path.join(root, 'sys/block', name, 'queue', attr)
+
+
+def device_class(name, root='/'):
+    """
+    Classify a block device as an NVMe drive, a SATA/SAS SSD or a hard
+    disk.
+    """
+    if name.startswith('nvme'):
+        return CLASS_NVME
+    rotational = spsysutil.read_line(queue_path(name, 'rotational', root))
+    return CLASS_HDD if rotational == '1' else CLASS_SSD
+
+
+def device_wwid(name, root='/'):
+    """
+    Return the persistent World Wide Identifier of a block device, or
+    None if the device does not report one.
+    """
+    for path in ('wwid', 'device/wwid'):
+        wwid = spsysutil.read_line(os.path.join(root, 'sys/block', name,
+                                                path))
+        if wwid:
+            return wwid
+    return None
+
+
+def plan(drives, root='/'):
+    """
+    Plan the queue parameters of the StorPool drives.
+
+    Return a dictionary mapping the device names to dictionaries with
+    the "class", "wwid" and "settings" (a list of (attribute, value)
+    tuples) keys.
+    """
+    res = {}
+    for name in sorted(drives):
+        dclass = device_class(name, root)
+        settings = []
+        chosen = None
+        for (attr, value) in PROFILES[dclass]:
+            if attr == 'scheduler':
+                available = spsysutil.parse_choices(spsysutil.read_line(
+                    queue_path(name, attr, root)))[1]
+                value = next((sched for sched in value
+                              if sched in available), None)
+                if value is None:
+                    continue
+                chosen = value
+            elif attr == 'nr_requests' and chosen == 'none':
+                continue
+            settings.append((attr, value))
+        res[name] = {
+            'class': dclass,
+            'wwid': device_wwid(name, root),
+            'settings': settings,
+        }
+    return res
+
+
+def apply(tuning, root='/'):
+    """
+    Set the planned queue parameters of the drives, only writing the ones
+    that differ.
+
+    Return a dictionary with the "changed" ((name, attribute, old, new)
+    tuples) and "errors" ((name, attribute, message) tuples) lists.
+    """
+    res = {'changed': [], 'errors': []}
+    for (name, data) in sorted(tuning.items()):
+        for (attr, value) in data['settings']:
+            path = queue_path(name, attr, root)
+            try:
+                with open(path, mode='r') as f:
+                    current = f.readline().strip()
+                if attr == 'scheduler':
+                    current = spsysutil.parse_choices(current)[0]
+                if current == value:
+                    continue
+                with open(path, mode='w') as f:
+                    f.write(value + '\n')
+            except (IOError, OSError) as e:
+                res['errors'].append((name, attr, str(e)))
+                continue
+            res['changed'].append((name, attr, current, value))
+    return res
+
+
+def rules_context(tuning):
+    """
+    Build the template context for the udev rules that set the queue
+    parameters when the drives appear, matching them by their WWID if
+    they have one.
+    """
+    return {
+        'drives': [
+            {
+                'name': name,
+                'class': data['class'],
+                'wwid': data['wwid'],
+                'settings': [{'attr': attr, 'value': value}
+                             for (attr, value) in data['settings']],
+            }
+            for (name, data) in sorted(tuning.items())
+        ],
+    }
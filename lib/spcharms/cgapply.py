@@ -0,0 +1,160 @@
+"""
+A StorPool Juju charm helper module: bring the running cgroups in line
+with the desired configuration without restarting anything.
+"""
+from __future__ import print_function
+
+import os
+
+from spcharms import sysutil as spsysutil
+from spcharms import topology as sptopology
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+CPUSET_ATTRS = ('cpuset.cpus', 'cpuset.mems')
+
+
+def read_attr(cgdir, attr):
+    """
+    Read a cgroup attribute, return None if the kernel does not support
+    it for this cgroup.
+    """
+    value = spsysutil.read_text(os.path.join(cgdir, attr))
+    return None if value is None else value.strip()
+
+
+def write_attr(cgdir, attr, value):
+    """
+    Write a cgroup attribute.
+    """
+    with open(os.path.join(cgdir, attr), mode='w') as f:
+        f.write(value + '\n')
+
+
+def normalize(attr, value):
+    """
+    Convert an attribute value to a form suitable for comparison.
+    """
+    if attr in CPUSET_ATTRS:
+        return sptopology.parse_cpulist(value)
+    if attr == 'io.weight':
+        # "default 100\n8:0 200" or just "100"
+        words = value.split('\n')[0].split()
+        return words[-1] if words else ''
+    return value.strip()
+
+
+def order_attrs(cgdir, attrs):
+    """
+    Sort the attributes so that the cgroup v1 memory limit never exceeds
+    the memory+swap one while they are being changed.
+    """
+    names = [attr for (attr, _) in attrs]
+    if 'memory.limit_in_bytes' not in names or \
+       'memory.memsw.limit_in_bytes' not in names:
+        return attrs
+    new = dict(attrs)['memory.limit_in_bytes']
+    current = read_attr(cgdir, 'memory.limit_in_bytes')
+    growing = current is not None and int(new) > int(current)
+    first = 'memory.memsw.limit_in_bytes' if growing \
+        else 'memory.limit_in_bytes'
+    return sorted(attrs, key=lambda item: item[0] != first)
+
+
+def descendants(cgdir):
+    """
+    Return the child cgroups of `cgdir`, parents before their children.
+    """
+    res = []
+    for (path, dirs, _) in os.walk(cgdir):
+        dirs.sort()
+        res.extend(os.path.join(path, name) for name in dirs)
+    return res
+
+
+def update_cpuset(cgdir, attr, value):
+    """
+    Change a cpuset attribute of a cgroup and all its descendants
+    without ever leaving a child with CPUs or memory nodes outside of
+    its parent: first widen everything top-down to the union of the old
+    and new sets, then narrow it bottom-up.
+
+    The descendants that had all of their parent's CPUs or memory nodes
+    get all of the new ones; the rest keep their own (e.g. per-vCPU)
+    subsets if these are still allowed, otherwise they also get the
+    whole new set.
+
+    Return a list of (directory, old, new) tuples for the descendants
+    that were changed.
+    """
+    target = {cgdir: sptopology.parse_cpulist(value)}
+    current = {cgdir: sptopology.parse_cpulist(read_attr(cgdir, attr))}
+    order = [cgdir]
+    for child in descendants(cgdir):
+        old = read_attr(child, attr)
+        if old is None or old == '':
+            # Not a cpuset cgroup or inheriting from its parent (v2).
+            continue
+        parent = os.path.dirname(child)
+        if parent not in target:
+            continue
+        current[child] = sptopology.parse_cpulist(old)
+        if current[child] == current[parent]:
+            target[child] = target[parent]
+        else:
+            target[child] = sorted(set(target[parent])
+                                   .intersection(current[child])) or \
+                target[parent]
+        order.append(child)
+
+    wide = {}
+    for path in order:
+        wide[path] = sorted(set(current[path]).union(target[path]))
+        if wide[path] != current[path]:
+            write_attr(path, attr, sptopology.format_cpulist(wide[path]))
+    for path in reversed(order):
+        if target[path] != wide[path]:
+            write_attr(path, attr, sptopology.format_cpulist(target[path]))
+
+    return [
+        (path, sptopology.format_cpulist(current[path]),
+         sptopology.format_cpulist(target[path]))
+        for path in order[1:]
+        if current[path] != target[path]
+    ]
+
+
+def reconcile(desired, root=CGROUP_ROOT):
+    """
+    Compare the running cgroups with the `desired` attributes (as
+    returned by spcharms.cgroups.desired_v1() or desired_v2()) and write
+    only the ones that differ.
+
+    Return a dictionary with the "changed" (path, attribute, old, new)
+    tuples, the "missing" cgroup paths that do not exist (yet), and the
+    "errors" (path, attribute, message) tuples.
+    """
+    res = {'changed': [], 'missing': [], 'errors': []}
+    for path in sorted(desired.keys()):
+        cgdir = os.path.join(root, path)
+        if not os.path.isdir(cgdir):
+            res['missing'].append(path)
+            continue
+
+        for (attr, value) in order_attrs(cgdir, desired[path]):
+            current = read_attr(cgdir, attr)
+            if current is None or \
+               normalize(attr, current) == normalize(attr, value):
+                continue
+            try:
+                if attr in CPUSET_ATTRS:
+                    for (child, old, new) in update_cpuset(cgdir, attr,
+                                                           value):
+                        res['changed'].append(
+                            (os.path.relpath(child, root), attr, old, new))
+                else:
+                    write_attr(cgdir, attr, value)
+                res['changed'].append((path, attr, current, value))
+            except (IOError, OSError, ValueError) as e:
+                res['errors'].append((path, attr, str(e)))
+    return res
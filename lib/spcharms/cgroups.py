@@ -0,0 +1,161 @@
+"""
+A StorPool Juju charm helper module: figure out which cgroup hierarchy
+the host uses and describe the files that set up the StorPool cgroups
+on it.
+"""
+from __future__ import print_function
+
+import os
+
+BACKEND_V1 = 'v1'
+BACKEND_V2 = 'v2'
+
+SYSTEMD_DIR = '/etc/systemd/system'
+DROPIN_NAME = '50-storpool-common.conf'
+
+# Kernel command-line parameters that only make sense for cgroup v1.
+V1_ONLY_PARAMS = ('swapaccount=1',)
+
+# The relative CPU and I/O weights of the slices; the systemd default
+# is 100.
+WEIGHTS = {
+    'storpool': 1000,
+    'machine': 100,
+    'system': 100,
+    'user': 100,
+}
+
+
+def detect_backend(root='/'):
+    """
+    Return BACKEND_V2 if the host runs with the unified cgroup hierarchy
+    mounted on /sys/fs/cgroup and BACKEND_V1 otherwise (this includes
+    the "hybrid" setup where the unified hierarchy is only used by
+    systemd itself).
+    """
+    controllers = os.path.join(root, 'sys/fs/cgroup/cgroup.controllers')
+    return BACKEND_V2 if os.path.exists(controllers) else BACKEND_V1
+
+
+def required_params(params, backend):
+    """
+    Filter out the kernel parameters that the backend does not need.
+    """
+    if backend == BACKEND_V1:
+        return params
+    return tuple(param for param in params if param not in V1_ONLY_PARAMS)
+
+
+def v2_files(tdata):
+    """
+    Describe the systemd slice units and drop-ins that configure the
+    cgroups on the unified hierarchy, based on the same `tdata` template
+    data as the cgconfig files.
+
+    Return a list of (template, destination, context) tuples.
+    """
+    res = [(
+        'systemd/storpool.slice',
+        os.path.join(SYSTEMD_DIR, 'storpool.slice'),
+        dict(tdata, weight=WEIGHTS['storpool']),
+    )]
+    for group in tdata['storpool_groups']:
+        res.append((
+            'systemd/storpool-group.slice',
+            os.path.join(SYSTEMD_DIR, 'storpool-{name}.slice'
+                         .format(name=group['name'])),
+            dict(tdata, group=group, weight=WEIGHTS['storpool']),
+        ))
+
+    for name in ('machine', 'system', 'user'):
+        res.append((
+            'systemd/slice-limits.conf',
+            os.path.join(SYSTEMD_DIR, '{name}.slice.d'.format(name=name),
+                         DROPIN_NAME),
+            dict(tdata,
+                 slice_cpus=tdata['cpu_rest'],
+                 slice_mems=tdata['mems_all'],
+                 # VMs may be throttled, but never killed by the limit.
+                 memory_high=tdata['mem_machine'] if name == 'machine'
+                 else None,
+                 memory_max=None if name == 'machine'
+                 else tdata['mem_' + name],
+                 weight=WEIGHTS[name]),
+        ))
+    return res
+
+
+def mb_to_bytes(mb):
+    """
+    Convert a memory plan value in megabytes to the cgroupfs byte count.
+    """
+    return str(int(mb) * 1024 * 1024)
+
+
+def desired_v1(tdata):
+    """
+    Describe the cgroup v1 attributes that the cgconfig files set, based
+    on the `tdata` template data.
+
+    Return a dictionary mapping cgroup directories (relative to the
+    cgroupfs mount point) to lists of (attribute, value) tuples.
+    """
+    res = {}
+
+    def add(group, cpus, mems, mem=None):
+        res['cpuset/' + group] = [('cpuset.cpus', cpus),
+                                  ('cpuset.mems', mems)]
+        if mem is not None:
+            res['memory/' + group] = [
+                ('memory.limit_in_bytes', mb_to_bytes(mem)),
+                ('memory.memsw.limit_in_bytes', mb_to_bytes(mem)),
+            ]
+
+    add('storpool.slice', tdata['cpu_storpool'], tdata['mems_storpool'],
+        tdata['mem_storpool'])
+    for group in tdata['storpool_groups']:
+        add('storpool.slice/' + group['name'], group['cpus'],
+            tdata['mems_storpool'])
+    for name in ('machine', 'system', 'user'):
+        add(name + '.slice', tdata['cpu_rest'], tdata['mems_all'],
+            tdata['mem_' + name])
+    return res
+
+
+def desired_v2(tdata):
+    """
+    Describe the cgroup v2 attributes that the systemd slice files set,
+    based on the `tdata` template data.
+
+    Return a dictionary mapping cgroup directories (relative to the
+    cgroupfs mount point) to lists of (attribute, value) tuples.
+    """
+    def weights(name):
+        return [('cpu.weight', str(WEIGHTS[name])),
+                ('io.weight', str(WEIGHTS[name]))]
+
+    mem_storpool = mb_to_bytes(tdata['mem_storpool'])
+    res = {
+        'storpool.slice': [
+            ('cpuset.cpus', tdata['cpu_storpool']),
+            ('cpuset.mems', tdata['mems_storpool']),
+            ('memory.min', mem_storpool),
+            ('memory.max', mem_storpool),
+            ('memory.swap.max', '0'),
+        ] + weights('storpool'),
+    }
+    for group in tdata['storpool_groups']:
+        res['storpool.slice/storpool-{name}.slice'
+            .format(name=group['name'])] = [
+            ('cpuset.cpus', group['cpus']),
+            ('cpuset.mems', tdata['mems_storpool']),
+        ] + weights('storpool')
+    for name in ('machine', 'system', 'user'):
+        limit = 'memory.high' if name == 'machine' else 'memory.max'
+        res[name + '.slice'] = [
+            ('cpuset.cpus', tdata['cpu_rest']),
+            ('cpuset.mems', tdata['mems_all']),
+            (limit, mb_to_bytes(tdata['mem_' + name])),
+            ('memory.swap.max', '0'),
+        ] + weights(name)
+    return res
@@ -0,0 +1,189 @@
+"""
+A StorPool Juju charm helper module: check the kernel command line
+against the parameters that StorPool requires or recommends.
+"""
+from __future__ import print_function
+
+import shlex
+
+from spcharms import topology as sptopology
+
+SEVERITY_REQUIRED = 'required'
+SEVERITY_RECOMMENDED = 'recommended'
+
+# The C-state to limit the CPUs to so that the StorPool services do not
+# pay the wake-up latency of the deeper idle states.
+MAX_CSTATE = 1
+
+
+def normalize_key(key):
+    """
+    Normalize a parameter name the way the kernel compares them.
+    """
+    return key.replace('-', '_')
+
+
+def parse(line):
+    """
+    Parse a kernel command line into a dictionary mapping the parameter
+    names to their values (None for flags without a value); if a
+    parameter is specified more than once, the last value wins.
+    """
+    res = {}
+    try:
+        words = shlex.split(line)
+    except ValueError:
+        words = line.split()
+    for word in words:
+        if word == '--':
+            break
+        if '=' in word:
+            (key, value) = word.split('=', 1)
+        else:
+            (key, value) = (word, None)
+        res[normalize_key(key)] = value
+    return res
+
+
+def rule(param, severity, match='exact', reason=None):
+    """
+    Describe a kernel parameter that should be present, given as
+    "name=value" or just "name" for flags.
+    """
+    if '=' in param:
+        (key, value) = param.split('=', 1)
+    else:
+        (key, value) = (param, None)
+    return {
+        'key': key,
+        'value': value,
+        'severity': severity,
+        'match': match,
+        'reason': reason,
+    }
+
+
+def split_cpus(value):
+    """
+    Split a CPU list parameter value into its flags (e.g. "domain" for
+    isolcpus) and its CPUs.
+    """
+    flags = []
+    cpus = []
+    for word in (value or '').split(','):
+        if not word:
+            continue
+        if word[0].isdigit():
+            cpus.extend(sptopology.parse_cpulist(word))
+        else:
+            flags.append(word)
+    return (flags, sorted(set(cpus)))
+
+
+def satisfied(rl, current):
+    """
+    Check whether the current value of a parameter satisfies a rule.
+    """
+    if rl['value'] is None:
+        return True
+    if current is None:
+        return False
+    if rl['match'] == 'cpus':
+        try:
+            have = set(split_cpus(current)[1])
+        except ValueError:
+            return False
+        return set(split_cpus(rl['value'])[1]).issubset(have)
+    if rl['match'] == 'max':
+        try:
+            return int(current) <= int(rl['value'])
+        except ValueError:
+            return False
+    return current == rl['value']
+
+
+def wanted_value(rl, current):
+    """
+    Return the value that the parameter should be changed to, keeping
+    the CPUs and flags that are already there for the CPU list ones.
+    """
+    if rl['match'] == 'cpus' and current is not None:
+        try:
+            (flags, cpus) = split_cpus(current)
+        except ValueError:
+            return rl['value']
+        cpus = set(cpus).union(split_cpus(rl['value'])[1])
+        return ','.join(flags + [sptopology.format_cpulist(cpus)])
+    return rl['value']
+
+
+def check(params, rules):
+    """
+    Check the parsed kernel parameters against a list of rules.
+
+    Return a list of the unsatisfied rules, each one a copy of the rule
+    with the additional "current" (the current value or None) and
+    "present" (whether the parameter was specified at all) and "wanted"
+    (the full "name=value" to put on the command line) keys.
+    """
+    res = []
+    for rl in rules:
+        key = normalize_key(rl['key'])
+        present = key in params
+        current = params.get(key)
+        if present and satisfied(rl, current):
+            continue
+        value = wanted_value(rl, current)
+        res.append(dict(
+            rl,
+            present=present,
+            current=current,
+            wanted=rl['key'] if value is None
+            else '{key}={value}'.format(key=rl['key'], value=value),
+        ))
+    return res
+
+
+def required_rules(params):
+    """
+    Build the rules for the parameters that StorPool cannot run without.
+    """
+    return [rule(param, SEVERITY_REQUIRED) for param in params]
+
+
+def recommended_rules(cpus):
+    """
+    Build the rules for the latency-related parameters that are
+    recommended for the CPUs dedicated to the StorPool services.
+    """
+    cpulist = sptopology.format_cpulist(cpus)
+    res = []
+    if cpulist:
+        res.extend([
+            rule('isolcpus=' + cpulist, SEVERITY_RECOMMENDED, 'cpus',
+                 'keep the scheduler from placing other tasks on the '
+                 'StorPool CPUs'),
+            rule('nohz_full=' + cpulist, SEVERITY_RECOMMENDED, 'cpus',
+                 'stop the scheduler tick on the StorPool CPUs'),
+            rule('rcu_nocbs=' + cpulist, SEVERITY_RECOMMENDED, 'cpus',
+                 'move the RCU callbacks off the StorPool CPUs'),
+        ])
+    res.extend([
+        rule('intel_idle.max_cstate={c}'.format(c=MAX_CSTATE),
+             SEVERITY_RECOMMENDED, 'max',
+             'avoid the wake-up latency of the deep C-states'),
+        rule('processor.max_cstate={c}'.format(c=MAX_CSTATE),
+             SEVERITY_RECOMMENDED, 'max',
+             'avoid the wake-up latency of the deep C-states'),
+        rule('iommu=pt', SEVERITY_RECOMMENDED, 'exact',
+             'avoid the IOMMU translation overhead for the host devices'),
+    ])
+    return res
+
+
+def suggestion(problems):
+    """
+    Return the exact kernel command line text to add, or to replace
+    the current values of the listed parameters with.
+    """
+    return ' '.join(prob['wanted'] for prob in problems)
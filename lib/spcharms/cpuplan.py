@@ -0,0 +1,136 @@
+"""
+A StorPool Juju charm helper module: decide how many CPUs the StorPool
+services need and which ones they should get.
+"""
+from __future__ import print_function
+
+from spcharms import topology as sptopology
+
+DEFAULTS = {
+    'storpool_block_cpus': 1,
+    'storpool_nics_per_rdma_cpu': 2,
+    'storpool_drives_per_server_cpu': 8,
+    'storpool_max_server_cpus': 4,
+}
+
+
+def config_int(config, name, default):
+    """
+    Fetch a non-negative integer planner setting from the charm config.
+    """
+    value = config.get(name, None)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError('Invalid "{name}" value "{value}"'
+                         .format(name=name, value=value))
+    if value < 0:
+        raise ValueError('The "{name}" setting may not be negative'
+                         .format(name=name))
+    return value
+
+
+def setting(config, name):
+    """
+    Fetch a CPU planner setting, falling back to the default value.
+    """
+    return config_int(config, name, DEFAULTS[name])
+
+
+def server_name(idx):
+    """
+    Return the name of the cgroup for the `idx`-th StorPool server
+    instance: "server", "server_1", "server_2", etc.
+    """
+    return 'server' if idx == 0 else 'server_{idx}'.format(idx=idx)
+
+
+def plan_services(topology, config):
+    """
+    Size the StorPool services for the network interfaces and drives
+    found on this host.
+
+    Return a list of dictionaries with the "name" of the service's
+    storpool.slice group, the number of dedicated "cpus" for it, and
+    the name of the service that it "shares" its CPUs with, if any.
+    """
+    nics = len(topology['ifaces'])
+    drives = len(topology['drives'])
+
+    per_rdma = setting(config, 'storpool_nics_per_rdma_cpu')
+    rdma = 1 if per_rdma == 0 else max(1, -(-nics // per_rdma))
+
+    per_server = setting(config, 'storpool_drives_per_server_cpu')
+    if per_server == 0:
+        servers = 0
+    else:
+        servers = min(setting(config, 'storpool_max_server_cpus'),
+                      -(-drives // per_server))
+
+    res = [{'name': 'rdma', 'cpus': rdma, 'shares': None}]
+    if servers:
+        res.append({'name': 'beacon', 'cpus': 1, 'shares': None})
+    else:
+        # A compute-only node: the beacon is mostly idle.
+        res.append({'name': 'beacon', 'cpus': 0, 'shares': 'rdma'})
+    block = setting(config, 'storpool_block_cpus')
+    if block:
+        res.append({'name': 'block', 'cpus': block, 'shares': None})
+    else:
+        res.append({'name': 'block', 'cpus': 0, 'shares': 'rdma'})
+    res.extend({'name': server_name(idx), 'cpus': 1, 'shares': None}
+               for idx in range(servers))
+    return res
+
+
+def plan_cpus(topology, node, services, all_cpus, pad=False):
+    """
+    Hand out CPUs to the planned StorPool services, preferring whole
+    physical cores on the StorPool NUMA node and falling back to
+    separate SMT threads if there are not enough cores.
+
+    If `pad` is set (the "very_few_cpus" bypass), reuse the last CPU
+    if there are not enough of them at all.
+
+    Return a dictionary with the "groups" (service name to list of CPUs),
+    all the StorPool "cpus", the "idle" SMT siblings, the "rest" of the
+    CPUs, and the "smt_fallback" flag.
+    """
+    count = sum(svc['cpus'] for svc in services)
+    alloc = sptopology.allocate_cpus(topology, node, count)
+    smt_fallback = alloc is None
+    if smt_fallback:
+        local_cpus = topology['nodes'][node]
+        cpus = local_cpus + [cpu for cpu in sorted(set(all_cpus))
+                             if cpu not in local_cpus]
+        if pad:
+            cpus.extend([cpus[-1]] * (count + 1 - len(cpus)))
+        alloc = {'service': cpus[:count], 'idle': [], 'rest': cpus[count:]}
+
+    groups = {}
+    pos = 0
+    for svc in services:
+        if svc['shares'] is None:
+            groups[svc['name']] = alloc['service'][pos:pos + svc['cpus']]
+            pos += svc['cpus']
+    for svc in services:
+        if svc['shares'] is not None:
+            groups[svc['name']] = groups[svc['shares']]
+
+    return {
+        'groups': groups,
+        'cpus': sorted(set(alloc['service'])),
+        'idle': alloc['idle'],
+        'rest': sorted(set(alloc['rest'])),
+        'smt_fallback': smt_fallback,
+    }
+
+
+def required_cpus(services):
+    """
+    Return the minimum number of CPUs needed to run the planned services
+    and still leave one for the rest of the system.
+    """
+    return sum(svc['cpus'] for svc in services) + 1
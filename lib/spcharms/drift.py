@@ -0,0 +1,165 @@
+"""
+A StorPool Juju charm helper module: check whether the cgroup limits and
+the interrupt affinity set up by the charm are still in force and
+whether the hardware that they were planned for has changed.
+"""
+from __future__ import print_function
+
+import os
+
+from charmhelpers.core import unitdata
+
+from spcharms import cgapply as spcgapply
+from spcharms import sysutil as spsysutil
+from spcharms import topology as sptopology
+
+KV_KEY = 'storpool-common.drift.plan'
+KV_REPORTED = 'storpool-common.drift.reported'
+
+# The cgroup attributes that keep StorPool and the virtual machines apart;
+# the weights are not worth the extra reads.
+CHECK_ATTRS = (
+    'cpuset.cpus',
+    'cpuset.mems',
+    'memory.limit_in_bytes',
+    'memory.min',
+    'memory.max',
+    'memory.high',
+)
+
+
+def hardware(root='/'):
+    """
+    Take a cheap snapshot of the hardware that the plan depends on: the
+    online CPUs and NUMA nodes, the total memory and the block devices.
+    """
+    try:
+        with open(os.path.join(root, 'proc/meminfo'), mode='r') as f:
+            words = f.readline().split()
+        memory = words[1] if len(words) > 1 else None
+    except (IOError, OSError):
+        memory = None
+    try:
+        drives = sorted(name for name in
+                        os.listdir(os.path.join(root, 'sys/block'))
+                        if not sptopology.VIRTUAL_BLOCK_DEVICES.match(name))
+    except (IOError, OSError):
+        drives = []
+    return {
+        'cpus': spsysutil.read_line(
+            os.path.join(root, 'sys/devices/system/cpu/online')),
+        'nodes': spsysutil.read_line(
+            os.path.join(root, 'sys/devices/system/node/online')),
+        'memory': memory,
+        'drives': drives,
+    }
+
+
+def record(desired, irqs, hw, unset=()):
+    """
+    Remember the cgroup attributes (as returned by
+    spcharms.cgroups.desired_v1() or desired_v2()), the interrupt
+    affinity plan and the hardware snapshot to check against later.
+    The `unset` cgroups did not exist when the attributes were applied,
+    so their absence is not drift.
+    """
+    unitdata.kv().unset(KV_REPORTED)
+    unitdata.kv().set(KV_KEY, {
+        'cgroups': dict(
+            (path, [[attr, value] for (attr, value) in attrs
+                    if attr in CHECK_ATTRS])
+            for (path, attrs) in desired.items()),
+        'unset': sorted(unset),
+        'irqs': dict((str(irq), sptopology.format_cpulist(cpus))
+                     for (irq, cpus) in irqs.items()),
+        'hardware': hw,
+    })
+
+
+def recorded():
+    """
+    Return the last recorded plan, or None if there is none yet.
+    """
+    return unitdata.kv().get(KV_KEY)
+
+
+def check_cgroups(cached, unset=(), root=spcgapply.CGROUP_ROOT):
+    """
+    Compare the running cgroups with the recorded attributes, skipping
+    the `unset` ones that the charm never set up while they are still
+    missing.
+
+    Return a list of (path, attribute, wanted, current) tuples; the
+    attribute and the values are None for the missing cgroups.
+    """
+    res = []
+    for path in sorted(cached.keys()):
+        cgdir = os.path.join(root, path)
+        if not os.path.isdir(cgdir):
+            if path not in unset:
+                res.append((path, None, None, None))
+            continue
+        for (attr, value) in cached[path]:
+            current = spcgapply.read_attr(cgdir, attr)
+            if current is not None and \
+               spcgapply.normalize(attr, current) != \
+               spcgapply.normalize(attr, value):
+                res.append((path, attr, value, current))
+    return res
+
+
+def check_irqs(cached, root='/'):
+    """
+    Compare the affinity of the pinned interrupts with the recorded one.
+
+    Return a list of (irq, wanted, current) tuples; the current value
+    is None for the interrupts that have gone away.
+    """
+    res = []
+    for irq in sorted(cached.keys(), key=int):
+        current = spsysutil.read_line(os.path.join(
+            root, 'proc/irq', irq, 'smp_affinity_list'))
+        try:
+            if current is not None and \
+               sptopology.parse_cpulist(current) == \
+               sptopology.parse_cpulist(cached[irq]):
+                continue
+        except ValueError:
+            pass
+        res.append((int(irq), cached[irq], current))
+    return res
+
+
+def check(plan, root='/', cgroot=spcgapply.CGROUP_ROOT):
+    """
+    Check the recorded plan against the running system.
+
+    Return a dictionary with the "hardware" (the names of the changed
+    parts of the snapshot), "cgroups" and "irqs" (see check_cgroups()
+    and check_irqs()) lists.
+    """
+    current = hardware(root)
+    return {
+        'hardware': sorted(key for (key, value) in plan['hardware'].items()
+                           if current.get(key) != value),
+        'cgroups': check_cgroups(plan['cgroups'], plan.get('unset', []),
+                                 cgroot),
+        'irqs': check_irqs(plan['irqs'], root),
+    }
+
+
+def describe(result):
+    """
+    Summarize the cgroup and interrupt drift, or return None if there
+    is none.
+    """
+    parts = []
+    for (path, attr, wanted, current) in result['cgroups']:
+        if attr is None:
+            parts.append('{path} missing'.format(path=path))
+        else:
+            parts.append('{path} {attr}'.format(path=path, attr=attr))
+    if result['irqs']:
+        parts.append('IRQ affinity: {irqs}'.format(
+            irqs=','.join(str(irq) for (irq, _, _) in result['irqs'])))
+    return '; '.join(parts) if parts else None
@@ -0,0 +1,191 @@
+"""
+A StorPool Juju charm helper module: reserve hugepages for the StorPool
+services on the NUMA node that they run on.
+"""
+from __future__ import print_function
+
+import os
+
+from charmhelpers.core import unitdata
+
+from spcharms import sysutil as spsysutil
+
+# StorPool uses the default x86 hugepage size.
+HUGEPAGE_KB = 2048
+
+KV_KEY = 'storpool-common.hugepages'
+KV_SHORTFALL = 'storpool-common.hugepages.shortfall'
+
+SERVICE_NAME = 'storpool-hugepages.service'
+SERVICE_FILE = '/etc/systemd/system/' + SERVICE_NAME
+
+
+def pages(mb):
+    """
+    Return the number of hugepages needed to hold `mb` megabytes.
+    """
+    return -(-mb * 1024 // HUGEPAGE_KB)
+
+
+def plan(node, mb):
+    """
+    Return the per-NUMA-node StorPool hugepage reservation: all of it on
+    the node that the StorPool CPUs and memory are on.
+    """
+    count = pages(mb)
+    return {node: count} if count > 0 else {}
+
+
+def nr_path(node, root='/'):
+    """
+    Return the path of the sysfs file holding the number of hugepages
+    allocated on a NUMA node.
+    """
+    return os.path.join(root, 'sys/devices/system/node',
+                        'node{node}'.format(node=node), 'hugepages',
+                        'hugepages-{size}kB'.format(size=HUGEPAGE_KB),
+                        'nr_hugepages')
+
+
+def write_nr(path, count):
+    """
+    Ask the kernel to allocate `count` hugepages, ignoring any errors;
+    the result is checked by reading the value back.
+    """
+    try:
+        with open(path, mode='w') as f:
+            f.write('{count}\n'.format(count=count))
+    except (IOError, OSError):
+        pass
+
+
+def compact_memory(root='/'):
+    """
+    Ask the kernel to defragment the memory so that more hugepages may be
+    allocated.
+    """
+    write_nr(os.path.join(root, 'proc/sys/vm/compact_memory'), 1)
+
+
+def total_mb(root='/'):
+    """
+    Return the memory currently allocated as hugepages of any size in
+    megabytes.
+    """
+    hpdir = os.path.join(root, 'sys/kernel/mm/hugepages')
+    try:
+        names = os.listdir(hpdir)
+    except (IOError, OSError):
+        return 0
+    res = 0
+    for name in names:
+        if not (name.startswith('hugepages-') and name.endswith('kB')):
+            continue
+        count = spsysutil.read_int(os.path.join(hpdir, name, 'nr_hugepages'))
+        if count is not None:
+            res += count * int(name[len('hugepages-'):-len('kB')])
+    return res // 1024
+
+
+def recorded():
+    """
+    Return the hugepages that the charm has already reserved, per node.
+    """
+    return dict((int(node), count) for (node, count)
+                in (unitdata.kv().get(KV_KEY) or {}).items())
+
+
+def recorded_mb():
+    """
+    Return the total size of the hugepages already reserved by the charm
+    in megabytes.
+    """
+    return sum(recorded().values()) * HUGEPAGE_KB // 1024
+
+
+def apply(reservation, root='/'):
+    """
+    Adjust the hugepage counts of the NUMA nodes so that StorPool gets
+    the `reservation` number of pages on each node, leaving the hugepages
+    allocated by others alone and releasing the charm's ones from the
+    nodes that are no longer in the reservation.
+
+    Return a dictionary mapping the node numbers to dictionaries with
+    the "wanted" and "got" numbers of pages.
+    """
+    previous = recorded()
+    res = {}
+    got_all = {}
+    for node in sorted(set(reservation.keys()) | set(previous.keys())):
+        wanted = reservation.get(node, 0)
+        path = nr_path(node, root)
+        current = spsysutil.read_int(path)
+        if current is None:
+            res[node] = {'wanted': wanted, 'got': 0}
+            continue
+        baseline = max(0, current - previous.get(node, 0))
+        target = baseline + wanted
+        if current != target:
+            write_nr(path, target)
+            current = spsysutil.read_int(path)
+            if current is not None and current < target:
+                compact_memory(root)
+                write_nr(path, target)
+                current = spsysutil.read_int(path)
+        got = (0 if current is None
+               else max(0, min(wanted, current - baseline)))
+        res[node] = {'wanted': wanted, 'got': got}
+        if got > 0:
+            got_all[node] = got
+    unitdata.kv().set(KV_KEY, got_all)
+    return res
+
+
+def release(root='/'):
+    """
+    Give back the hugepages reserved by the charm, leaving the node
+    counts at what they were before, plus any pages allocated by others
+    in the meantime.
+    """
+    return apply({}, root)
+
+
+def shortfall(result):
+    """
+    Describe the nodes on which the kernel could not allocate all the
+    hugepages, or return None if everything was allocated.
+    """
+    short = ['node {node}: {got} of {wanted} MB'.format(
+                node=node,
+                got=data['got'] * HUGEPAGE_KB // 1024,
+                wanted=data['wanted'] * HUGEPAGE_KB // 1024)
+             for (node, data) in sorted(result.items())
+             if data['got'] < data['wanted']]
+    return '; '.join(short) if short else None
+
+
+def others(node, root='/'):
+    """
+    Return the number of hugepages on a NUMA node that were not allocated
+    by the charm.
+    """
+    current = spsysutil.read_int(nr_path(node, root))
+    if current is None:
+        return 0
+    return max(0, current - recorded().get(node, 0))
+
+
+def unit_context(reservation, root='/'):
+    """
+    Build the template context for the boot-time hugepage reservation
+    service: the absolute per-node count of the hugepages allocated by
+    others plus the StorPool ones, so that starting the service again
+    does not allocate any more.
+    """
+    return {
+        'hugepages': [
+            {'node': node, 'pages': count, 'path': nr_path(node),
+             'target': others(node, root) + count}
+            for (node, count) in sorted(reservation.items())
+        ],
+    }
@@ -0,0 +1,163 @@
+"""
+A StorPool Juju charm helper module: collect the hardware facts that the
+charm plans the StorPool configuration from once and keep them in the
+unit data until the hardware changes.
+"""
+from __future__ import print_function
+
+import hashlib
+import os
+
+from charmhelpers.core import unitdata
+
+from spcharms import drift as spdrift
+from spcharms import sysutil as spsysutil
+from spcharms import topology as sptopology
+
+KV_KEY = 'storpool-common.inventory'
+
+
+def stat_mtime(path):
+    """
+    Return the modification time of a file, or None if it is missing.
+    """
+    try:
+        return os.stat(path).st_mtime
+    except (IOError, OSError):
+        return None
+
+
+def list_dir(path):
+    """
+    Return the sorted entries of a directory, or an empty list if it is
+    missing.
+    """
+    try:
+        return sorted(os.listdir(path))
+    except (IOError, OSError):
+        return []
+
+
+def block_holders(root='/'):
+    """
+    Map all the block devices and their partitions to the devices that
+    are stacked on top of them (e.g. device mapper or MD ones).
+    """
+    blockdir = os.path.join(root, 'sys/block')
+    res = {}
+    for name in list_dir(blockdir):
+        devdir = os.path.join(blockdir, name)
+        for part in [name] + [entry for entry in list_dir(devdir)
+                              if entry.startswith(name)]:
+            path = devdir if part == name else os.path.join(devdir, part)
+            res[part] = list_dir(os.path.join(path, 'holders'))
+    return res
+
+
+def mounts_digest(root='/'):
+    """
+    Return a digest of the mounted filesystems and the active swap areas.
+    """
+    digest = hashlib.sha256()
+    for path in ('proc/mounts', 'proc/swaps'):
+        text = spsysutil.read_text(os.path.join(root, path)) or ''
+        digest.update(text.encode('UTF-8'))
+    return digest.hexdigest()
+
+
+def fingerprint(root='/'):
+    """
+    Take a cheap fingerprint of the facts that the inventory depends on:
+    the boot, the online CPUs and NUMA nodes, the total memory and the
+    block devices (see spcharms.drift.hardware()), the devices stacked
+    on them and the mounts that decide which ones are free, and the
+    StorPool configuration that names the network interfaces.
+    """
+    res = spdrift.hardware(root=root)
+    res.update({
+        'boot_id': spsysutil.read_line(
+            os.path.join(root, 'proc/sys/kernel/random/boot_id')),
+        'holders': block_holders(root),
+        'mounts': mounts_digest(root),
+        'storpool_conf': [
+            stat_mtime(os.path.join(root, path))
+            for path in ('etc/storpool.conf', 'etc/storpool.conf.d')
+        ],
+    })
+    return res
+
+
+def parse_cpuinfo(lines):
+    """
+    Return the sorted numbers of the processors listed in /proc/cpuinfo.
+    """
+    res = []
+    for line in lines:
+        if line.startswith('processor'):
+            words = line.split()
+            if len(words) > 2 and words[2].isdigit():
+                res.append(int(words[2]))
+    return sorted(res)
+
+
+def collect(root='/'):
+    """
+    Collect the hardware facts.
+
+    Return a dictionary with the "cmdline" (the kernel command line),
+    "cpus" (the processor numbers), "mem_total" (the /proc/meminfo
+    MemTotal (value, unit) pair, or None) and "topology" (see
+    spcharms.topology.get_topology()) keys.
+    """
+    with open(os.path.join(root, 'proc/cmdline'), mode='r') as f:
+        cmdline = f.readline()
+    with open(os.path.join(root, 'proc/cpuinfo'), mode='r') as f:
+        cpus = parse_cpuinfo(f)
+    mem_total = None
+    with open(os.path.join(root, 'proc/meminfo'), mode='r') as f:
+        for line in f:
+            words = line.split()
+            if len(words) > 1 and words[0] == 'MemTotal:':
+                mem_total = (int(words[1]),
+                             words[2] if len(words) > 2 else '')
+                break
+    return {
+        'cmdline': cmdline,
+        'cpus': cpus,
+        'mem_total': mem_total,
+        'topology': sptopology.get_topology(cpus, root=root),
+    }
+
+
+def restore(inventory):
+    """
+    Undo the conversion of the integer keys and the tuples done when
+    storing the inventory in the unit data.
+    """
+    topology = dict(inventory['topology'])
+    topology['nodes'] = dict((int(node), cpus) for (node, cpus)
+                             in topology['nodes'].items())
+    mem_total = inventory['mem_total']
+    return dict(
+        inventory,
+        mem_total=None if mem_total is None else tuple(mem_total),
+        topology=topology,
+    )
+
+
+def load(root='/'):
+    """
+    Return the hardware facts, collecting them anew only if the
+    fingerprint has changed since they were last stored.
+
+    Return a tuple with the inventory and a flag whether it was cached.
+    """
+    fprint = fingerprint(root)
+    kv = unitdata.kv()
+    cached = kv.get(KV_KEY)
+    if cached is not None and cached['fingerprint'] == fprint:
+        return (restore(cached['inventory']), True)
+
+    inventory = collect(root)
+    kv.set(KV_KEY, {'fingerprint': fprint, 'inventory': inventory})
+    return (restore(kv.get(KV_KEY)['inventory']), False)
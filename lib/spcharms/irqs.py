@@ -0,0 +1,273 @@
+"""
+A StorPool Juju charm helper module: pin the interrupts of the StorPool
+network interfaces and NVMe drives to the StorPool CPUs.
+"""
+from __future__ import print_function
+
+import os
+import re
+
+from charmhelpers.core import unitdata
+
+from spcharms import cgroups as spcgroups
+from spcharms import sysutil as spsysutil
+from spcharms import topology as sptopology
+
+IRQBALANCE_DROPIN = os.path.join(spcgroups.SYSTEMD_DIR,
+                                 'irqbalance.service.d',
+                                 spcgroups.DROPIN_NAME)
+
+# The irqbalance environment file; systemd lets the variables read from
+# it override the ones set in the drop-in.
+IRQBALANCE_DEFAULTS = '/etc/default/irqbalance'
+IRQBALANCE_VARS = ('IRQBALANCE_BANNED_CPUS', 'IRQBALANCE_BANNED_CPULIST',
+                   'IRQBALANCE_ARGS')
+
+RE_NVME_CTRL = re.compile(r'^(nvme\d+)')
+
+KV_KEY = 'storpool-common.irqs.foreign'
+KV_ORIGINAL = 'storpool-common.irqs.original'
+
+
+def parse_interrupts(lines):
+    """
+    Parse the lines of /proc/interrupts.
+
+    Return a dictionary with the "cpus" (the CPU numbers of the columns)
+    and "irqs" keys, the latter mapping the numbers of the device IRQs
+    to dictionaries with the "name" (the last word of the description)
+    and "line" keys.  The counters are only split out of the line when
+    needed, since there may be thousands of columns on large hosts.
+    """
+    res = {'cpus': [], 'irqs': {}}
+    if not lines:
+        return res
+    res['cpus'] = [int(word[3:]) for word in lines[0].split()
+                   if word.startswith('CPU')]
+    for line in lines[1:]:
+        (irq, sep, rest) = line.partition(':')
+        irq = irq.strip()
+        if not sep or not irq.isdigit():
+            continue
+        words = rest.rsplit(None, 1)
+        res['irqs'][int(irq)] = {
+            'name': words[-1] if words else '',
+            'line': rest,
+        }
+    return res
+
+
+def irq_counts(data, columns):
+    """
+    Return the counters of an interrupt in the specified columns of
+    /proc/interrupts.
+    """
+    if not columns:
+        return []
+    words = data['line'].split(None, max(columns) + 1)
+    return [int(words[idx]) for idx in columns if idx < len(words) and
+            words[idx].isdigit()]
+
+
+def read_interrupts(root='/'):
+    """
+    Read and parse /proc/interrupts.
+    """
+    try:
+        with open(os.path.join(root, 'proc/interrupts'), mode='r') as f:
+            return parse_interrupts(f.readlines())
+    except (IOError, OSError):
+        return parse_interrupts([])
+
+
+def msi_irqs(devdir):
+    """
+    Return the MSI/MSI-X interrupts of a PCI device.
+    """
+    try:
+        return sorted(int(name) for name in
+                      os.listdir(os.path.join(devdir, 'msi_irqs'))
+                      if name.isdigit())
+    except (IOError, OSError):
+        return []
+
+
+def named_irqs(interrupts, pattern):
+    """
+    Return the interrupts whose names match a regular expression.
+    """
+    return sorted(irq for (irq, data) in interrupts['irqs'].items()
+                  if pattern.match(data['name']))
+
+
+def nic_irqs(iface, interrupts, root='/'):
+    """
+    Return the interrupts of a network interface: the MSI ones of its
+    PCI device or, failing that, the ones named after it.
+    """
+    res = msi_irqs(os.path.join(root, 'sys/class/net', iface, 'device'))
+    if res:
+        return res
+    return named_irqs(interrupts,
+                      re.compile(r'^{iface}(?:$|[-@])'
+                                 .format(iface=re.escape(iface))))
+
+
+def nvme_irqs(drive, interrupts, root='/'):
+    """
+    Return the interrupts of the controller of an NVMe namespace.
+    """
+    m = RE_NVME_CTRL.match(drive)
+    if m is None:
+        return []
+    ctrl = m.group(1)
+    res = msi_irqs(os.path.join(root, 'sys/class/nvme', ctrl, 'device'))
+    if res:
+        return res
+    return named_irqs(interrupts,
+                      re.compile(r'^{ctrl}q\d+$'.format(ctrl=ctrl)))
+
+
+def spread(irqs, cpus):
+    """
+    Distribute the interrupts over the CPUs, one CPU each.
+    """
+    if not cpus:
+        return {}
+    return dict((irq, [cpus[idx % len(cpus)]])
+                for (idx, irq) in enumerate(sorted(irqs)))
+
+
+def plan_irqs(topology, cpu_plan, interrupts, root='/'):
+    """
+    Pin the interrupts of the StorPool network interfaces to the CPUs of
+    the RDMA service and the ones of the StorPool NVMe drives to the
+    CPUs of the server instances, or to all the StorPool CPUs if there
+    are no servers.
+
+    Return a dictionary mapping the interrupt numbers to CPU lists.
+    """
+    groups = cpu_plan['groups']
+    server_cpus = sorted(set(
+        cpu for (name, cpus) in groups.items() if name.startswith('server')
+        for cpu in cpus))
+
+    nics = set()
+    for iface in sorted(topology['ifaces']):
+        nics.update(nic_irqs(iface, interrupts, root))
+    drives = set()
+    for drive in sorted(topology['drives']):
+        drives.update(nvme_irqs(drive, interrupts, root))
+    drives.difference_update(nics)
+
+    res = spread(nics, groups.get('rdma') or cpu_plan['cpus'])
+    res.update(spread(drives, server_cpus or cpu_plan['cpus']))
+    return res
+
+
+def recorded():
+    """
+    Return the original affinity (a CPU list string) of the interrupts
+    pinned by the charm.
+    """
+    return dict((int(irq), cpus) for (irq, cpus)
+                in (unitdata.kv().get(KV_ORIGINAL) or {}).items())
+
+
+def apply(plan, root='/'):
+    """
+    Set the affinity of the planned interrupts, only writing the ones
+    that differ, restoring the original affinity of the ones that are
+    no longer planned and remembering the original affinity of the new
+    ones.
+
+    Return a dictionary with the "changed" ((irq, old, new) tuples) and
+    "errors" ((irq, message) tuples, e.g. for the kernel-managed
+    interrupts that may not be moved) lists.
+    """
+    res = {'changed': [], 'errors': []}
+    original = recorded()
+    wanted = dict((irq, sptopology.parse_cpulist(cpus))
+                  for (irq, cpus) in original.items() if irq not in plan)
+    wanted.update(plan)
+    kept = {}
+    for (irq, cpus) in sorted(wanted.items()):
+        path = os.path.join(root, 'proc/irq', str(irq), 'smp_affinity_list')
+        value = sptopology.format_cpulist(cpus)
+        try:
+            with open(path, mode='r') as f:
+                current = f.readline().strip()
+            if irq in plan:
+                kept[irq] = original.get(irq, current)
+            if sptopology.parse_cpulist(current) == sorted(cpus):
+                continue
+            with open(path, mode='w') as f:
+                f.write(value + '\n')
+        except (IOError, OSError, ValueError) as e:
+            res['errors'].append((irq, str(e)))
+            continue
+        res['changed'].append((irq, current, value))
+    unitdata.kv().set(KV_ORIGINAL, dict((str(irq), cpus)
+                                        for (irq, cpus) in kept.items()))
+    return res
+
+
+def restore(root='/'):
+    """
+    Restore the original affinity of all the interrupts pinned by the
+    charm.
+    """
+    return apply({}, root)
+
+
+def irqbalance_context(cpus, irqs):
+    """
+    Build the template context for the irqbalance drop-in that keeps it
+    off the StorPool CPUs and the pinned interrupts.
+    """
+    return {
+        'banned_cpulist': sptopology.format_cpulist(cpus),
+        'banned_cpumask': spsysutil.format_cpumask(cpus),
+        'banned_irqs': sorted(irqs),
+    }
+
+
+def irqbalance_overrides(root='/'):
+    """
+    List the variables of the irqbalance drop-in that the irqbalance
+    environment file also sets, so that the drop-in ones are ignored.
+    """
+    text = spsysutil.read_text(
+        os.path.join(root, IRQBALANCE_DEFAULTS.lstrip('/'))) or ''
+    found = set()
+    for line in text.split('\n'):
+        line = line.strip()
+        if line.startswith('export '):
+            line = line[len('export '):].lstrip()
+        if '=' in line:
+            found.add(line.split('=', 1)[0].strip())
+    return [name for name in IRQBALANCE_VARS if name in found]
+
+
+def foreign_interrupts(interrupts, cpus, own):
+    """
+    Count the interrupts handled by the specified CPUs that do not
+    belong to the `own` interrupts.
+    """
+    columns = [idx for (idx, cpu) in enumerate(interrupts['cpus'])
+               if cpu in cpus]
+    return sum(sum(irq_counts(data, columns))
+               for (irq, data) in interrupts['irqs'].items()
+               if irq not in own)
+
+
+def foreign_rate(count, now):
+    """
+    Compute the rate of the foreign interrupts on the StorPool CPUs since
+    the previous check, if any, and remember the current count.
+    """
+    prev = unitdata.kv().get(KV_KEY)
+    unitdata.kv().set(KV_KEY, {'time': now, 'count': count})
+    if prev is None or now <= prev['time'] or count < prev['count']:
+        return None
+    return (count - prev['count']) / (now - prev['time'])
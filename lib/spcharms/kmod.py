@@ -0,0 +1,76 @@
+"""
+A StorPool Juju charm helper module: only rebuild the kernel module
+dependencies when the StorPool kernel modules have actually changed.
+"""
+from __future__ import print_function
+
+import glob
+import os
+import subprocess
+
+from charmhelpers.core import unitdata
+
+from spcharms import manifest as spmanifest
+
+KV_PREFIX = 'storpool-common.depmod.'
+
+
+def module_files(package, root='/'):
+    """
+    Return the kernel module files installed by a Debian package,
+    as listed in the dpkg database.
+    """
+    infodir = os.path.join(root, 'var/lib/dpkg/info')
+    lists = glob.glob(os.path.join(infodir, package + '.list')) + \
+        glob.glob(os.path.join(infodir, package + ':*.list'))
+    res = set()
+    for fname in lists:
+        with open(fname, mode='r') as f:
+            for line in f:
+                path = line.strip()
+                name = os.path.basename(path)
+                if name.endswith('.ko') or '.ko.' in name:
+                    res.add(path)
+    return sorted(res)
+
+
+def fingerprint(files, root='/'):
+    """
+    Describe the modification time, size and contents of the kernel
+    module files.
+    """
+    res = {}
+    for path in files:
+        fname = os.path.join(root, path.lstrip('/'))
+        try:
+            st = os.stat(fname)
+        except (IOError, OSError):
+            res[path] = None
+            continue
+        res[path] = [int(st.st_mtime), st.st_size,
+                     spmanifest.file_digest(fname)]
+    return res
+
+
+def depmod_needed(release, package, root='/'):
+    """
+    Check whether the module dependencies for the `release` kernel need
+    to be rebuilt because the modules installed by `package` have changed
+    since the last run or the dependency file is missing.
+
+    Return a (needed, fingerprint) tuple.
+    """
+    fprint = fingerprint(module_files(package, root), root)
+    if unitdata.kv().get(KV_PREFIX + release) != fprint:
+        return (True, fprint)
+    depfile = os.path.join(root, 'lib/modules', release, 'modules.dep')
+    return (not os.path.exists(depfile), fprint)
+
+
+def depmod(release, fprint):
+    """
+    Rebuild the module dependencies for the `release` kernel only and
+    remember the fingerprint of the StorPool modules.
+    """
+    subprocess.check_call(['depmod', '-a', release])
+    unitdata.kv().set(KV_PREFIX + release, fprint)
@@ -0,0 +1,50 @@
+"""
+A StorPool Juju charm helper module: keep track of the contents of the
+files installed by the charm so that unchanged ones are not reinstalled.
+"""
+from __future__ import print_function
+
+import hashlib
+
+from charmhelpers.core import unitdata
+
+KV_PREFIX = 'storpool-common.manifest.'
+
+
+def digest(data):
+    """
+    Compute the content hash of a string or a bytes object.
+    """
+    if not isinstance(data, bytes):
+        data = data.encode('UTF-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    """
+    Compute the content hash of a file, return None if it cannot be read.
+    """
+    try:
+        with open(path, mode='rb') as f:
+            return digest(f.read())
+    except (IOError, OSError):
+        return None
+
+
+def up_to_date(dst, content_digest, mode):
+    """
+    Check whether the charm has already installed a file with the same
+    contents and permissions as `dst` and it has not been modified since.
+    """
+    entry = unitdata.kv().get(KV_PREFIX + dst)
+    if entry != {'digest': content_digest, 'mode': mode}:
+        return False
+    return file_digest(dst) == content_digest
+
+
+def record(dst, content_digest, mode):
+    """
+    Record the contents and permissions of a file that was just installed.
+    """
+    unitdata.kv().set(KV_PREFIX + dst,
+                      {'digest': content_digest, 'mode': mode})
@@ -0,0 +1,161 @@
+"""
+A StorPool Juju charm helper module: split the host memory between the
+kernel, the system, StorPool and the virtual machines.
+"""
+from __future__ import print_function
+
+from charmhelpers.core import unitdata
+
+from spcharms import cpuplan as spcpuplan
+from spcharms import sysutil as spsysutil
+
+KV_KEY = 'storpool-common.memory-plan'
+
+DEFAULTS = {
+    'memory_system': 4096,
+    'memory_user': 4096,
+    'memory_kernel_min': 2048,
+    'memory_kernel_percent': 4,
+    'memory_kernel_max': 10240,
+    'storpool_memory_base': 1024,
+    'storpool_memory_per_nic': 128,
+    'storpool_memory_per_server': 2048,
+    'storpool_memory_per_tb': 256,
+    'storpool_hugepages_base': 256,
+    'storpool_hugepages_per_server': 1024,
+}
+
+# The fixed sizes used with the "very_little_memory" bypass.
+LITTLE_MEMORY = {
+    'system': 1900,
+    'user': 512,
+    'storpool': 1024,
+    'kernel': 512,
+    'sp_hugepages': 256,
+}
+
+TB = 1024 * 1024 * 1024 * 1024
+
+
+def setting(config, name):
+    """
+    Fetch a memory planner setting, falling back to the default value.
+    """
+    return spcpuplan.config_int(config, name, DEFAULTS[name])
+
+
+def parse_meminfo(lines):
+    """
+    Parse the lines of /proc/meminfo into a dictionary of (value, unit)
+    tuples; the unit is an empty string for page counts.
+    """
+    res = {}
+    for line in lines:
+        words = line.split()
+        if len(words) < 2 or not words[0].endswith(':'):
+            continue
+        try:
+            value = int(words[1])
+        except ValueError:
+            continue
+        res[words[0][:-1]] = (value, words[2] if len(words) > 2 else '')
+    return res
+
+
+def meminfo_mb(meminfo, name):
+    """
+    Return a /proc/meminfo size value in megabytes.
+    """
+    (value, unit) = meminfo[name]
+    unit = unit.upper()
+    if unit.startswith('K'):
+        return int(value / 1024)
+    elif unit.startswith('M'):
+        return value
+    elif unit.startswith('G'):
+        return value * 1024
+    raise ValueError('Could not parse the "{u}" unit for {name} in '
+                     '/proc/meminfo'.format(u=unit, name=name))
+
+
+def hugepages_mb(meminfo):
+    """
+    Return the amount of memory reserved for hugepages in megabytes.
+    """
+    if 'HugePages_Total' not in meminfo or 'Hugepagesize' not in meminfo:
+        return 0
+    return meminfo['HugePages_Total'][0] * meminfo_mb(meminfo, 'Hugepagesize')
+
+
+def plan_memory(mem_total, hugepages, topology, services, config,
+                little=False):
+    """
+    Compute the memory limits (in megabytes) of the system, user,
+    StorPool and machine slices and the amount left to the kernel,
+    based on the total memory, the memory reserved for hugepages, the
+    StorPool drives and interfaces, and the planned StorPool `services`.
+    The `hugepages` value should not include the StorPool hugepages,
+    since they are planned here, too.
+
+    If `little` is set (the "very_little_memory" bypass), use small fixed
+    sizes instead.
+
+    Return a dictionary with the "total", "hugepages", "kernel",
+    "system", "user", "storpool", "sp_hugepages" (the hugepages to reserve
+    for StorPool), and "machine" keys; the latter may be zero or negative
+    if there is not enough memory.
+    """
+    if little:
+        res = dict(LITTLE_MEMORY)
+    else:
+        nics = len(topology['ifaces'])
+        servers = len([svc for svc in services
+                       if svc['name'].startswith('server')])
+        capacity = sum(topology.get('drive_sizes', {}).values())
+        storpool = setting(config, 'storpool_memory_base') + \
+            nics * setting(config, 'storpool_memory_per_nic') + \
+            servers * setting(config, 'storpool_memory_per_server') + \
+            -(-capacity * setting(config, 'storpool_memory_per_tb') // TB)
+        # The kernel's own needs grow much slower than the memory.
+        kernel = spsysutil.clamp(
+            mem_total * setting(config, 'memory_kernel_percent') // 100,
+            setting(config, 'memory_kernel_min'),
+            setting(config, 'memory_kernel_max'))
+        res = {
+            'system': setting(config, 'memory_system'),
+            'user': setting(config, 'memory_user'),
+            'storpool': storpool,
+            'kernel': kernel,
+            'sp_hugepages': setting(config, 'storpool_hugepages_base') +
+            servers * setting(config, 'storpool_hugepages_per_server'),
+        }
+
+    res.update({'total': mem_total, 'hugepages': hugepages})
+    res['reserved'] = res['system'] + res['user'] + res['storpool'] + \
+        res['kernel'] + hugepages + res['sp_hugepages']
+    res['machine'] = mem_total - res['reserved']
+    return res
+
+
+def format_plan(plan):
+    """
+    Describe a memory plan in a single line.
+    """
+    return 'total {total}M: kernel {kernel}M, system {system}M, ' \
+           'user {user}M, storpool {storpool}M, storpool hugepages ' \
+           '{sp_hugepages}M, other hugepages {hugepages}M, ' \
+           'machine {machine}M'.format(**plan)
+
+
+def record(plan):
+    """
+    Remember the memory plan for the handlers that run later.
+    """
+    unitdata.kv().set(KV_KEY, plan)
+
+
+def recorded():
+    """
+    Return the last memory plan, or None if there is none yet.
+    """
+    return unitdata.kv().get(KV_KEY)
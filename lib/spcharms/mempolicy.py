@@ -0,0 +1,122 @@
+"""
+A StorPool Juju charm helper module: set the transparent hugepage
+defragmentation, KSM scanning and automatic NUMA balancing policy for
+the role of the node, so that the kernel's background memory work does
+not stall the StorPool services.
+"""
+from __future__ import print_function
+
+import os
+
+from spcharms import sysutil as spsysutil
+
+KV_KEY = 'storpool-common.mempolicy'
+
+SERVICE_NAME = 'storpool-mempolicy.service'
+SERVICE_FILE = '/etc/systemd/system/' + SERVICE_NAME
+DESCRIPTION = 'Set the memory management policy for the StorPool node role'
+
+ROLE_AUTO = 'auto'
+ROLE_STORAGE = 'storage'
+ROLE_COMPUTE = 'compute'
+ROLE_HYPERCONVERGED = 'hyperconverged'
+ROLES = (ROLE_STORAGE, ROLE_COMPUTE, ROLE_HYPERCONVERGED)
+
+# The storpool.conf settings of the StorPool server instances: the cache
+# size of the single one or of each of several ones.
+SERVER_KEYS = ('SP_CACHE_SIZE', 'SP_SERVER')
+
+THP_DEFRAG = 'sys/kernel/mm/transparent_hugepage/defrag'
+KHUGEPAGED_DEFRAG = 'sys/kernel/mm/transparent_hugepage/khugepaged/defrag'
+KSM_RUN = 'sys/kernel/mm/ksm/run'
+KSM_PAGES = 'sys/kernel/mm/ksm/pages_to_scan'
+KSM_SLEEP = 'sys/kernel/mm/ksm/sleep_millisecs'
+NUMA_BALANCING = 'proc/sys/kernel/numa_balancing'
+
+# The settings for each role; a list of values means the first one that
+# the kernel offers.  Only the madvise()d memory (e.g. the guests' one)
+# is ever compacted synchronously, KSM only scans the memory that QEMU
+# marks as mergeable, and there is no way to keep the NUMA balancing
+# hinting faults out of the StorPool processes, so it is only left on
+# for the virtual machines on the pure compute nodes.  KSM scans at
+# most 500 pages a second (a tenth of the kernel's default rate), and
+# not any faster on the compute nodes than on the hyperconverged ones.
+POLICIES = {
+    ROLE_STORAGE: [
+        (THP_DEFRAG, ['madvise', 'never']),
+        (KHUGEPAGED_DEFRAG, '0'),
+        (KSM_RUN, '0'),
+        (NUMA_BALANCING, '0'),
+    ],
+    ROLE_COMPUTE: [
+        (THP_DEFRAG, ['defer+madvise', 'madvise']),
+        (KHUGEPAGED_DEFRAG, '1'),
+        (KSM_RUN, '1'),
+        (KSM_PAGES, '100'),
+        (KSM_SLEEP, '200'),
+        (NUMA_BALANCING, '1'),
+    ],
+    ROLE_HYPERCONVERGED: [
+        (THP_DEFRAG, ['defer+madvise', 'madvise']),
+        (KHUGEPAGED_DEFRAG, '0'),
+        (KSM_RUN, '1'),
+        (KSM_PAGES, '100'),
+        (KSM_SLEEP, '200'),
+        (NUMA_BALANCING, '0'),
+    ],
+}
+
+
+def server_configured(conf):
+    """
+    Check whether the parsed StorPool configuration of this node (see
+    topology.parse_storpool_conf()) sets up any StorPool server
+    instances.
+    """
+    return any(key.startswith(SERVER_KEYS) for key in conf)
+
+
+def node_role(role, conf, root='/'):
+    """
+    Resolve the configured node role: on "auto" (or unset), a node that
+    the StorPool configuration sets up a server on is a storage one, or
+    a hyperconverged one if it can also run virtual machines, and any
+    other node is a compute one.
+
+    Raise ValueError for an invalid role.
+    """
+    if role is None or role == '' or role == ROLE_AUTO:
+        if not server_configured(conf):
+            return ROLE_COMPUTE
+        if os.path.exists(os.path.join(root, 'dev/kvm')):
+            return ROLE_HYPERCONVERGED
+        return ROLE_STORAGE
+    if role not in ROLES:
+        raise ValueError('Invalid "storpool_node_role" value "{role}"'
+                         .format(role=role))
+    return role
+
+
+def plan(role, root='/'):
+    """
+    Plan the memory policy settings for the node role, skipping the ones
+    that the kernel does not support.
+
+    Return a dictionary mapping the sysfs and procfs paths (relative to
+    the root directory) to the values to write to them (see
+    settings.apply()).
+    """
+    res = {}
+    for (path, value) in POLICIES[role]:
+        full = os.path.join(root, path)
+        if not os.path.exists(full):
+            continue
+        if isinstance(value, list):
+            available = spsysutil.parse_choices(
+                spsysutil.read_line(full))[1]
+            value = next((choice for choice in value
+                          if choice in available), None)
+            if value is None:
+                continue
+        res[path] = value
+    return res
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+"""
+A StorPool Juju charm helper module: tune the ring buffers, the interrupt
+coalescing and the RPS/XPS masks of the StorPool network interfaces.
+
+The charm also installs this file as a standalone program that the
+network configuration hooks run to reapply the settings when a link
+comes up, so it must only use the Python standard library.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROGRAM = '/usr/lib/storpool-common/storpool-nic-tune'
+SETTINGS_FILE = '/etc/storpool-common/nic-tuning.json'
+
+# The programs of the network configuration tools and the hooks that
+# they run when a link comes up; ifupdown and networkd-dispatcher both
+# pass the interface name in $IFACE.
+HOOK_TOOLS = (
+    ('/sbin/ifup', (
+        '/etc/network/if-up.d/storpool-nic-tune',
+    )),
+    ('/usr/bin/networkd-dispatcher', (
+        '/etc/networkd-dispatcher/carrier.d/50-storpool-nic-tune',
+        '/etc/networkd-dispatcher/routable.d/50-storpool-nic-tune',
+    )),
+)
+HOOKS = tuple(path for (_, paths) in HOOK_TOOLS for path in paths)
+
+ETHTOOL = 'ethtool'
+
+# Large enough to absorb the bursts without dropping packets, small
+# enough to keep the queueing latency and the cache footprint in check.
+RING_SIZE = 4096
+
+# Interrupt coalescing for low latency: fire within a few microseconds
+# instead of letting the adaptive algorithm trade latency for throughput.
+COALESCE = [
+    ('adaptive-rx', 'off'),
+    ('adaptive-tx', 'off'),
+    ('rx-usecs', '8'),
+    ('tx-usecs', '8'),
+]
+
+
+def hooks(root='/'):
+    """
+    Return the hooks of the network configuration tools installed on the
+    host.
+    """
+    return [path for (program, paths) in HOOK_TOOLS
+            if os.path.exists(os.path.join(root, program.lstrip('/')))
+            for path in paths]
+
+
+def parse_rings(output):
+    """
+    Parse the output of "ethtool -g".
+
+    Return a tuple with the maximum and the current sizes of the "rx"
+    and "tx" rings.
+    """
+    res = ({}, {})
+    idx = None
+    for line in output.split('\n'):
+        if line.startswith('Pre-set maximums'):
+            idx = 0
+        elif line.startswith('Current hardware settings'):
+            idx = 1
+        elif idx is not None and ':' in line:
+            (key, value) = line.split(':', 1)
+            key = key.strip().lower()
+            if key in ('rx', 'tx') and value.strip().isdigit():
+                res[idx][key] = int(value)
+    return res
+
+
+def parse_coalesce(output):
+    """
+    Parse the output of "ethtool -c" into a dictionary mapping the
+    "ethtool -C" parameter names to the current values; the parameters
+    that the driver does not support are left out.
+    """
+    res = {}
+    for line in output.split('\n'):
+        if line.startswith('Adaptive '):
+            words = line.replace(':', ' ').split()
+            for (key, value) in zip(words[1::2], words[2::2]):
+                if value in ('on', 'off'):
+                    res['adaptive-' + key.lower()] = value
+        elif ':' in line:
+            (key, value) = line.split(':', 1)
+            value = value.strip()
+            if value.isdigit():
+                res[key.strip()] = value
+    return res
+
+
+def cpu_mask(cpus):
+    """
+    Format a CPU list as a sysfs bitmask: comma-separated 32-bit groups
+    of hexadecimal digits.
+    """
+    value = sum(1 << cpu for cpu in set(cpus))
+    words = []
+    while value or not words:
+        words.append('{:08x}'.format(value & 0xffffffff))
+        value >>= 32
+    return ','.join(reversed(words))
+
+
+def parse_mask(value):
+    """
+    Parse a sysfs bitmask into a set of CPUs.
+    """
+    value = int(value.replace(',', '') or '0', 16)
+    return set(cpu for cpu in range(value.bit_length()) if value & (1 << cpu))
+
+
+def plan(ifaces, cpus):
+    """
+    Plan the tuning of the StorPool network interfaces for the CPUs that
+    serve them.
+
+    Return a dictionary mapping the interface names to dictionaries with
+    the "ring" (the wanted ring size, capped by the hardware maximum),
+    "coalesce" (a list of [parameter, value] pairs) and "cpus" keys.
+    """
+    return dict(
+        (iface, {
+            'ring': RING_SIZE,
+            'coalesce': [[key, value] for (key, value) in COALESCE],
+            'cpus': sorted(cpus),
+        })
+        for iface in sorted(ifaces)
+    )
+
+
+def ethtool(args, program=ETHTOOL):
+    """
+    Run ethtool and return its output.
+    """
+    return subprocess.check_output([program] + args,
+                                   stderr=subprocess.STDOUT) \
+        .decode('UTF-8', 'replace')
+
+
+def tune_rings(iface, size, program=ETHTOOL):
+    """
+    Grow the rings of an interface to the wanted size or to the maximum
+    that the hardware supports.
+
+    Return a list of (parameter, old, new) tuples.
+    """
+    (maximum, current) = parse_rings(ethtool(['-g', iface], program))
+    args = []
+    res = []
+    for key in ('rx', 'tx'):
+        if key not in maximum or key not in current or not maximum[key]:
+            continue
+        wanted = min(size, maximum[key])
+        if current[key] != wanted:
+            args.extend([key, str(wanted)])
+            res.append(('ring-' + key, current[key], wanted))
+    if args:
+        ethtool(['-G', iface] + args, program)
+    return res
+
+
+def tune_coalesce(iface, settings, program=ETHTOOL):
+    """
+    Set the interrupt coalescing parameters that the driver supports.
+
+    Return a list of (parameter, old, new) tuples.
+    """
+    current = parse_coalesce(ethtool(['-c', iface], program))
+    args = []
+    res = []
+    for (key, value) in settings:
+        if key in current and current[key] != value:
+            args.extend([key, value])
+            res.append((key, current[key], value))
+    if args:
+        ethtool(['-C', iface] + args, program)
+    return res
+
+
+def queue_masks(iface, cpus, root='/'):
+    """
+    Compute the RPS masks of the receive queues (all the CPUs) and the
+    XPS masks of the transmit queues (the CPUs spread over the queues)
+    of an interface.
+
+    Return a dictionary mapping the sysfs paths to the masks.
+    """
+    qdir = os.path.join(root, 'sys/class/net', iface, 'queues')
+    if not cpus:
+        return {}
+    try:
+        queues = os.listdir(qdir)
+    except (IOError, OSError):
+        return {}
+    rx = sorted((q for q in queues if q.startswith('rx-')),
+                key=lambda q: int(q[3:]))
+    tx = sorted((q for q in queues if q.startswith('tx-')),
+                key=lambda q: int(q[3:]))
+    res = dict((os.path.join(qdir, q, 'rps_cpus'), cpu_mask(cpus))
+               for q in rx)
+    for (idx, q) in enumerate(tx):
+        res[os.path.join(qdir, q, 'xps_cpus')] = cpu_mask(
+            cpus[idx::len(tx)] or [cpus[idx % len(cpus)]])
+    return res
+
+
+def tune_queues(iface, cpus, root='/'):
+    """
+    Write the RPS and XPS masks that differ from the planned ones.
+
+    Return a tuple with a list of (path, old, new) tuples and a list of
+    (path, message) tuples.
+    """
+    changed = []
+    errors = []
+    for (path, mask) in sorted(queue_masks(iface, cpus, root).items()):
+        try:
+            with open(path, mode='r') as f:
+                current = f.readline().strip()
+            if parse_mask(current) == parse_mask(mask):
+                continue
+            with open(path, mode='w') as f:
+                f.write(mask + '\n')
+        except (IOError, OSError, ValueError) as e:
+            errors.append((path, str(e)))
+            continue
+        changed.append((path, current, mask))
+    return (changed, errors)
+
+
+def apply(settings, root='/', program=ETHTOOL):
+    """
+    Tune the planned interfaces that are present on the host.
+
+    Return a dictionary with the "changed" ((interface, parameter, old,
+    new) tuples) and "errors" ((interface, parameter, message) tuples)
+    lists.
+    """
+    res = {'changed': [], 'errors': []}
+    for (iface, data) in sorted(settings.items()):
+        if not os.path.exists(os.path.join(root, 'sys/class/net', iface)):
+            res['errors'].append((iface, 'device', 'no such interface'))
+            continue
+        for (what, func, arg) in (('ring', tune_rings, data['ring']),
+                                  ('coalesce', tune_coalesce,
+                                   data['coalesce'])):
+            try:
+                res['changed'].extend((iface, key, old, new) for
+                                      (key, old, new) in func(iface, arg,
+                                                              program))
+            except subprocess.CalledProcessError as e:
+                res['errors'].append(
+                    (iface, what, e.output.decode('UTF-8', 'replace')
+                     .strip()))
+            except (IOError, OSError) as e:
+                res['errors'].append((iface, what, str(e)))
+        (changed, errors) = tune_queues(iface, data['cpus'], root)
+        res['changed'].extend((iface, path, old, new)
+                              for (path, old, new) in changed)
+        res['errors'].extend((iface, path, msg) for (path, msg) in errors)
+    return res
+
+
+def main(argv=None):
+    """
+    Reapply the recorded tuning to one or all of the interfaces.
+    """
+    parser = argparse.ArgumentParser(
+        prog='storpool-nic-tune',
+        description='Tune the StorPool network interfaces')
+    parser.add_argument('-i', '--iface',
+                        help='only tune this interface if it is a StorPool '
+                             'one')
+    parser.add_argument('-s', '--settings', default=SETTINGS_FILE,
+                        help='the file with the planned settings')
+    args = parser.parse_args(argv)
+
+    with open(args.settings, mode='r') as f:
+        settings = json.load(f)
+    if args.iface is not None:
+        settings = dict((iface, data) for (iface, data) in settings.items()
+                        if iface == args.iface)
+    res = apply(settings)
+    for (iface, key, old, new) in res['changed']:
+        print('{iface}: {key}: {old} -> {new}'
+              .format(iface=iface, key=key, old=old, new=new))
+    for (iface, key, msg) in res['errors']:
+        print('{iface}: {key}: {msg}'.format(iface=iface, key=key, msg=msg),
+              file=sys.stderr)
+    return 1 if res['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
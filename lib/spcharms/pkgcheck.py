@@ -0,0 +1,70 @@
+"""
+A StorPool Juju charm helper module: quickly check whether the StorPool
+packages are already installed at the requested version.
+"""
+from __future__ import print_function
+
+import os
+
+from charmhelpers.core import unitdata
+
+KV_KEY = 'storpool-common.packages'
+
+
+def installed_versions(names, root='/'):
+    """
+    Parse the dpkg status database once and return the versions of
+    the packages in `names` that are fully installed.
+    """
+    wanted = set(names)
+    res = {}
+    try:
+        f = open(os.path.join(root, 'var/lib/dpkg/status'), mode='r')
+    except (IOError, OSError):
+        return res
+
+    def flush(pkg):
+        if pkg.get('Package') in wanted and \
+           pkg.get('Status', '').endswith(' installed') and \
+           'Version' in pkg:
+            res[pkg['Package']] = pkg['Version']
+
+    with f:
+        pkg = {}
+        for line in f:
+            if line == '\n':
+                flush(pkg)
+                pkg = {}
+            elif line[0] not in ' \t' and ':' in line:
+                (key, value) = line.split(':', 1)
+                if key in ('Package', 'Status', 'Version'):
+                    pkg[key] = value.strip()
+        flush(pkg)
+    return res
+
+
+def record(spver, packages, root='/'):
+    """
+    Remember the dpkg versions of the `packages` that were installed for
+    the `spver` StorPool version.
+    """
+    unitdata.kv().set(KV_KEY, {
+        'storpool_version': spver,
+        'packages': installed_versions(packages, root),
+    })
+
+
+def verify(spver, packages, root='/'):
+    """
+    Check whether all the `packages` were installed for the `spver`
+    StorPool version by a previous run and are still installed at
+    the same versions.
+    """
+    rec = unitdata.kv().get(KV_KEY)
+    if rec is None or rec.get('storpool_version') != spver:
+        return False
+    recorded = rec.get('packages', {})
+    if any(name not in recorded for name in packages):
+        return False
+    current = installed_versions(packages, root)
+    return all(current.get(name) == recorded[name] for name in packages)
@@ -0,0 +1,406 @@
+"""
+A StorPool Juju charm helper module: the side-effect-free planning of
+the kernel parameter, CPU and memory decisions, and of the whole
+configuration of a host from a snapshot of its /proc and sysfs trees.
+"""
+from __future__ import print_function
+
+import json
+import os
+
+from charmhelpers.core import templating
+
+from spcharms import blockdev as spblockdev
+from spcharms import cgroups as spcgroups
+from spcharms import cmdline as spcmdline
+from spcharms import cpuplan as spcpuplan
+from spcharms import hugepages as sphugepages
+from spcharms import inventory as spinventory
+from spcharms import irqs as spirqs
+from spcharms import memplan as spmemplan
+from spcharms import mempolicy as spmempolicy
+from spcharms import netdev as spnetdev
+from spcharms import power as sppower
+from spcharms import rsyslog as sprsyslog
+from spcharms import settings as spsettings
+from spcharms import slicemetrics as spslicemetrics
+from spcharms import sysctl as spsysctl
+from spcharms import sysutil as spsysutil
+from spcharms import topology as sptopology
+
+KERNEL_REQUIRED_PARAMS = (
+    'swapaccount=1',
+    'vga=normal',
+    'nofb',
+    'nomodeset',
+    'video=vesafb:off',
+    'i915.modeset=0',
+)
+
+# The cgroup v1 configuration files generated from the templates; the
+# rest of the cgconfig files are copied from the StorPool packages.
+CGCONFIG_TEMPLATES = (
+    ('machine-cgsetup.conf', '/etc/machine-cgsetup.conf'),
+    ('machine.slice.conf', '/etc/cgconfig.d/machine.slice.conf'),
+    ('storpool.slice.conf', '/etc/cgconfig.d/storpool.slice.conf'),
+    ('system.slice.conf', '/etc/cgconfig.d/system.slice.conf'),
+    ('user.slice.conf', '/etc/cgconfig.d/user.slice.conf'),
+)
+
+SYSCTL_FILE = '/etc/sysctl.d/99-StorPool.conf'
+SYSCTL_VENDOR = '/usr/lib/storpool/etcfiles/storpool-common' + SYSCTL_FILE
+
+# How often to export the slice metrics, in seconds.
+SLICE_METRICS_INTERVAL = 30
+
+
+def check_kernel(line, backend):
+    """
+    Parse the kernel command line and check it for the parameters that
+    StorPool requires with the specified cgroup backend.
+
+    Return a tuple with the parsed parameters and the list of the
+    unsatisfied rules (see spcharms.cmdline.check()).
+    """
+    params = spcmdline.parse(line)
+    return (params, spcmdline.check(
+        params,
+        spcmdline.required_rules(spcgroups.required_params(
+            KERNEL_REQUIRED_PARAMS, backend))))
+
+
+def check_recommended(params, cpu_plan):
+    """
+    Check the kernel parameters against the ones recommended for the
+    planned StorPool CPUs.
+    """
+    return spcmdline.check(params, spcmdline.recommended_rules(
+        cpu_plan['cpus'] + cpu_plan['idle']))
+
+
+def plan_cpus(topology, config, all_cpus, very_few_cpus=False):
+    """
+    Pick the StorPool NUMA node and plan the StorPool services and CPUs.
+
+    Return a dictionary with the "node", "services" and "cpu_plan"
+    keys; raise ValueError if the CPUs cannot be planned.
+    """
+    node = sptopology.select_storpool_node(topology)
+    try:
+        services = spcpuplan.plan_services(topology, config)
+    except ValueError as e:
+        raise ValueError('Could not plan the StorPool CPUs: {e}'.format(e=e))
+    needed = spcpuplan.required_cpus(services)
+    if len(all_cpus) < needed and not very_few_cpus:
+        raise ValueError('Not enough CPUs, need at least {needed}'
+                         .format(needed=needed))
+    return {
+        'node': node,
+        'services': services,
+        'cpu_plan': spcpuplan.plan_cpus(topology, node, services, all_cpus,
+                                        pad=very_few_cpus),
+    }
+
+
+def plan_memory(mem_total, hugepages, topology, services, config,
+                little=False):
+    """
+    Plan the memory limits from the /proc/meminfo MemTotal (value, unit)
+    pair and the hugepages (in megabytes) not reserved by the charm.
+
+    Return the memory plan (see spcharms.memplan.plan_memory()); raise
+    ValueError if there is not enough memory or it cannot be planned.
+    """
+    if mem_total is None:
+        raise ValueError('Could not find MemTotal in /proc/meminfo')
+    total = spmemplan.meminfo_mb({'MemTotal': mem_total}, 'MemTotal')
+    try:
+        mem_plan = spmemplan.plan_memory(total, hugepages, topology,
+                                         services, config, little=little)
+    except ValueError as e:
+        raise ValueError('Could not plan the memory allocation: {e}'
+                         .format(e=e))
+    if mem_plan['machine'] <= 0:
+        raise ValueError('Not enough memory, only have {total}M, need {mem}M'
+                         .format(mem=mem_plan['reserved'], total=total))
+    return mem_plan
+
+
+def template_data(topology, node, services, cpu_plan, mem_plan=None):
+    """
+    Build the template data for the cgroup configuration files.
+    """
+    tdata = {
+        'cpu_storpool': sptopology.format_cpulist(cpu_plan['cpus']),
+        'cpu_rest': sptopology.format_cpulist(cpu_plan['rest']),
+        'storpool_groups': [
+            {
+                'name': svc['name'],
+                'cpus': sptopology.format_cpulist(
+                    cpu_plan['groups'][svc['name']]),
+            }
+            for svc in services
+        ],
+        'mems_storpool': str(node),
+        'mems_all': ','.join(map(str, sorted(topology['nodes'].keys()))),
+    }
+    if mem_plan is not None:
+        tdata.update({
+            'mem_system': mem_plan['system'],
+            'mem_user': mem_plan['user'],
+            'mem_storpool': mem_plan['storpool'],
+            'mem_machine': mem_plan['machine'],
+        })
+    return tdata
+
+
+def desired_cgroups(backend, tdata):
+    """
+    Describe the cgroup attributes that the configuration files set.
+    """
+    if backend == spcgroups.BACKEND_V2:
+        return spcgroups.desired_v2(tdata)
+    return spcgroups.desired_v1(tdata)
+
+
+def render_files(specs, templates_dir=None, mode='644'):
+    """
+    Render the (template, path, context) tuples into the (path, mode,
+    contents) ones that the file builders below return.
+    """
+    return [(dst, mode, templating.render(source=source, target=None,
+                                          context=context,
+                                          templates_dir=templates_dir))
+            for (source, dst, context) in specs]
+
+
+def program_file(module, dst):
+    """
+    Describe the installation of one of the standalone helper modules as
+    a program.
+    """
+    with open(module.__file__, mode='r') as f:
+        return (dst, '755', f.read())
+
+
+def cgroup_files(backend, tdata, templates_dir=None):
+    """
+    List the cgroup configuration files generated from templates.
+    """
+    if backend == spcgroups.BACKEND_V2:
+        specs = spcgroups.v2_files(tdata)
+    else:
+        specs = [(source, dst, tdata) for (source, dst) in CGCONFIG_TEMPLATES]
+    return render_files(specs, templates_dir)
+
+
+def hugepages_files(reservation, templates_dir=None):
+    """
+    List the files of the boot-time hugepage reservation.
+    """
+    return render_files([('systemd/storpool-hugepages.service',
+                          sphugepages.SERVICE_FILE,
+                          sphugepages.unit_context(reservation))],
+                        templates_dir)
+
+
+def irqbalance_files(cpu_plan, irq_plan, templates_dir=None):
+    """
+    List the files that keep irqbalance off the StorPool CPUs and the
+    pinned interrupts.
+    """
+    return render_files([('systemd/irqbalance.conf', spirqs.IRQBALANCE_DROPIN,
+                          spirqs.irqbalance_context(
+                              cpu_plan['cpus'] + cpu_plan['idle'],
+                              irq_plan.keys()))],
+                        templates_dir)
+
+
+def block_queue_files(tuning, templates_dir=None):
+    """
+    List the files that tune the StorPool drives' queues when they appear.
+    """
+    return render_files([('udev/storpool-block.rules', spblockdev.UDEV_RULES,
+                          spblockdev.rules_context(tuning))],
+                        templates_dir)
+
+
+def settings_files(module, settings, templates_dir=None):
+    """
+    List the files of the boot-time service that applies the settings
+    planned by one of the helper modules (e.g. spcharms.power).
+    """
+    return render_files([(spsettings.SERVICE_TEMPLATE, module.SERVICE_FILE,
+                          spsettings.unit_context(module.DESCRIPTION,
+                                                  settings))],
+                        templates_dir)
+
+
+def nic_files(settings, hooks, templates_dir=None):
+    """
+    List the files that tune the StorPool network interfaces whenever
+    their links come up through the specified network tool `hooks`.
+    """
+    context = {'program': spnetdev.PROGRAM,
+               'settings': spnetdev.SETTINGS_FILE}
+    return [
+        program_file(spnetdev, spnetdev.PROGRAM),
+        (spnetdev.SETTINGS_FILE, '644',
+         json.dumps(settings, indent=2, sort_keys=True) + '\n'),
+    ] + render_files([('network/storpool-nic-tune', path, context)
+                      for path in hooks],
+                     templates_dir, mode='755')
+
+
+def rsyslog_files(mem_plan, forward, templates_dir=None):
+    """
+    List the StorPool rsyslog configuration files.
+    """
+    return render_files([('rsyslog/storpool.conf', sprsyslog.CONF_FILE,
+                          sprsyslog.plan(mem_plan, forward))],
+                        templates_dir)
+
+
+def sysctl_files(vendor, settings):
+    """
+    List the sysctl files: the vendor ones with the computed `settings`
+    layered on top.
+    """
+    return [(SYSCTL_FILE, '644', spsysctl.layer(vendor, settings))]
+
+
+def slice_metrics_files(templates_dir=None):
+    """
+    List the files of the slice metrics exporter and its timer.
+    """
+    context = {
+        'program': spslicemetrics.PROGRAM,
+        'output': os.path.join(spslicemetrics.TEXTFILE_DIR,
+                               spslicemetrics.TEXTFILE_NAME),
+        'interval': SLICE_METRICS_INTERVAL,
+    }
+    return [program_file(spslicemetrics, spslicemetrics.PROGRAM)] + \
+        render_files([('systemd/' + name,
+                       os.path.join(spcgroups.SYSTEMD_DIR, name), context)
+                      for name in (spslicemetrics.SERVICE_NAME,
+                                   spslicemetrics.TIMER_NAME)],
+                     templates_dir)
+
+
+def plan_host(root, config, bypassed=(), own_hugepages_mb=0,
+              templates_dir=None):
+    """
+    Plan the whole StorPool configuration of a host from a snapshot of
+    its /proc, sysfs and /etc trees under `root` without changing
+    anything. The `bypassed` names are the charm's development bypasses
+    that should be honoured; `own_hugepages_mb` is the amount of the
+    allocated hugepages that the charm has already reserved.
+
+    Return a JSON-serializable dictionary with the "ok", "error",
+    "warnings", "backend", "kernel" ("missing" and "recommended"
+    parameters), "node", "cpusets", "memory", "cgroups" and "files"
+    (path to contents) keys; the planning stops at the first error.
+    """
+    res = {
+        'ok': False,
+        'error': None,
+        'warnings': [],
+        'backend': None,
+        'kernel': {'missing': [], 'recommended': []},
+        'node': None,
+        'cpusets': {},
+        'memory': None,
+        'cgroups': {},
+        'files': {},
+    }
+    backend = spcgroups.detect_backend(root)
+    res['backend'] = backend
+    try:
+        inventory = spinventory.collect(root)
+    except ValueError as e:
+        res['error'] = str(e)
+        return res
+
+    (params, missing) = check_kernel(inventory['cmdline'], backend)
+    res['kernel']['missing'] = [prob['wanted'] for prob in missing]
+    if missing and 'kernel_parameters' not in bypassed:
+        res['error'] = 'Missing kernel parameters: {missing}'.format(
+            missing=spcmdline.suggestion(missing))
+        return res
+
+    topology = inventory['topology']
+    try:
+        cpus = plan_cpus(topology, config, inventory['cpus'],
+                         'very_few_cpus' in bypassed)
+        hugepages = max(0, sphugepages.total_mb(root) - own_hugepages_mb)
+        mem_plan = plan_memory(inventory['mem_total'], hugepages, topology,
+                               cpus['services'], config,
+                               'very_little_memory' in bypassed)
+    except ValueError as e:
+        res['error'] = str(e)
+        return res
+
+    (node, services, cpu_plan) = (cpus['node'], cpus['services'],
+                                  cpus['cpu_plan'])
+    if cpu_plan['smt_fallback']:
+        res['warnings'].append('Not enough physical cores to give each '
+                               'StorPool service a whole core')
+    res['kernel']['recommended'] = [
+        prob['wanted'] for prob in check_recommended(params, cpu_plan)]
+    tdata = template_data(topology, node, services, cpu_plan, mem_plan)
+    res.update({
+        'node': node,
+        'cpusets': dict(
+            [('storpool', tdata['cpu_storpool']),
+             ('rest', tdata['cpu_rest'])] +
+            [(grp['name'], grp['cpus']) for grp in tdata['storpool_groups']]),
+        'memory': mem_plan,
+        'cgroups': dict((path, [list(item) for item in attrs])
+                        for (path, attrs)
+                        in desired_cgroups(backend, tdata).items()),
+    })
+
+    try:
+        forward = sprsyslog.parse_target(
+            config.get('storpool_log_forward', None))
+    except ValueError as e:
+        res['warnings'].append(str(e))
+        forward = None
+    try:
+        role = spmempolicy.node_role(config.get('storpool_node_role', None),
+                                     sptopology.parse_storpool_conf(root),
+                                     root)
+    except ValueError as e:
+        res['warnings'].append(str(e))
+        role = None
+    interrupts = spirqs.read_interrupts(root)
+    irq_plan = spirqs.plan_irqs(topology, cpu_plan, interrupts, root)
+    overrides = spirqs.irqbalance_overrides(root)
+    if overrides:
+        res['warnings'].append('{path} overrides the irqbalance {names} '
+                               'settings'.format(
+                                   path=spirqs.IRQBALANCE_DEFAULTS,
+                                   names=', '.join(overrides)))
+    tuning = spblockdev.plan(topology['drives'].keys(), root)
+    nics = spnetdev.plan(topology['ifaces'].keys(),
+                         cpu_plan['groups'].get('rdma') or cpu_plan['cpus'])
+    speed = spsysctl.nic_speed(sorted(topology['ifaces']), root)
+    vendor = spsysutil.read_text(os.path.join(root, SYSCTL_VENDOR.lstrip('/')))
+    files = cgroup_files(backend, tdata, templates_dir) + \
+        hugepages_files(sphugepages.plan(node, mem_plan['sp_hugepages']),
+                        templates_dir) + \
+        irqbalance_files(cpu_plan, irq_plan, templates_dir) + \
+        nic_files(nics, spnetdev.hooks(root), templates_dir) + \
+        block_queue_files(tuning, templates_dir) + \
+        settings_files(sppower, sppower.plan(cpu_plan['cpus'], root),
+                       templates_dir) + \
+        rsyslog_files(mem_plan, forward, templates_dir) + \
+        sysctl_files(vendor or '', spsysctl.generate(mem_plan, speed)) + \
+        slice_metrics_files(templates_dir)
+    if role is not None:
+        files += settings_files(spmempolicy, spmempolicy.plan(role, root),
+                                templates_dir)
+    res['files'] = dict((dst, contents) for (dst, _, contents) in files)
+
+    res['ok'] = True
+    return res
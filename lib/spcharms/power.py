@@ -0,0 +1,60 @@
+"""
+A StorPool Juju charm helper module: run the CPUs dedicated to the
+StorPool services at full speed and keep them out of the deep idle
+states.
+"""
+from __future__ import print_function
+
+import os
+
+from spcharms import cmdline as spcmdline
+from spcharms import sysutil as spsysutil
+
+GOVERNOR = 'performance'
+
+KV_KEY = 'storpool-common.power'
+
+SERVICE_NAME = 'storpool-cpupower.service'
+SERVICE_FILE = '/etc/systemd/system/' + SERVICE_NAME
+DESCRIPTION = 'Keep the StorPool CPUs at full speed and out of the deep ' \
+              'idle states'
+
+CPU_DIR = 'sys/devices/system/cpu'
+
+
+def idle_states(cpu, root='/'):
+    """
+    Return the numbers of the cpuidle states of a CPU.
+    """
+    path = os.path.join(root, CPU_DIR, 'cpu{cpu}'.format(cpu=cpu), 'cpuidle')
+    try:
+        names = os.listdir(path)
+    except (IOError, OSError):
+        return []
+    return sorted(int(name[5:]) for name in names
+                  if name.startswith('state') and name[5:].isdigit())
+
+
+def plan(cpus, root='/'):
+    """
+    Plan the cpufreq and cpuidle settings for the StorPool CPUs: the
+    performance governor, if the driver supports it, and all the idle
+    states deeper than the one allowed on the kernel command line
+    disabled.
+
+    Return a dictionary mapping the sysfs paths (relative to the root
+    directory) to the values to write to them (see settings.apply()).
+    """
+    res = {}
+    for cpu in sorted(cpus):
+        cpudir = os.path.join(CPU_DIR, 'cpu{cpu}'.format(cpu=cpu))
+        available = spsysutil.read_line(os.path.join(
+            root, cpudir, 'cpufreq/scaling_available_governors'))
+        if available is not None and GOVERNOR in available.split():
+            res[os.path.join(cpudir, 'cpufreq/scaling_governor')] = GOVERNOR
+        for state in idle_states(cpu, root):
+            if state > spcmdline.MAX_CSTATE:
+                res[os.path.join(cpudir, 'cpuidle',
+                                 'state{state}'.format(state=state),
+                                 'disable')] = '1'
+    return res
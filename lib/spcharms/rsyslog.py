@@ -0,0 +1,149 @@
+"""
+A StorPool Juju charm helper module: generate the rsyslog configuration
+that writes out (and optionally forwards) the StorPool log messages
+through asynchronous, disk-assisted queues, and validate it.
+"""
+from __future__ import print_function
+
+import os
+import re
+import subprocess
+
+from spcharms import sysutil as spsysutil
+
+# Processed before the distribution's 50-default.conf so that the StorPool
+# messages may be kept out of the system logs.
+CONF_FILE = '/etc/rsyslog.d/49-StorPool.conf'
+
+# The vendor configuration installed by earlier versions of the charm.
+OLD_CONF_FILES = ('/etc/rsyslog.d/99-StorPool.conf',)
+
+KV_FORWARD = 'storpool-common.rsyslog.forward'
+
+LOG_DIR = '/var/log/storpool'
+SPOOL_DIR = '/var/spool/rsyslog'
+
+# The rough size of a queued message with its properties, in bytes.
+MESSAGE_SIZE = 2048
+
+# The on-disk spill-over limit of each queue, in megabytes.
+DISK_SPACE_MB = 1024
+
+# How long a new message may wait for room in a full queue before it is
+# dropped, in milliseconds.
+ENQUEUE_TIMEOUT_MS = 2000
+
+# The interval over which the forwarded messages are rate limited, in
+# seconds.
+RATELIMIT_INTERVAL = 5
+
+DEFAULT_PORT = 514
+PROTOCOLS = ('tcp', 'udp')
+
+TARGET_RE = re.compile(r'''
+    ^
+    (?: (?P<protocol> [a-z]+ ) :// )?
+    (?: \[ (?P<ipv6> [0-9A-Fa-f:.]+ ) \] | (?P<host> [^:/\[\]]+ ) )
+    (?: : (?P<port> [0-9]+ ) )?
+    $
+''', re.X)
+
+
+def parse_target(value):
+    """
+    Parse a "[tcp://|udp://]host[:port]" log forwarding target; IPv6
+    addresses must be enclosed in brackets.
+
+    Return a dictionary with the "protocol", "host" and "port" keys, or
+    None if the value is empty; raise ValueError if it is invalid.
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    match = TARGET_RE.match(value)
+    if match is None:
+        raise ValueError('Invalid log forwarding target "{value}"'
+                         .format(value=value))
+    protocol = match.group('protocol') or 'tcp'
+    if protocol not in PROTOCOLS:
+        raise ValueError('Invalid log forwarding protocol "{proto}"'
+                         .format(proto=protocol))
+    port = int(match.group('port') or DEFAULT_PORT)
+    if not 0 < port < 65536:
+        raise ValueError('Invalid log forwarding port {port}'
+                         .format(port=port))
+    return {
+        'protocol': protocol,
+        'host': match.group('ipv6') or match.group('host'),
+        'port': port,
+    }
+
+
+def plan(mem_plan, forward=None):
+    """
+    Size the queues for the memory of the system slice that rsyslog
+    runs in (see memplan.plan_memory()), or for the default one if
+    there is no memory plan yet: up to 1/32 of it, between 16 and 256 MB
+    per queue.  A burst of up to a quarter of a queue may be forwarded
+    in each rate limiting interval.
+
+    Return the template context.
+    """
+    system = 4096 if mem_plan is None else mem_plan['system']
+    size = spsysutil.clamp(system // 32, 16, 256) * 1024 * 1024 // MESSAGE_SIZE
+    return {
+        'log_dir': LOG_DIR,
+        'spool_dir': SPOOL_DIR,
+        'queue_size': size,
+        'high_watermark': size * 8 // 10,
+        'low_watermark': size * 6 // 10,
+        'batch_size': spsysutil.clamp(size // 64, 128, 1024),
+        'disk_space': '{mb}m'.format(mb=DISK_SPACE_MB),
+        'enqueue_timeout': ENQUEUE_TIMEOUT_MS,
+        'ratelimit_interval': RATELIMIT_INTERVAL,
+        'ratelimit_burst': size // 4,
+        'forward': forward,
+    }
+
+
+def put(path, content):
+    """
+    Replace a file with the specified contents or remove it if they are
+    None.
+    """
+    if content is None:
+        if os.path.exists(path):
+            os.unlink(path)
+        return
+    tempf = path + '.new'
+    with open(tempf, mode='w') as f:
+        f.write(content)
+    os.chmod(tempf, 0o644)
+    os.rename(tempf, path)
+
+
+def validate(content, path=CONF_FILE):
+    """
+    Put the generated configuration in place and check the full system
+    configuration with rsyslogd; rsyslogd itself only reads it when it
+    is restarted.  If the check fails, put the previous file back.
+
+    Return None if it is valid or the rsyslogd error messages.
+    """
+    try:
+        with open(path, mode='r') as f:
+            previous = f.read()
+    except (IOError, OSError):
+        previous = None
+
+    try:
+        put(path, content)
+        subprocess.check_output(['rsyslogd', '-N1'],
+                                stderr=subprocess.STDOUT)
+        return None
+    except subprocess.CalledProcessError as e:
+        error = e.output.decode('UTF-8', 'replace').strip()
+    except (IOError, OSError) as e:
+        error = str(e)
+    put(path, previous)
+    return error
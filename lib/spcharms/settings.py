@@ -0,0 +1,102 @@
+"""
+A StorPool Juju charm helper module: write a set of sysfs and procfs
+values, remember the original ones so that they may be restored when
+the charm no longer needs them, and describe the boot-time service that
+writes them again.
+
+The modules that plan such settings (power, mempolicy) define the
+KV_KEY to remember the original values under, the SERVICE_NAME and
+SERVICE_FILE of the boot-time service and its DESCRIPTION.
+"""
+from __future__ import print_function
+
+import os
+
+from charmhelpers.core import unitdata
+
+from spcharms import sysutil as spsysutil
+
+SERVICE_TEMPLATE = 'systemd/storpool-settings.service'
+
+
+def recorded(kv_key):
+    """
+    Return the original values of the settings changed by the charm.
+    """
+    return unitdata.kv().get(kv_key) or {}
+
+
+def write_values(values, root):
+    """
+    Write the values that differ from the current ones.
+
+    Return a dictionary with the "changed" ((path, old, new) tuples) and
+    "errors" ((path, message) tuples) lists and the "original" values of
+    the settings that could be read.
+    """
+    res = {'changed': [], 'errors': [], 'original': {}}
+    for (path, value) in sorted(values.items()):
+        full = os.path.join(root, path)
+        current = spsysutil.read_value(full)
+        if current is None:
+            res['errors'].append((path, 'cannot read the current value'))
+            continue
+        res['original'][path] = current
+        if current == value:
+            continue
+        try:
+            with open(full, mode='w') as f:
+                f.write(value + '\n')
+        except (IOError, OSError) as e:
+            res['errors'].append((path, str(e)))
+            continue
+        res['changed'].append((path, current, value))
+    return res
+
+
+def apply(kv_key, settings, root='/'):
+    """
+    Apply the planned settings (a dictionary mapping the paths relative
+    to the root directory to the values), restoring the original values
+    of the ones that are no longer planned and remembering the original
+    values of the new ones.
+
+    Return a dictionary with the "changed" and "errors" lists as
+    returned by write_values().
+    """
+    original = recorded(kv_key)
+    restore = dict((path, value) for (path, value) in original.items()
+                   if path not in settings)
+    res = write_values(restore, root)
+    kept = dict((path, value) for (path, value) in original.items()
+                if path in settings)
+
+    written = write_values(settings, root)
+    for (path, value) in written['original'].items():
+        kept.setdefault(path, value)
+    unitdata.kv().set(kv_key, kept)
+    return {
+        'changed': res['changed'] + written['changed'],
+        'errors': res['errors'] + written['errors'],
+    }
+
+
+def restore(kv_key, root='/'):
+    """
+    Restore the original values of all the settings changed by the charm.
+    """
+    return apply(kv_key, {}, root)
+
+
+def unit_context(description, settings):
+    """
+    Build the template context for the boot-time service that applies
+    the settings.
+    """
+    return {
+        'description': description,
+        'settings': [
+            {'path': '/' + path, 'value': value}
+            for (path, value) in sorted(settings.items())
+        ],
+    }
@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+"""
+A StorPool Juju charm helper module: export the CPU, memory and pressure
+statistics of the StorPool and other top-level slices in the Prometheus
+node_exporter textfile format.
+
+The charm installs this file as a standalone program run by a systemd
+timer, so it must only use the Python standard library.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+TEXTFILE_DIR = '/var/lib/prometheus/node-exporter'
+TEXTFILE_NAME = 'storpool_slices.prom'
+
+PROGRAM = '/usr/lib/storpool-common/storpool-slice-metrics'
+SERVICE_NAME = 'storpool-slice-metrics.service'
+TIMER_NAME = 'storpool-slice-metrics.timer'
+
+SLICES = ('storpool.slice', 'machine.slice', 'system.slice', 'user.slice')
+
+PRESSURE = ('cpu', 'memory', 'io')
+
+METRICS = {
+    'memory_usage_bytes': ('gauge', 'The memory used by the slice.'),
+    'memory_limit_bytes': ('gauge', 'The memory limit of the slice.'),
+    'memory_failcnt_total': (
+        'counter', 'The number of times the memory limit was hit (v1).'),
+    'memory_events_total': (
+        'counter', 'The memory limit events of the slice (v2).'),
+    'cpu_usage_seconds_total': (
+        'counter', 'The CPU time used by the slice.'),
+    'cpu_periods_total': (
+        'counter', 'The CPU bandwidth control periods of the slice.'),
+    'cpu_throttled_periods_total': (
+        'counter', 'The periods in which the slice was throttled.'),
+    'cpu_throttled_seconds_total': (
+        'counter', 'The time the slice was throttled for.'),
+    'pressure_stall_seconds_total': (
+        'counter', 'The time the tasks of the slice stalled on a resource.'),
+    'collector_duration_seconds': (
+        'gauge', 'The time it took to collect the slice metrics.'),
+}
+
+PREFIX = 'storpool_slice_'
+
+
+def read_file(path):
+    """
+    Read a small file, return None if it does not exist.
+    """
+    try:
+        with open(path, mode='r') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def read_int(path):
+    """
+    Read an integer value, return None for a missing file or "max".
+    """
+    value = read_file(path)
+    try:
+        return int(value.strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def read_keyed(path):
+    """
+    Read a flat keyed file such as cpu.stat or memory.events.
+    """
+    res = {}
+    for line in (read_file(path) or '').split('\n'):
+        words = line.split()
+        if len(words) == 2 and words[1].isdigit():
+            res[words[0]] = int(words[1])
+    return res
+
+
+def read_pressure(path):
+    """
+    Read a PSI file, return a dictionary mapping "some" and "full" to
+    the total stall time in microseconds.
+    """
+    res = {}
+    for line in (read_file(path) or '').split('\n'):
+        words = line.split()
+        if not words:
+            continue
+        for word in words[1:]:
+            if word.startswith('total='):
+                res[words[0]] = int(word[6:])
+    return res
+
+
+def is_unified(root=CGROUP_ROOT):
+    """
+    Check whether the unified (v2) cgroup hierarchy is mounted.
+    """
+    return os.path.exists(os.path.join(root, 'cgroup.controllers'))
+
+
+def list_slices(base):
+    """
+    Return the top-level slices and the children of storpool.slice that
+    exist under a cgroup directory; the virtual machines' cgroups are
+    never descended into.
+    """
+    res = []
+    for name in SLICES:
+        if not os.path.isdir(os.path.join(base, name)):
+            continue
+        res.append(name)
+        if name != 'storpool.slice':
+            continue
+        try:
+            children = sorted(os.listdir(os.path.join(base, name)))
+        except (IOError, OSError):
+            continue
+        res.extend(name + '/' + child for child in children
+                   if os.path.isdir(os.path.join(base, name, child)))
+    return res
+
+
+def label(path):
+    """
+    Strip the "storpool-" prefix and ".slice" suffix of the StorPool
+    service slices (v2) so that both hierarchies report the same names.
+    """
+    parent, _, child = path.rpartition('/')
+    if not parent:
+        return path
+    if child.startswith('storpool-') and child.endswith('.slice'):
+        child = child[len('storpool-'):-len('.slice')]
+    return parent + '/' + child
+
+
+def collect_v2(root=CGROUP_ROOT):
+    """
+    Collect the slice metrics from the unified hierarchy.
+
+    Return a list of (metric, labels, value) tuples.
+    """
+    res = []
+    for path in list_slices(root):
+        cgdir = os.path.join(root, path)
+        lbl = {'slice': label(path)}
+        res.append(('memory_usage_bytes', lbl,
+                    read_int(os.path.join(cgdir, 'memory.current'))))
+        res.append(('memory_limit_bytes', lbl,
+                    read_int(os.path.join(cgdir, 'memory.max'))))
+        for (event, count) in sorted(read_keyed(
+                os.path.join(cgdir, 'memory.events')).items()):
+            res.append(('memory_events_total', dict(lbl, event=event),
+                        count))
+        stat = read_keyed(os.path.join(cgdir, 'cpu.stat'))
+        if 'usage_usec' in stat:
+            res.append(('cpu_usage_seconds_total', lbl,
+                        stat['usage_usec'] / 1e6))
+        if 'nr_periods' in stat:
+            res.append(('cpu_periods_total', lbl, stat['nr_periods']))
+            res.append(('cpu_throttled_periods_total', lbl,
+                        stat.get('nr_throttled')))
+            res.append(('cpu_throttled_seconds_total', lbl,
+                        stat.get('throttled_usec', 0) / 1e6))
+        for resource in PRESSURE:
+            for (kind, total) in sorted(read_pressure(os.path.join(
+                    cgdir, resource + '.pressure')).items()):
+                res.append(('pressure_stall_seconds_total',
+                            dict(lbl, resource=resource, kind=kind),
+                            total / 1e6))
+    return res
+
+
+def collect_v1(root=CGROUP_ROOT):
+    """
+    Collect the slice metrics from the cgroup v1 controllers; there is
+    no per-cgroup pressure information there.
+
+    Return a list of (metric, labels, value) tuples.
+    """
+    res = []
+    memory = os.path.join(root, 'memory')
+    for path in list_slices(memory):
+        cgdir = os.path.join(memory, path)
+        lbl = {'slice': label(path)}
+        res.append(('memory_usage_bytes', lbl,
+                    read_int(os.path.join(cgdir, 'memory.usage_in_bytes'))))
+        res.append(('memory_limit_bytes', lbl,
+                    read_int(os.path.join(cgdir, 'memory.limit_in_bytes'))))
+        res.append(('memory_failcnt_total', lbl,
+                    read_int(os.path.join(cgdir, 'memory.failcnt'))))
+
+    cpuacct = os.path.join(root, 'cpuacct')
+    for path in list_slices(cpuacct):
+        usage = read_int(os.path.join(cpuacct, path, 'cpuacct.usage'))
+        res.append(('cpu_usage_seconds_total', {'slice': label(path)},
+                    None if usage is None else usage / 1e9))
+
+    cpu = os.path.join(root, 'cpu')
+    for path in list_slices(cpu):
+        lbl = {'slice': label(path)}
+        stat = read_keyed(os.path.join(cpu, path, 'cpu.stat'))
+        if 'nr_periods' in stat:
+            res.append(('cpu_periods_total', lbl, stat['nr_periods']))
+            res.append(('cpu_throttled_periods_total', lbl,
+                        stat.get('nr_throttled')))
+            res.append(('cpu_throttled_seconds_total', lbl,
+                        stat.get('throttled_time', 0) / 1e9))
+    return res
+
+
+def collect(root=CGROUP_ROOT):
+    """
+    Collect the slice metrics from whichever hierarchy is mounted.
+    """
+    start = time.time()
+    res = collect_v2(root) if is_unified(root) else collect_v1(root)
+    res.append(('collector_duration_seconds', {}, time.time() - start))
+    return res
+
+
+def format_value(value):
+    """
+    Format a sample value the way Prometheus expects it.
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_metrics(samples):
+    """
+    Format the collected samples in the textfile format, grouped by
+    metric; the samples without a value are skipped.
+    """
+    lines = []
+    for name in sorted(set(metric for (metric, _, _) in samples)):
+        (mtype, mhelp) = METRICS[name]
+        lines.append('# HELP {p}{name} {help}'
+                     .format(p=PREFIX, name=name, help=mhelp))
+        lines.append('# TYPE {p}{name} {type}'
+                     .format(p=PREFIX, name=name, type=mtype))
+        for (metric, labels, value) in samples:
+            if metric != name or value is None:
+                continue
+            lbl = ','.join('{key}="{value}"'.format(key=key, value=labels[key])
+                           for key in sorted(labels))
+            lines.append('{p}{name}{lbl} {value}'.format(
+                p=PREFIX, name=name, lbl='{' + lbl + '}' if lbl else '',
+                value=format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomic(path, data):
+    """
+    Write the file so that node_exporter never sees a partial one.
+    """
+    tmp = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+    with open(tmp, mode='w') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+def main(argv=None):
+    """
+    Collect the metrics and write them out once.
+    """
+    parser = argparse.ArgumentParser(
+        prog='storpool-slice-metrics',
+        description='Export the StorPool slice metrics for node_exporter')
+    parser.add_argument('-o', '--output',
+                        default=os.path.join(TEXTFILE_DIR, TEXTFILE_NAME),
+                        help='the textfile to write, "-" for stdout')
+    parser.add_argument('-r', '--root', default=CGROUP_ROOT,
+                        help='the cgroupfs mount point')
+    args = parser.parse_args(argv)
+
+    data = format_metrics(collect(args.root))
+    if args.output == '-':
+        sys.stdout.write(data)
+    else:
+        write_atomic(args.output, data)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
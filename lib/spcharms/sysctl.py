@@ -0,0 +1,148 @@
+"""
+A StorPool Juju charm helper module: compute the kernel tunables from
+the host's memory, the StorPool network interfaces and the memory plan,
+and apply the ones that have changed.
+"""
+from __future__ import print_function
+
+import os
+
+from charmhelpers.core import unitdata
+
+from spcharms import sysutil as spsysutil
+
+KV_KEY = 'storpool-common.sysctl'
+
+# Assume a 10 GbE link if the interface does not report its speed.
+DEFAULT_SPEED = 10000
+
+# The round-trip time (in microseconds) to size the socket buffers for.
+BUFFER_RTT_US = 2000
+
+MB = 1024 * 1024
+
+
+def nic_speed(ifaces, root='/'):
+    """
+    Return the highest link speed (in Mbit/s) of the StorPool network
+    interfaces.
+    """
+    speeds = []
+    for iface in ifaces:
+        speed = spsysutil.read_int(os.path.join(root, 'sys/class/net',
+                                                iface, 'speed'))
+        if speed is not None and speed > 0:
+            speeds.append(speed)
+    return max(speeds) if speeds else DEFAULT_SPEED
+
+
+def generate(mem_plan, speed):
+    """
+    Compute the sysctl settings from the memory plan (see
+    memplan.plan_memory()) and the link speed (in Mbit/s).
+
+    Return a list of (key, value) tuples.
+    """
+    total_kb = mem_plan['total'] * 1024
+    # Keep enough memory free for the atomic allocations of the network
+    # drivers: 0.5% of the memory plus 16 MB for each 10 Gbit/s,
+    # between 64 MB and 2 GB.
+    min_free = spsysutil.clamp(
+        total_kb // 200 + 16 * 1024 * (speed // 10000),
+        64 * 1024, 2 * 1024 * 1024)
+
+    # The page cache only lives in the memory not given to the virtual
+    # machines; let at most half of that be dirty.
+    outside = max(0, mem_plan['total'] - max(0, mem_plan['machine']))
+    dirty = spsysutil.clamp(outside * 50 // max(1, mem_plan['total']), 2, 20)
+    background = max(1, dirty // 2)
+
+    # Hypervisors should not swap the virtual machines' memory out.
+    swappiness = 1 if mem_plan['machine'] > mem_plan['total'] // 2 else 10
+
+    # The bandwidth-delay product of the fastest link, 16 MB to 256 MB.
+    buffers = spsysutil.clamp(speed * BUFFER_RTT_US // 8, 16 * MB, 256 * MB)
+    backlog = spsysutil.clamp(speed // 4, 1000, 250000)
+
+    return [
+        ('vm.min_free_kbytes', str(min_free)),
+        ('vm.dirty_ratio', str(dirty)),
+        ('vm.dirty_background_ratio', str(background)),
+        ('vm.swappiness', str(swappiness)),
+        ('net.core.rmem_max', str(buffers)),
+        ('net.core.wmem_max', str(buffers)),
+        ('net.ipv4.tcp_rmem', '4096 87380 {b}'.format(b=buffers)),
+        ('net.ipv4.tcp_wmem', '4096 65536 {b}'.format(b=buffers)),
+        ('net.core.netdev_max_backlog', str(backlog)),
+    ]
+
+
+def parse(lines):
+    """
+    Parse the lines of a sysctl.d file into a dictionary; the later
+    settings override the earlier ones.
+    """
+    res = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in '#;' or '=' not in line:
+            continue
+        (key, value) = line.split('=', 1)
+        res[key.strip().lstrip('-').replace('/', '.')] = \
+            normalize(value)
+    return res
+
+
+def normalize(value):
+    """
+    Collapse the whitespace in a sysctl value the way the kernel
+    reports it.
+    """
+    return ' '.join(value.split())
+
+
+def layer(vendor, settings):
+    """
+    Append the generated settings to the contents of the vendor file so
+    that they override its values.
+    """
+    lines = [vendor.rstrip('\n'), '',
+             '# Computed by the storpool-common charm from the host memory,',
+             '# the StorPool network interfaces and the memory plan.']
+    lines.extend('{key} = {value}'.format(key=key, value=value)
+                 for (key, value) in settings)
+    return '\n'.join(lines).lstrip('\n') + '\n'
+
+
+def proc_path(key, root='/'):
+    """
+    Return the /proc/sys path of a sysctl setting.
+    """
+    return os.path.join(root, 'proc/sys', key.replace('.', '/'))
+
+
+def apply(settings, root='/'):
+    """
+    Set the running kernel's values of the settings that differ and
+    remember what was applied.
+
+    Return a dictionary with the "changed" ((key, old, new) tuples) and
+    "errors" ((key, message) tuples) lists.
+    """
+    res = {'changed': [], 'errors': []}
+    applied = unitdata.kv().get(KV_KEY) or {}
+    for (key, value) in sorted(settings.items()):
+        path = proc_path(key, root)
+        try:
+            with open(path, mode='r') as f:
+                current = normalize(f.read())
+            if current != value:
+                with open(path, mode='w') as f:
+                    f.write(value + '\n')
+                res['changed'].append((key, current, value))
+        except (IOError, OSError) as e:
+            res['errors'].append((key, str(e)))
+            continue
+        applied[key] = value
+    unitdata.kv().set(KV_KEY, applied)
+    return res
@@ -0,0 +1,95 @@
+"""
+A StorPool Juju charm helper module: the small helpers shared by the
+other modules for reading the sysfs and procfs files, parsing and
+formatting their values, and clamping the computed sizes.
+
+The standalone programs that the charm installs (netdev, slicemetrics)
+keep their own copies, since they may only use the standard library.
+"""
+from __future__ import print_function
+
+
+def read_text(path):
+    """
+    Read a whole file, return None if it does not exist.
+    """
+    try:
+        with open(path, mode='r') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def read_line(path):
+    """
+    Read the first line of a (sysfs) file, return None if it is missing.
+    """
+    try:
+        with open(path, mode='r') as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def read_int(path):
+    """
+    Read an integer value, return None if it is not available.
+    """
+    try:
+        return int(read_line(path))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_choices(value):
+    """
+    Parse the contents of a sysfs file that lists the choices with the
+    selected one in brackets, e.g. "[mq-deadline] kyber none".
+
+    Return a tuple with the selected choice (None if no choice is
+    bracketed) and the available ones.
+    """
+    current = None
+    available = []
+    for word in (value or '').split():
+        if word.startswith('[') and word.endswith(']'):
+            word = word[1:-1]
+            current = word
+        available.append(word)
+    return (current, available)
+
+
+def read_value(path):
+    """
+    Read a sysfs value, return None if it is not available; for the files
+    that list the choices, return the selected one.
+    """
+    value = read_line(path)
+    if value is None:
+        return None
+    (current, _) = parse_choices(value)
+    return value if current is None else current
+
+
+def format_cpumask(cpus):
+    """
+    Format a list of CPUs as a kernel-style hexadecimal CPU mask made of
+    comma-separated 32-bit words.
+    """
+    mask = 0
+    for cpu in cpus:
+        mask |= 1 << cpu
+    words = []
+    while True:
+        words.append('{w:08x}'.format(w=mask & 0xffffffff))
+        mask >>= 32
+        if not mask:
+            break
+    return ','.join(reversed(words))
+
+
+def clamp(value, low, high):
+    """
+    Limit a value to the [low, high] range.
+    """
+    return max(low, min(high, value))
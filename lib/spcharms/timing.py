@@ -0,0 +1,227 @@
+"""
+A StorPool Juju charm helper module: measure how long each phase of
+the reactive handlers takes and how much of it is spent in child
+processes.
+"""
+from __future__ import print_function
+
+import contextlib
+import functools
+import json
+import os
+import subprocess
+import time
+
+from charmhelpers.core import hookenv
+
+TIMELINE_FILE = '/var/lib/storpool-common/hook-timeline.json'
+
+# The subprocess module functions that are counted.
+SUBPROCESS_FUNCS = ('call', 'check_call', 'check_output', 'run')
+
+_timeline = None
+
+
+class Timeline(object):
+    """
+    The timings of the handlers and their phases during a single hook.
+    """
+
+    def __init__(self, hook):
+        self.hook = hook
+        self.started = time.time()
+        self.start = time.monotonic()
+        self.handlers = []
+        self.handler = None
+        self.phase = None
+        self.saved = {}
+
+    def new_record(self, name):
+        """
+        Start measuring a handler or a phase.
+        """
+        return {
+            'name': name,
+            'start': time.monotonic() - self.start,
+            'wall': 0.0,
+            'subprocesses': 0,
+            'subprocess_time': 0.0,
+        }
+
+    def end_phase(self):
+        """
+        Finish measuring the current phase, if any.
+        """
+        if self.phase is not None:
+            self.phase['wall'] = time.monotonic() - self.start - \
+                self.phase['start']
+            self.phase = None
+
+    def begin_handler(self, name):
+        """
+        Start measuring a reactive handler and intercept the subprocess
+        calls made while it runs.
+        """
+        self.handler = self.new_record(name)
+        self.handler['phases'] = []
+        self.handler['metrics'] = {}
+        self.handlers.append(self.handler)
+        for fname in SUBPROCESS_FUNCS:
+            func = getattr(subprocess, fname, None)
+            if func is not None:
+                self.saved[fname] = func
+                setattr(subprocess, fname, self.wrap(func))
+
+    def end_handler(self):
+        """
+        Finish measuring a handler and stop intercepting the subprocess
+        calls.
+        """
+        self.end_phase()
+        for (fname, func) in self.saved.items():
+            setattr(subprocess, fname, func)
+        self.saved = {}
+        self.handler['wall'] = time.monotonic() - self.start - \
+            self.handler['start']
+        self.handler = None
+
+    def begin_phase(self, name):
+        """
+        Finish the current phase of the handler and start a new one.
+        """
+        if self.handler is None:
+            return
+        self.end_phase()
+        self.phase = self.new_record(name)
+        self.handler['phases'].append(self.phase)
+
+    def add_metric(self, name, value):
+        """
+        Record a measurement made by the current handler.
+        """
+        if self.handler is not None:
+            self.handler['metrics'][name] = value
+
+    def wrap(self, func):
+        """
+        Count the invocations of a subprocess function and the time
+        spent in it.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - start
+                for rec in (self.handler, self.phase):
+                    if rec is not None:
+                        rec['subprocesses'] += 1
+                        rec['subprocess_time'] += elapsed
+
+        return wrapper
+
+    def as_dict(self):
+        """
+        Describe the timeline in a JSON-serializable form.
+        """
+        return {
+            'hook': self.hook,
+            'unit': hookenv.local_unit(),
+            'started': self.started,
+            'wall': time.monotonic() - self.start,
+            'handlers': self.handlers,
+        }
+
+    def summary(self):
+        """
+        Describe the timeline in a single line.
+        """
+        def describe(handler):
+            return '{name} {wall:.2f}s, {count} subprocesses {sub:.2f}s ' \
+                '[{phases}]'.format(
+                    name=handler['name'],
+                    wall=handler['wall'],
+                    count=handler['subprocesses'],
+                    sub=handler['subprocess_time'],
+                    phases=', '.join('{name} {wall:.2f}s'.format(**phase)
+                                     for phase in handler['phases']))
+
+        return '{hook}: {wall:.2f}s; {handlers}'.format(
+            hook=self.hook,
+            wall=time.monotonic() - self.start,
+            handlers='; '.join(map(describe, self.handlers)))
+
+    def write(self, path=None):
+        """
+        Store the timeline into a JSON file.
+        """
+        if path is None:
+            path = TIMELINE_FILE
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, mode=0o755)
+        tempname = path + '.tmp'
+        with open(tempname, mode='w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+            f.write('\n')
+        os.rename(tempname, path)
+
+
+def finish():
+    """
+    Write out the timeline at the end of the hook and log a summary.
+    """
+    global _timeline
+    if _timeline is None:
+        return
+    timeline = _timeline
+    _timeline = None
+    hookenv.log('Hook timing: {summary}'.format(summary=timeline.summary()),
+                hookenv.INFO)
+    try:
+        timeline.write()
+    except (IOError, OSError) as e:
+        hookenv.log('Could not write the hook timeline to {path}: {e}'
+                    .format(path=TIMELINE_FILE, e=e), hookenv.WARNING)
+
+
+def timeline():
+    """
+    Return the timeline for the current hook, creating it if needed.
+    """
+    global _timeline
+    if _timeline is None:
+        _timeline = Timeline(hookenv.hook_name())
+        hookenv.atexit(finish)
+    return _timeline
+
+
+@contextlib.contextmanager
+def handler(name):
+    """
+    Measure the phases of a reactive handler and the subprocesses it runs.
+    """
+    tl = timeline()
+    if tl.handler is not None:
+        yield
+        return
+    tl.begin_handler(name)
+    try:
+        yield
+    finally:
+        tl.end_handler()
+
+
+def phase(name):
+    """
+    Start a new phase of the currently running handler.
+    """
+    timeline().begin_phase(name)
+
+
+def metric(name, value):
+    """
+    Record a measurement made by the currently running handler.
+    """
+    timeline().add_metric(name, value)
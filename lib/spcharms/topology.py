@@ -0,0 +1,341 @@
+"""
+A StorPool Juju charm helper module: examine the CPU, NUMA and device
+topology of the host.
+"""
+from __future__ import print_function
+
+import os
+import re
+
+from spcharms import sysutil as spsysutil
+
+# Block devices that never hold StorPool data.
+VIRTUAL_BLOCK_DEVICES = re.compile(r'^(loop|ram|zram|dm-|md|nbd|sr|fd)')
+
+RE_CPU_RANGE = re.compile(r'^(\d+)(?:-(\d+))?$')
+
+
+def parse_cpulist(s):
+    """
+    Parse a kernel-style CPU list (e.g. "0-3,8,10-11") into a sorted list
+    of CPU numbers.
+    """
+    res = set()
+    for part in s.strip().split(','):
+        if not part:
+            continue
+        m = RE_CPU_RANGE.match(part)
+        if m is None:
+            raise ValueError('Invalid CPU list element "{part}" in "{s}"'
+                             .format(part=part, s=s))
+        first = int(m.group(1))
+        last = first if m.group(2) is None else int(m.group(2))
+        res.update(range(first, last + 1))
+    return sorted(res)
+
+
+def format_cpulist(cpus):
+    """
+    Format a list of CPU numbers as a kernel-style CPU list, collapsing
+    consecutive numbers into ranges.
+    """
+    parts = []
+    start = prev = None
+    for cpu in sorted(set(cpus)):
+        if prev is not None and cpu == prev + 1:
+            prev = cpu
+            continue
+        if start is not None:
+            parts.append(str(start) if start == prev
+                         else '{s}-{e}'.format(s=start, e=prev))
+        start = prev = cpu
+    if start is not None:
+        parts.append(str(start) if start == prev
+                     else '{s}-{e}'.format(s=start, e=prev))
+    return ','.join(parts)
+
+
+def read_node(path):
+    """
+    Read a sysfs "numa_node" file, return None if there is no NUMA
+    information for the device.
+    """
+    node = spsysutil.read_int(path)
+    return node if node is not None and node >= 0 else None
+
+
+def get_numa_nodes(root='/'):
+    """
+    Return a dictionary mapping the NUMA node numbers to the lists of
+    CPUs that belong to them, or an empty dictionary if the kernel does
+    not expose any NUMA information.
+    """
+    nodedir = os.path.join(root, 'sys/devices/system/node')
+    try:
+        names = os.listdir(nodedir)
+    except (IOError, OSError):
+        return {}
+
+    res = {}
+    for name in names:
+        if not name.startswith('node') or not name[4:].isdigit():
+            continue
+        cpus = spsysutil.read_line(os.path.join(nodedir, name, 'cpulist'))
+        res[int(name[4:])] = [] if cpus is None else parse_cpulist(cpus)
+    return res
+
+
+def get_cpu_cores(all_cpus, root='/'):
+    """
+    Group the online CPUs into physical cores using the sysfs
+    thread_siblings_list, core_id and physical_package_id attributes.
+
+    Return a list of cores, each one a sorted list of its online SMT
+    threads, ordered by package and core number.
+    """
+    online = set(all_cpus)
+    cores = {}
+    for cpu in sorted(online):
+        topodir = os.path.join(root, 'sys/devices/system/cpu',
+                               'cpu{cpu}'.format(cpu=cpu), 'topology')
+        siblings = spsysutil.read_line(os.path.join(topodir,
+                                                    'thread_siblings_list'))
+        threads = [cpu] if siblings is None else \
+            [sib for sib in parse_cpulist(siblings) if sib in online]
+        if cpu not in threads:
+            threads.append(cpu)
+        package = spsysutil.read_line(os.path.join(topodir,
+                                                   'physical_package_id'))
+        core_id = spsysutil.read_line(os.path.join(topodir, 'core_id'))
+        key = (int(package) if package is not None else 0,
+               int(core_id) if core_id is not None else cpu,
+               min(threads))
+        cores.setdefault(key, set()).update(threads)
+    return [sorted(cores[key]) for key in sorted(cores.keys())]
+
+
+def get_mounted_devices(root='/'):
+    """
+    Return the names of the block devices and partitions that hold
+    mounted filesystems or active swap areas.
+    """
+    res = set()
+    for (path, field) in (('proc/mounts', 0), ('proc/swaps', 0)):
+        try:
+            with open(os.path.join(root, path), mode='r') as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            continue
+        for line in lines:
+            words = line.split()
+            if len(words) > field and words[field].startswith('/dev/'):
+                res.add(os.path.basename(words[field]))
+    return res
+
+
+def block_device_in_use(name, mounted, root='/'):
+    """
+    Check whether a block device or any of its partitions is mounted or
+    used by the device mapper or an MD array (e.g. the system disk).
+    """
+    devdir = os.path.join(root, 'sys/block', name)
+    parts = [name] + [entry for entry in os.listdir(devdir)
+                      if entry.startswith(name)]
+    for part in parts:
+        if part in mounted:
+            return True
+        path = devdir if part == name else os.path.join(devdir, part)
+        try:
+            if os.listdir(os.path.join(path, 'holders')):
+                return True
+        except (IOError, OSError):
+            pass
+    return False
+
+
+def get_block_devices(root='/'):
+    """
+    Return the names of the physical block devices on the host that are
+    not in use by the operating system, i.e. the candidate StorPool
+    drives.
+    """
+    blockdir = os.path.join(root, 'sys/block')
+    try:
+        names = os.listdir(blockdir)
+    except (IOError, OSError):
+        return []
+    mounted = get_mounted_devices(root)
+    return sorted(
+        name for name in names
+        if not VIRTUAL_BLOCK_DEVICES.match(name) and
+        os.path.exists(os.path.join(blockdir, name, 'device')) and
+        not block_device_in_use(name, mounted, root)
+    )
+
+
+def get_block_device_size(name, root='/'):
+    """
+    Return the size of a block device in bytes.
+    """
+    size = spsysutil.read_int(os.path.join(root, 'sys/block', name, 'size'))
+    return 0 if size is None else size * 512
+
+
+def get_block_device_node(name, root='/'):
+    """
+    Return the NUMA node that a block device is attached to.
+    """
+    devdir = os.path.join(root, 'sys/block', name, 'device')
+    # NVMe namespaces hang off the controller, one level further down.
+    for path in ('numa_node', 'device/numa_node'):
+        node = read_node(os.path.join(devdir, path))
+        if node is not None:
+            return node
+    return None
+
+
+def get_net_device_node(name, root='/'):
+    """
+    Return the NUMA node that a network interface is attached to.
+    """
+    return read_node(os.path.join(root, 'sys/class/net', name,
+                                  'device/numa_node'))
+
+
+def parse_storpool_conf(root='/', hostname=None):
+    """
+    Parse the StorPool configuration file and its storpool.conf.d/
+    snippets, honouring the per-host sections for this node; the name
+    of a host whose snapshot is found under `root` is read from its
+    /etc/hostname file, raise ValueError if there is none.
+    """
+    if hostname is None and os.path.realpath(root) != '/':
+        hostname = spsysutil.read_line(os.path.join(root, 'etc/hostname'))
+        if hostname is None:
+            raise ValueError('No etc/hostname in the {root} snapshot'
+                             .format(root=root))
+    if hostname is None:
+        hostname = os.uname()[1]
+    names = (hostname, hostname.split('.', 1)[0])
+
+    files = [os.path.join(root, 'etc/storpool.conf')]
+    confdir = os.path.join(root, 'etc/storpool.conf.d')
+    if os.path.isdir(confdir):
+        files.extend(os.path.join(confdir, fname)
+                     for fname in sorted(os.listdir(confdir))
+                     if fname.endswith('.conf'))
+
+    res = {}
+    for fname in files:
+        try:
+            with open(fname, mode='r') as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            continue
+        active = True
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                active = line[1:-1].strip() in names
+                continue
+            if active and '=' in line:
+                (key, value) = line.split('=', 1)
+                res[key.strip()] = value.strip()
+    return res
+
+
+def get_storpool_interfaces(conf):
+    """
+    Return the raw network interfaces that StorPool uses according to
+    the parsed `conf` StorPool configuration.
+    """
+    res = set()
+    for key in ('SP_IFACE1_CFG', 'SP_IFACE2_CFG'):
+        fields = conf.get(key, '').split(':')
+        # 1:resolve-iface:raw-iface:vlan:ip:...
+        if len(fields) > 2 and fields[2]:
+            res.add(fields[2])
+        elif len(fields) > 1 and fields[1]:
+            res.add(fields[1])
+    if not res:
+        for word in conf.get('SP_IFACE', '').split(','):
+            iface = word.split('=', 1)[0].strip()
+            if iface:
+                res.add(iface)
+    return sorted(res)
+
+
+def get_topology(all_cpus, root='/'):
+    """
+    Examine the NUMA layout of the host and the placement of the StorPool
+    network interfaces and the block devices.
+
+    Return a dictionary with the "nodes" (node number to list of online
+    CPUs), "cores" (lists of SMT siblings), "ifaces" and "drives" (device
+    name to NUMA node) and "drive_sizes" (device name to size in bytes)
+    keys.
+    """
+    online = set(all_cpus)
+    nodes = dict(
+        (node, [cpu for cpu in cpus if cpu in online])
+        for (node, cpus) in get_numa_nodes(root).items()
+    )
+    if not nodes or not any(nodes.values()):
+        nodes = {0: sorted(online)}
+
+    ifaces = get_storpool_interfaces(parse_storpool_conf(root))
+    drives = get_block_devices(root)
+    return {
+        'nodes': nodes,
+        'cores': get_cpu_cores(online, root),
+        'ifaces': dict((iface, get_net_device_node(iface, root))
+                       for iface in ifaces),
+        'drives': dict((drive, get_block_device_node(drive, root))
+                       for drive in drives),
+        'drive_sizes': dict((drive, get_block_device_size(drive, root))
+                            for drive in drives),
+    }
+
+
+def select_storpool_node(topology):
+    """
+    Pick the NUMA node that StorPool should run on: the one that most of
+    the StorPool network interfaces are attached to, then the one with
+    the most drives, then the lowest-numbered one.
+    """
+    candidates = sorted(node for (node, cpus) in topology['nodes'].items()
+                        if cpus)
+
+    def count(devices, node):
+        return len([dev for (dev, dnode) in devices.items() if dnode == node])
+
+    return max(candidates,
+               key=lambda node: (count(topology['ifaces'], node),
+                                 count(topology['drives'], node),
+                                 -node))
+
+
+def allocate_cpus(topology, node, count):
+    """
+    Give each of `count` StorPool services a whole physical core,
+    preferring the cores on the specified NUMA node.
+
+    Return a dictionary with the "service" CPUs (one per service), the
+    "idle" SMT siblings of the service CPUs that nobody should run on,
+    and the "rest" of the CPUs, or None if there are not enough cores to
+    leave at least one for the rest of the system.
+    """
+    local = set(topology['nodes'].get(node, []))
+    cores = [core for core in topology['cores'] if core[0] in local] + \
+        [core for core in topology['cores'] if core[0] not in local]
+    if len(cores) <= count:
+        return None
+
+    chosen = cores[:count]
+    return {
+        'service': [core[0] for core in chosen],
+        'idle': sorted(cpu for core in chosen for cpu in core[1:]),
+        'rest': sorted(cpu for core in cores[count:] for cpu in core),
+    }
@@ -6,14 +6,37 @@ from __future__ import print_function
 import os
 import subprocess
 import tempfile
+import time
 
 from charms import reactive
-from charmhelpers.core import hookenv, host, templating
+from charmhelpers.core import hookenv, host, unitdata
 
+from spcharms import blockdev as spblockdev
+from spcharms import cgapply as spcgapply
+from spcharms import cgroups as spcgroups
+from spcharms import cmdline as spcmdline
 from spcharms import config as spconfig
+from spcharms import drift as spdrift
+from spcharms import hugepages as sphugepages
+from spcharms import inventory as spinventory
+from spcharms import irqs as spirqs
+from spcharms import kmod as spkmod
+from spcharms import manifest as spmanifest
+from spcharms import memplan as spmemplan
+from spcharms import mempolicy as spmempolicy
+from spcharms import netdev as spnetdev
+from spcharms import pkgcheck as sppkgcheck
+from spcharms import plan as spplan
+from spcharms import power as sppower
 from spcharms import repo as sprepo
+from spcharms import rsyslog as sprsyslog
+from spcharms import settings as spsettings
+from spcharms import slicemetrics as spslicemetrics
 from spcharms import states as spstates
 from spcharms import status as spstatus
+from spcharms import sysctl as spsysctl
+from spcharms import timing as sptiming
+from spcharms import topology as sptopology
 from spcharms import txn
 from spcharms import utils as sputils
 
@@ -26,16 +49,6 @@ STATES_REDO = {
 }
 
 
-KERNEL_REQUIRED_PARAMS = (
-    'swapaccount=1',
-    'vga=normal',
-    'nofb',
-    'nomodeset',
-    'video=vesafb:off',
-    'i915.modeset=0',
-)
-
-
 def rdebug(s):
     """
     Pass the diagnostic message string `s` to the central diagnostic logger.
@@ -52,49 +65,219 @@ def install_package():
     """
     Install the base StorPool packages.
     """
-    rdebug('the common repo has become available and '
-           'we do have the configuration')
-
-    rdebug('checking the kernel command line')
-    with open('/proc/cmdline', mode='r') as f:
-        ln = f.readline()
-        if not ln:
+    with sptiming.handler('install_package'):
+        rdebug('the common repo has become available and '
+               'we do have the configuration')
+
+        sptiming.phase('inventory')
+        (inventory, cached) = spinventory.load()
+        rdebug('using the {how} hardware inventory'
+               .format(how='cached' if cached else 'newly collected'))
+
+        sptiming.phase('kernel-check')
+        cg_backend = spcgroups.detect_backend()
+        rdebug('using the cgroup {backend} backend'
+               .format(backend=cg_backend))
+
+        rdebug('checking the kernel command line')
+        if not inventory['cmdline']:
             sputils.err('Could not read a single line from /proc/cmdline')
             return
-        words = ln.split()
-
-        # OK, so this is a bit naive, but it will do the job
-        global KERNEL_REQUIRED_PARAMS
-        missing = list(filter(lambda param: param not in words,
-                              KERNEL_REQUIRED_PARAMS))
+        (cmdline, missing) = spplan.check_kernel(inventory['cmdline'],
+                                                 cg_backend)
         if missing:
             if sputils.bypassed('kernel_parameters'):
-                hookenv.log('The "kernel_parameters" bypass is meant FOR '
-                            'DEVELOPMENT ONLY!  DO NOT run a StorPool cluster '
-                            'in production with it!', hookenv.WARNING)
+                hookenv.log('The "kernel_parameters" bypass is meant '
+                            'FOR DEVELOPMENT ONLY!  DO NOT run a StorPool '
+                            'cluster in production with it!',
+                            hookenv.WARNING)
             else:
                 sputils.err('Missing kernel parameters: {missing}'
-                            .format(missing=' '.join(missing)))
+                            .format(missing=spcmdline.suggestion(missing)))
                 return
 
-    spstatus.npset('maintenance', 'obtaining the requested StorPool version')
-    spver = spconfig.m().get('storpool_version', None)
-    if spver is None or spver == '':
-        rdebug('no storpool_version key in the charm config yet')
-        return
+        spstatus.npset('maintenance',
+                       'obtaining the requested StorPool version')
+        spver = spconfig.m().get('storpool_version', None)
+        if spver is None or spver == '':
+            rdebug('no storpool_version key in the charm config yet')
+            return
 
-    spstatus.npset('maintenance', 'installing the StorPool common packages')
-    (err, newly_installed) = sprepo.install_packages({
+        sptiming.phase('packages')
+        if not install_packages(spver):
+            return
+
+        if not configure_host(inventory, cg_backend, cmdline):
+            return
+
+        rdebug('setting the package-installed state')
+        reactive.set_state('storpool-common.package-installed')
+        report_status()
+
+
+def configure_host(inventory, cg_backend, cmdline):
+    """
+    Plan the StorPool CPUs and memory for the host's hardware and set up
+    the hugepages, the cgroups, the interrupts and the device tuning
+    accordingly.
+
+    Return False if StorPool cannot be placed on this host.
+    """
+    sptiming.phase('cpu-plan')
+    all_cpus = inventory['cpus']
+    very_few_cpus = sputils.bypassed('very_few_cpus')
+    if very_few_cpus:
+        hookenv.log('The "very_few_cpus" bypass is meant '
+                    'FOR DEVELOPMENT ONLY!  DO NOT run a StorPool '
+                    'cluster in production with it!', hookenv.WARNING)
+
+    rdebug('examining the NUMA topology')
+    topology = inventory['topology']
+    rdebug('planning the StorPool CPU allocation')
+    try:
+        cpus = spplan.plan_cpus(topology, spconfig.m(), all_cpus,
+                                very_few_cpus=very_few_cpus)
+    except ValueError as e:
+        sputils.err(str(e))
+        return False
+    (sp_node, services, cpu_plan) = (cpus['node'], cpus['services'],
+                                     cpus['cpu_plan'])
+    rdebug('- NUMA nodes: {nodes}; StorPool interfaces: {ifaces}; '
+           'drives: {drives}; placing StorPool on node {node}'
+           .format(nodes=sorted(topology['nodes'].keys()),
+                   ifaces=topology['ifaces'],
+                   drives=topology['drives'],
+                   node=sp_node))
+    if cpu_plan['smt_fallback']:
+        msg = 'Not enough physical cores to give each StorPool service ' \
+              'a whole core, falling back to SMT threads'
+        if very_few_cpus:
+            rdebug(msg)
+        else:
+            hookenv.log(msg, hookenv.WARNING)
+    rdebug('- StorPool CPUs: {groups}; idle SMT siblings: {idle}'
+           .format(groups=cpu_plan['groups'], idle=cpu_plan['idle']))
+    check_recommended_params(cmdline, cpu_plan)
+
+    sptiming.phase('memory-plan')
+    very_little_memory = sputils.bypassed('very_little_memory')
+    if very_little_memory:
+        hookenv.log('The "very_little_memory" bypass is meant '
+                    'FOR DEVELOPMENT ONLY!  DO NOT run a StorPool '
+                    'cluster in production with it!', hookenv.WARNING)
+    try:
+        # Our own hugepages are planned anew below.
+        hugepages = max(0, sphugepages.total_mb() -
+                        sphugepages.recorded_mb())
+        mem_plan = spplan.plan_memory(inventory['mem_total'], hugepages,
+                                      topology, services, spconfig.m(),
+                                      little=very_little_memory)
+    except ValueError as e:
+        sputils.err(str(e))
+        return False
+    spmemplan.record(mem_plan)
+    plan_desc = spmemplan.format_plan(mem_plan)
+    hookenv.log('StorPool memory plan: {desc}'.format(desc=plan_desc),
+                hookenv.INFO)
+    spstatus.npset('maintenance',
+                   'memory plan: {desc}'.format(desc=plan_desc))
+    tdata = spplan.template_data(topology, sp_node, services, cpu_plan,
+                                 mem_plan)
+
+    sptiming.phase('hugepages')
+    install_hugepages(sp_node, mem_plan['sp_hugepages'])
+
+    sptiming.phase('cgroup-files')
+    rdebug('generating the cgroup configuration: {tdata}'
+           .format(tdata=tdata))
+    if cg_backend == spcgroups.BACKEND_V2:
+        install_slices(tdata)
+    else:
+        install_cgconfig(tdata)
+    sptiming.phase('cgroup-apply')
+    cg_res = apply_cgroups(cg_backend, tdata)
+    sptiming.phase('irqs')
+    irq_plan = configure_irqs(topology, cpu_plan)
+    sptiming.phase('nics')
+    configure_nics(topology, cpu_plan)
+    sptiming.phase('block-queues')
+    configure_block_queues(topology)
+    sptiming.phase('power')
+    configure_power(cpu_plan['cpus'])
+    sptiming.phase('mempolicy')
+    configure_mempolicy()
+    spdrift.record(spplan.desired_cgroups(cg_backend, tdata), irq_plan,
+                   spdrift.hardware(), cg_res['missing'])
+    return True
+
+
+def report_status():
+    """
+    Clear the maintenance status at the end of a handler, unless some of
+    the StorPool hugepages could not be allocated; that is reported until
+    a later allocation succeeds, so that the other handlers run in the
+    same hook do not hide it.
+    """
+    short = unitdata.kv().get(sphugepages.KV_SHORTFALL)
+    if short is not None:
+        spstatus.npset('blocked',
+                       'StorPool hugepages only partially allocated: '
+                       '{short}'.format(short=short))
+    else:
+        spstatus.npset('maintenance', '')
+
+
+def check_recommended_params(cmdline, cpu_plan):
+    """
+    Check the kernel command line for the parameters recommended for
+    the StorPool CPUs and their idle SMT siblings, and report the ones
+    that should be added or changed.
+    """
+    rdebug('checking the recommended kernel parameters')
+    missing = spplan.check_recommended(cmdline, cpu_plan)
+    for prob in missing:
+        rdebug('- {key}: {current}, should be {wanted} to {reason}'
+               .format(key=prob['key'],
+                       current=prob['current'] if prob['present']
+                       else 'missing',
+                       wanted=prob['wanted'],
+                       reason=prob['reason']))
+    if missing:
+        hookenv.log('Recommended kernel parameters for StorPool, add to '
+                    'the kernel command line: {params}'
+                    .format(params=spcmdline.suggestion(missing)),
+                    hookenv.WARNING)
+    return missing
+
+
+def install_packages(spver):
+    """
+    Install the StorPool common packages and update the kernel module
+    dependencies, unless the packages are already installed at the
+    requested version.
+
+    Return False if the installation failed.
+    """
+    release = os.uname().release
+    kmod = 'kmod-storpool-' + release
+    packages = {
         'storpool-cli': spver,
         'storpool-common': spver,
         'storpool-etcfiles': spver,
-        'kmod-storpool-' + os.uname().release: spver,
+        kmod: spver,
         'python-storpool': spver,
-    })
+    }
+    if sppkgcheck.verify(spver, packages):
+        rdebug('all the StorPool common packages are already installed '
+               'at version {spver}'.format(spver=spver))
+        return True
+
+    spstatus.npset('maintenance', 'installing the StorPool common packages')
+    (err, newly_installed) = sprepo.install_packages(packages)
     if err is not None:
         rdebug('oof, we could not install packages: {err}'.format(err=err))
         rdebug('removing the package-installed state')
-        return
+        return False
 
     if newly_installed:
         rdebug('it seems we managed to install some packages: {names}'
@@ -103,118 +286,108 @@ def install_package():
     else:
         rdebug('it seems that all the packages were installed already')
 
-    rdebug('updating the kernel module dependencies')
-    spstatus.npset('maintenance', 'updating the kernel module dependencies')
-    subprocess.check_call(['depmod', '-a'])
-
-    rdebug('gathering CPU information for the cgroup configuration')
-    with open('/proc/cpuinfo', mode='r') as f:
-        lns = f.readlines()
-        all_cpus = sorted(map(lambda lst: int(lst[2]),
-                              filter(lambda lst: lst and lst[0] == 'processor',
-                                     map(lambda s: s.split(), lns))))
-    if sputils.bypassed('very_few_cpus'):
-        hookenv.log('The "very_few_cpus" bypass is meant '
-                    'FOR DEVELOPMENT ONLY!  DO NOT run a StorPool cluster in '
-                    'production with it!', hookenv.WARNING)
-        last_cpu = all_cpus[-1]
-        all_cpus.extend([last_cpu, last_cpu, last_cpu])
-    if len(all_cpus) < 4:
-        sputils.err('Not enough CPUs, need at least 4')
-        return
-    tdata = {
-        'cpu_rdma': str(all_cpus[0]),
-        'cpu_beacon': str(all_cpus[1]),
-        'cpu_block': str(all_cpus[2]),
-        'cpu_rest': '{min}-{max}'.format(min=all_cpus[3], max=all_cpus[-1]),
-    }
+    sptiming.phase('depmod')
+    (needed, fprint) = spkmod.depmod_needed(release, kmod)
+    if needed or kmod in newly_installed:
+        rdebug('updating the kernel module dependencies for {release}'
+               .format(release=release))
+        spstatus.npset('maintenance',
+                       'updating the kernel module dependencies')
+        spkmod.depmod(release, fprint)
+    else:
+        rdebug('the StorPool kernel modules have not changed')
 
-    rdebug('gathering system memory information for the cgroup configuration')
-    with open('/proc/meminfo', mode='r') as f:
-        while True:
-            line = f.readline()
-            if not line:
-                sputils.err('Could not find MemTotal in /proc/meminfo')
-                return
-            words = line.split()
-            if words[0] == 'MemTotal:':
-                mem_total = int(words[1])
-                unit = words[2].upper()
-                if unit.startswith('K'):
-                    mem_total = int(mem_total / 1024)
-                elif unit.startswith('M'):
-                    pass
-                elif unit.startswith('G'):
-                    mem_total = mem_total * 1024
-                else:
-                    sputils.err('Could not parse the "{u}" unit for '
-                                'MemTotal in /proc/meminfo'.format(u=words[2]))
-                    return
-                break
-    mem_system = 4 * 1024
-    mem_user = 4 * 1024
-    mem_storpool = 1 * 1024
-    mem_kernel = 10 * 1024
-    if sputils.bypassed('very_little_memory'):
-        hookenv.log('The "very_little_memory" bypass is meant '
-                    'FOR DEVELOPMENT ONLY!  DO NOT run a StorPool cluster in '
-                    'production with it!', hookenv.WARNING)
-        mem_system = 1 * 1900
-        mem_user = 1 * 512
-        mem_storpool = 1 * 1024
-        mem_kernel = 1 * 512
-    mem_reserved = mem_system + mem_user + mem_storpool + mem_kernel
-    if mem_total <= mem_reserved:
-        sputils.err('Not enough memory, only have {total}M, need {mem}M'
-                    .format(mem=mem_reserved, total=mem_total))
-        return
-    mem_machine = mem_total - mem_reserved
-    tdata.update({
-        'mem_system': mem_system,
-        'mem_user': mem_user,
-        'mem_storpool': mem_storpool,
-        'mem_machine': mem_machine,
-    })
-
-    rdebug('generating the cgroup configuration: {tdata}'.format(tdata=tdata))
-    if not os.path.isdir('/etc/cgconfig.d'):
-        os.mkdir('/etc/cgconfig.d', mode=0o755)
+    sppkgcheck.record(spver, packages)
+    return True
+
+
+def install_data(data, dst, mode):
+    """
+    Install a file with the specified contents as `dst` unless the charm
+    has already installed the very same file.
+
+    Return True if the file was installed.
+    """
+    data_digest = spmanifest.digest(data)
+    if spmanifest.up_to_date(dst, data_digest, mode):
+        rdebug('- {dst} is up to date'.format(dst=dst))
+        return False
+
+    with tempfile.NamedTemporaryFile(dir='/tmp',
+                                     mode='w+b',
+                                     delete=True) as tempf:
+        rdebug('- generating {tempf} for {dst}'
+               .format(dst=dst, tempf=tempf.name))
+        tempf.write(data if isinstance(data, bytes) else data.encode('UTF-8'))
+        tempf.flush()
+        rdebug('- generating {dst}'.format(dst=dst))
+        txn.install('-o', 'root', '-g', 'root', '-m', mode, '--',
+                    tempf.name, dst)
+    spmanifest.record(dst, data_digest, mode)
+    return True
+
+
+def install_file(src, dst, mode):
+    """
+    Install a copy of the `src` file as `dst` if it has changed.
+
+    Return True if the file was installed.
+    """
+    with open(src, mode='rb') as f:
+        data = f.read()
+    src_digest = spmanifest.digest(data)
+    if spmanifest.up_to_date(dst, src_digest, mode):
+        rdebug('- {dst} is up to date'.format(dst=dst))
+        return False
+
+    rdebug('- installing {src} as {dst}'.format(src=src, dst=dst))
+    txn.install('-o', 'root', '-g', 'root', '-m', mode, '--', src, dst)
+    spmanifest.record(dst, src_digest, mode)
+    return True
+
+
+def install_files(files):
+    """
+    Install the (path, mode, contents) files planned by one of the
+    spcharms.plan file builders, creating their directories if needed.
+
+    Return the paths of the files that were installed.
+    """
+    changed = []
+    for (dst, mode, contents) in files:
+        dstdir = os.path.dirname(dst)
+        if not os.path.isdir(dstdir):
+            os.makedirs(dstdir, mode=0o755)
+        if install_data(contents, dst, mode):
+            changed.append(dst)
+    return changed
+
+
+def install_cgconfig(tdata):
+    """
+    Set up the cgroup v1 hierarchy using the cgconfig service.
+    """
+    files = spplan.cgroup_files(spcgroups.BACKEND_V1, tdata)
+    changed = bool(install_files(files))
+    # The rest of the cgconfig files come from the StorPool packages.
+    planned = set(dst for (dst, _, _) in files)
     cgconfig_dir = '/usr/share/doc/storpool/examples/cgconfig/ubuntu1604'
-    for (path, _, files) in os.walk(cgconfig_dir):
-        for fname in files:
+    for (path, _, fnames) in os.walk(cgconfig_dir):
+        for fname in fnames:
             src = path + '/' + fname
             dst = src.replace(cgconfig_dir, '')
+            if dst in planned:
+                continue
             dstdir = os.path.dirname(dst)
             if not os.path.isdir(dstdir):
                 os.makedirs(dstdir, mode=0o755)
+            mode = '{:o}'.format(os.stat(src).st_mode & 0o777)
+            if install_file(src, dst, mode):
+                changed = True
 
-            if fname in (
-                         'machine.slice.conf',
-                         'storpool.slice.conf',
-                         'system.slice.conf',
-                         'user.slice.conf',
-                         'machine-cgsetup.conf',
-                        ):
-                with tempfile.NamedTemporaryFile(dir='/tmp',
-                                                 mode='w+t',
-                                                 delete=True) as tempf:
-                    rdebug('- generating {tempf} for {dst}'
-                           .format(dst=dst, tempf=tempf.name))
-                    templating.render(
-                                      source=fname,
-                                      target=tempf.name,
-                                      owner='root',
-                                      perms=0o644,
-                                      context=tdata,
-                                     )
-                    rdebug('- generating {dst}'.format(dst=dst))
-                    txn.install('-o', 'root', '-g', 'root', '-m', '644', '--',
-                                tempf.name, dst)
-            else:
-                mode = '{:o}'.format(os.stat(src).st_mode & 0o777)
-                rdebug('- installing {src} as {dst}'.format(src=src, dst=dst))
-                txn.install('-o', 'root', '-g', 'root', '-m', mode, '--',
-                            src, dst)
+    if not changed:
+        rdebug('the cgconfig files have not changed')
+        return
 
     rdebug('starting the cgconfig service')
     rdebug('- refreshing the systemctl service database')
@@ -222,12 +395,305 @@ def install_package():
     rdebug('- starting the cgconfig service')
     try:
         host.service_resume('cgconfig')
-    except Exception:
-        pass
+    except Exception as e:
+        hookenv.log('Could not start the cgconfig service: {e}'.format(e=e),
+                    hookenv.WARNING)
 
-    rdebug('setting the package-installed state')
-    reactive.set_state('storpool-common.package-installed')
-    spstatus.npset('maintenance', '')
+
+def install_slices(tdata):
+    """
+    Set up the unified cgroup hierarchy using systemd slice units and
+    drop-in files.
+    """
+    if not install_files(spplan.cgroup_files(spcgroups.BACKEND_V2, tdata)):
+        rdebug('the systemd slice files have not changed')
+        return
+
+    rdebug('- refreshing the systemctl service database')
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+
+
+def install_hugepages(node, mb):
+    """
+    Reserve `mb` megabytes of hugepages for StorPool on its NUMA node,
+    both right now and at boot time.
+
+    Return a description of the shortfall if the kernel could not
+    allocate all the hugepages, or None; the shortfall is remembered
+    for report_status().
+    """
+    reservation = sphugepages.plan(node, mb)
+    rdebug('reserving hugepages for StorPool: {res}'.format(res=reservation))
+    if install_files(spplan.hugepages_files(reservation)):
+        rdebug('- enabling the boot-time hugepage reservation')
+        subprocess.check_call(['systemctl', 'daemon-reload'])
+        subprocess.check_call(['systemctl', 'enable',
+                               sphugepages.SERVICE_NAME])
+
+    res = sphugepages.apply(reservation)
+    rdebug('- hugepages per node: {res}'.format(res=res))
+    short = sphugepages.shortfall(res)
+    kv = unitdata.kv()
+    if short is not None:
+        hookenv.log('Could not allocate all the StorPool hugepages, '
+                    'only got {short}'.format(short=short), hookenv.WARNING)
+        kv.set(sphugepages.KV_SHORTFALL, short)
+    elif kv.get(sphugepages.KV_SHORTFALL) is not None:
+        rdebug('- all the StorPool hugepages are allocated now')
+        kv.unset(sphugepages.KV_SHORTFALL)
+    return short
+
+
+def remove_hugepages():
+    """
+    Remove the boot-time hugepage reservation and give the hugepages
+    reserved for StorPool back to the kernel.
+    """
+    rdebug('releasing the StorPool hugepages')
+    if os.path.exists(sphugepages.SERVICE_FILE):
+        rdebug('- disabling {name}'.format(name=sphugepages.SERVICE_NAME))
+        subprocess.call(['systemctl', 'disable', sphugepages.SERVICE_NAME])
+        os.unlink(sphugepages.SERVICE_FILE)
+        subprocess.call(['systemctl', 'daemon-reload'])
+    res = sphugepages.release()
+    rdebug('- hugepages per node: {res}'.format(res=res))
+    unitdata.kv().unset(sphugepages.KV_SHORTFALL)
+
+
+def apply_cgroups(backend, tdata):
+    """
+    Apply the cgroup configuration to the running cgroups, including the
+    existing virtual machines' ones, without restarting anything.
+    """
+    rdebug('applying the cgroup configuration to the running cgroups')
+    res = spcgapply.reconcile(spplan.desired_cgroups(backend, tdata))
+    for (path, attr, old, new) in res['changed']:
+        rdebug('- {path}: {attr}: {old} -> {new}'
+               .format(path=path, attr=attr, old=old, new=new))
+    if res['missing']:
+        rdebug('- not created yet: {missing}'
+               .format(missing=' '.join(res['missing'])))
+    for (path, attr, msg) in res['errors']:
+        hookenv.log('Could not set {attr} for the {path} cgroup: {msg}'
+                    .format(path=path, attr=attr, msg=msg),
+                    hookenv.WARNING)
+    return res
+
+
+def configure_irqs(topology, cpu_plan):
+    """
+    Pin the interrupts of the StorPool network interfaces and NVMe drives
+    to the StorPool CPUs and keep irqbalance away from them.
+
+    Return the affinity of the interrupts that could be pinned.
+    """
+    rdebug('pinning the StorPool interrupts')
+    interrupts = spirqs.read_interrupts()
+    plan = spirqs.plan_irqs(topology, cpu_plan, interrupts)
+    if install_files(spplan.irqbalance_files(cpu_plan, plan)):
+        rdebug('- restarting irqbalance')
+        subprocess.check_call(['systemctl', 'daemon-reload'])
+        subprocess.check_call(['systemctl', 'try-restart',
+                               'irqbalance.service'])
+    overrides = spirqs.irqbalance_overrides()
+    if overrides:
+        hookenv.log('{path} sets {names}, so irqbalance may still move '
+                    'interrupts to the StorPool CPUs'
+                    .format(path=spirqs.IRQBALANCE_DEFAULTS,
+                            names=', '.join(overrides)), hookenv.WARNING)
+
+    res = spirqs.apply(plan)
+    for (irq, old, new) in res['changed']:
+        rdebug('- IRQ {irq}: {old} -> {new}'
+               .format(irq=irq, old=old, new=new))
+    # The kernel-managed NVMe queue interrupts may not be moved.
+    for (irq, msg) in res['errors']:
+        rdebug('- could not pin IRQ {irq}: {msg}'.format(irq=irq, msg=msg))
+
+    rdma_cpus = cpu_plan['groups'].get('rdma', [])
+    foreign = spirqs.foreign_interrupts(interrupts, rdma_cpus, plan)
+    rate = spirqs.foreign_rate(foreign, time.time())
+    rdebug('- other interrupts on the RDMA CPUs: {count} total, {rate}/s'
+           .format(count=foreign,
+                   rate='?' if rate is None else '{:.1f}'.format(rate)))
+    sptiming.metric('irqs_pinned', len(plan))
+    sptiming.metric('irqs_changed', len(res['changed']))
+    sptiming.metric('irqs_unmovable', len(res['errors']))
+    sptiming.metric('rdma_cpu_foreign_interrupts', foreign)
+    sptiming.metric('rdma_cpu_foreign_interrupt_rate', rate)
+    unmovable = set(irq for (irq, _) in res['errors'])
+    return dict((irq, cpus) for (irq, cpus) in plan.items()
+                if irq not in unmovable)
+
+
+def remove_irqs():
+    """
+    Restore the original affinity of the StorPool interrupts and let
+    irqbalance use the StorPool CPUs again.
+    """
+    rdebug('unpinning the StorPool interrupts')
+    res = spirqs.restore()
+    for (irq, old, new) in res['changed']:
+        rdebug('- IRQ {irq}: {old} -> {new}'
+               .format(irq=irq, old=old, new=new))
+    for (irq, msg) in res['errors']:
+        rdebug('- could not restore IRQ {irq}: {msg}'
+               .format(irq=irq, msg=msg))
+    if os.path.exists(spirqs.IRQBALANCE_DROPIN):
+        rdebug('- removing {path}'.format(path=spirqs.IRQBALANCE_DROPIN))
+        os.unlink(spirqs.IRQBALANCE_DROPIN)
+        subprocess.call(['systemctl', 'daemon-reload'])
+        subprocess.call(['systemctl', 'try-restart', 'irqbalance.service'])
+
+
+def configure_nics(topology, cpu_plan):
+    """
+    Tune the rings, the interrupt coalescing and the RPS/XPS masks of the
+    StorPool network interfaces for the StorPool networking CPUs, both
+    right now and whenever their links come up.
+    """
+    rdebug('tuning the StorPool network interfaces')
+    cpus = cpu_plan['groups'].get('rdma') or cpu_plan['cpus']
+    settings = spnetdev.plan(topology['ifaces'].keys(), cpus)
+    hooks = spnetdev.hooks()
+    install_files(spplan.nic_files(settings, hooks))
+    for path in spnetdev.HOOKS:
+        if path not in hooks and os.path.exists(path):
+            rdebug('- removing the {path} hook of a tool that is gone'
+                   .format(path=path))
+            os.unlink(path)
+
+    res = spnetdev.apply(settings)
+    for (iface, key, old, new) in res['changed']:
+        rdebug('- {iface}: {key}: {old} -> {new}'
+               .format(iface=iface, key=key, old=old, new=new))
+    for (iface, key, msg) in res['errors']:
+        hookenv.log('Could not tune {key} for {iface}: {msg}'
+                    .format(iface=iface, key=key, msg=msg), hookenv.WARNING)
+    sptiming.metric('nic_changed', len(res['changed']))
+    return res
+
+
+def configure_block_queues(topology):
+    """
+    Tune the block layer queues of the StorPool drives, both right now
+    and through udev rules when they appear.
+    """
+    rdebug('tuning the block queues of the StorPool drives')
+    tuning = spblockdev.plan(topology['drives'].keys())
+    for (name, data) in sorted(tuning.items()):
+        rdebug('- {name}: {dclass}: {settings}'
+               .format(name=name, dclass=data['class'],
+                       settings=data['settings']))
+    if install_files(spplan.block_queue_files(tuning)):
+        rdebug('- reloading the udev rules')
+        subprocess.check_call(['udevadm', 'control', '--reload'])
+        if tuning:
+            subprocess.check_call(
+                ['udevadm', 'trigger', '--action=change',
+                 '--subsystem-match=block'] +
+                ['--sysname-match=' + name for name in sorted(tuning)])
+
+    res = spblockdev.apply(tuning)
+    for (name, attr, old, new) in res['changed']:
+        rdebug('- {name}: {attr}: {old} -> {new}'
+               .format(name=name, attr=attr, old=old, new=new))
+    for (name, attr, msg) in res['errors']:
+        hookenv.log('Could not set {attr} for {name}: {msg}'
+                    .format(name=name, attr=attr, msg=msg), hookenv.WARNING)
+    sptiming.metric('block_queue_changed', len(res['changed']))
+    return res
+
+
+def remove_block_tuning():
+    """
+    Remove the udev rules that tune the StorPool drives' queues; the
+    current settings are left alone until the drives are reattached.
+    """
+    if os.path.exists(spblockdev.UDEV_RULES):
+        rdebug('removing {path}'.format(path=spblockdev.UDEV_RULES))
+        os.unlink(spblockdev.UDEV_RULES)
+        subprocess.call(['udevadm', 'control', '--reload'])
+
+
+def configure_settings(module, settings):
+    """
+    Apply the sysfs and procfs settings planned by one of the helper
+    modules (e.g. spcharms.power) right now and install the boot-time
+    service that applies them again.
+    """
+    if install_files(spplan.settings_files(module, settings)):
+        rdebug('- enabling {name}'.format(name=module.SERVICE_NAME))
+        subprocess.check_call(['systemctl', 'daemon-reload'])
+        subprocess.check_call(['systemctl', 'enable', module.SERVICE_NAME])
+
+    res = spsettings.apply(module.KV_KEY, settings)
+    for (path, old, new) in res['changed']:
+        rdebug('- {path}: {old} -> {new}'.format(path=path, old=old, new=new))
+    for (path, msg) in res['errors']:
+        hookenv.log('Could not set {path}: {msg}'.format(path=path, msg=msg),
+                    hookenv.WARNING)
+    return res
+
+
+def remove_settings(module):
+    """
+    Remove the boot-time service of one of the helper modules and
+    restore the original values of the settings that it changed.
+    """
+    if os.path.exists(module.SERVICE_FILE):
+        rdebug('- disabling {name}'.format(name=module.SERVICE_NAME))
+        subprocess.call(['systemctl', 'disable', module.SERVICE_NAME])
+        os.unlink(module.SERVICE_FILE)
+        subprocess.call(['systemctl', 'daemon-reload'])
+    res = spsettings.restore(module.KV_KEY)
+    for (path, old, new) in res['changed']:
+        rdebug('- {path}: {old} -> {new}'.format(path=path, old=old, new=new))
+    for (path, msg) in res['errors']:
+        hookenv.log('Could not restore {path}: {msg}'
+                    .format(path=path, msg=msg), hookenv.WARNING)
+    return res
+
+
+def configure_power(cpus):
+    """
+    Run the StorPool CPUs with the performance cpufreq governor and
+    without the deep idle states, both right now and at boot time.
+    """
+    rdebug('configuring the power management of the StorPool CPUs')
+    return configure_settings(sppower, sppower.plan(cpus))
+
+
+def configure_mempolicy():
+    """
+    Set the transparent hugepage, KSM and NUMA balancing policy for the
+    role of the node, both right now and at boot time.
+    """
+    rdebug('configuring the memory management policy')
+    try:
+        role = spmempolicy.node_role(
+            spconfig.m().get('storpool_node_role', None),
+            sptopology.parse_storpool_conf())
+    except ValueError as e:
+        hookenv.log('{e}, leaving the memory management policy alone'
+                    .format(e=e), hookenv.WARNING)
+        return None
+    rdebug('- node role: {role}'.format(role=role))
+    res = configure_settings(spmempolicy, spmempolicy.plan(role))
+    sptiming.metric('mempolicy_changed', len(res['changed']))
+    return res
+
+
+def remove_nic_tuning():
+    """
+    Stop reapplying the network interface tuning when the links come up;
+    the current settings are left alone until the next reboot.
+    """
+    rdebug('removing the network interface tuning hooks')
+    for path in spnetdev.HOOKS + (spnetdev.PROGRAM, spnetdev.SETTINGS_FILE):
+        if os.path.exists(path):
+            rdebug('- removing {path}'.format(path=path))
+            os.unlink(path)
 
 
 @reactive.when('l-storpool-config.config-written',
@@ -238,21 +704,147 @@ def copy_config_files():
     """
     Install some configuration files.
     """
-    spstatus.npset('maintenance', 'copying the storpool-common config files')
-    basedir = '/usr/lib/storpool/etcfiles/storpool-common'
-    for f in (
-        '/etc/rsyslog.d/99-StorPool.conf',
-        '/etc/sysctl.d/99-StorPool.conf',
-    ):
-        rdebug('installing {fname}'.format(fname=f))
-        txn.install('-o', 'root', '-g', 'root', '-m', '644', basedir + f, f)
-
-    rdebug('about to restart rsyslog')
-    spstatus.npset('maintenance', 'restarting the system logging service')
-    host.service_restart('rsyslog')
+    with sptiming.handler('copy_config_files'):
+        sptiming.phase('config-files')
+        spstatus.npset('maintenance',
+                       'copying the storpool-common config files')
+        basedir = '/usr/lib/storpool/etcfiles/storpool-common'
+        sptiming.phase('rsyslog')
+        rsyslog_changed = install_rsyslog()
+
+        sptiming.phase('sysctl')
+        install_sysctl(basedir)
+
+        sptiming.phase('slice-metrics')
+        install_slice_metrics()
+
+        if rsyslog_changed:
+            # rsyslogd only rereads its configuration on a restart; the
+            # queues are saved to disk and the journal and the syslog
+            # socket hold the new messages in the meantime.
+            rdebug('about to restart rsyslog')
+            sptiming.phase('rsyslog-restart')
+            spstatus.npset('maintenance',
+                           'restarting the system logging service')
+            host.service_restart('rsyslog')
+        else:
+            rdebug('the rsyslog configuration has not changed')
+
+        reactive.set_state('storpool-common.config-written')
+        report_status()
+
+
+def install_rsyslog():
+    """
+    Generate the StorPool rsyslog configuration and install it if it has
+    changed and rsyslogd accepts it.
 
-    reactive.set_state('storpool-common.config-written')
-    spstatus.npset('maintenance', '')
+    Return True if the configuration was installed.
+    """
+    rdebug('generating the StorPool rsyslog configuration')
+    value = spconfig.m().get('storpool_log_forward', None)
+    unitdata.kv().set(sprsyslog.KV_FORWARD, value)
+    try:
+        forward = sprsyslog.parse_target(value)
+    except ValueError as e:
+        hookenv.log('{e}, not forwarding the StorPool logs'.format(e=e),
+                    hookenv.WARNING)
+        forward = None
+    mem_plan = spmemplan.recorded()
+    rdebug('- forwarding to {forward}'.format(forward=forward))
+    files = spplan.rsyslog_files(mem_plan, forward)
+    files = [(dst, mode, contents) for (dst, mode, contents) in files
+             if not spmanifest.up_to_date(dst, spmanifest.digest(contents),
+                                          mode)]
+    removed = False
+    for path in sprsyslog.OLD_CONF_FILES:
+        if os.path.exists(path):
+            rdebug('- removing {path}'.format(path=path))
+            os.unlink(path)
+            removed = True
+    if not files:
+        rdebug('- the rsyslog configuration is up to date')
+        return removed
+
+    for (dst, _, contents) in files:
+        error = sprsyslog.validate(contents, dst)
+        if error is not None:
+            hookenv.log('Not installing the rejected rsyslog configuration: '
+                        '{error}'.format(error=error), hookenv.WARNING)
+            return removed
+    return bool(install_files(files)) or removed
+
+
+def install_slice_metrics():
+    """
+    Install the slice metrics exporter and the timer that runs it.
+    """
+    rdebug('installing the slice metrics exporter')
+    if not os.path.isdir(spslicemetrics.TEXTFILE_DIR):
+        os.makedirs(spslicemetrics.TEXTFILE_DIR, mode=0o755)
+    changed = bool(install_files(spplan.slice_metrics_files()))
+    if changed:
+        rdebug('- starting the slice metrics timer')
+        subprocess.check_call(['systemctl', 'daemon-reload'])
+        subprocess.check_call(['systemctl', 'enable', '--now',
+                               spslicemetrics.TIMER_NAME])
+    return changed
+
+
+def remove_slice_metrics():
+    """
+    Stop the slice metrics timer and remove the exporter, its units and
+    the metrics that it last wrote.
+    """
+    rdebug('removing the slice metrics exporter')
+    units = [os.path.join(spcgroups.SYSTEMD_DIR, name)
+             for name in (spslicemetrics.TIMER_NAME,
+                          spslicemetrics.SERVICE_NAME)]
+    if any(os.path.exists(path) for path in units):
+        rdebug('- stopping the slice metrics timer')
+        subprocess.call(['systemctl', 'disable', '--now',
+                         spslicemetrics.TIMER_NAME])
+    for path in units + [spslicemetrics.PROGRAM,
+                         os.path.join(spslicemetrics.TEXTFILE_DIR,
+                                      spslicemetrics.TEXTFILE_NAME)]:
+        if os.path.exists(path):
+            rdebug('- removing {path}'.format(path=path))
+            os.unlink(path)
+    subprocess.call(['systemctl', 'daemon-reload'])
+
+
+def install_sysctl(basedir):
+    """
+    Install the vendor sysctl settings with the ones computed for this
+    host layered on top of them, and apply the ones that have changed.
+    """
+    rdebug('installing {fname}'.format(fname=spplan.SYSCTL_FILE))
+    with open(basedir + spplan.SYSCTL_FILE, mode='r') as f:
+        vendor = f.read()
+    mem_plan = spmemplan.recorded()
+    if mem_plan is None:
+        rdebug('- no memory plan yet, only using the vendor settings')
+        settings = []
+    else:
+        ifaces = sptopology.get_storpool_interfaces(
+            sptopology.parse_storpool_conf())
+        speed = spsysctl.nic_speed(ifaces)
+        settings = spsysctl.generate(mem_plan, speed)
+        rdebug('- computed for {total}M of memory and {speed} Mbit/s: '
+               '{settings}'.format(total=mem_plan['total'], speed=speed,
+                                   settings=settings))
+    files = spplan.sysctl_files(vendor, settings)
+    install_files(files)
+
+    res = spsysctl.apply(spsysctl.parse(
+        '\n'.join(contents for (_, _, contents) in files).split('\n')))
+    for (key, old, new) in res['changed']:
+        rdebug('- {key}: {old} -> {new}'.format(key=key, old=old, new=new))
+    for (key, msg) in res['errors']:
+        hookenv.log('Could not set the {key} sysctl: {msg}'
+                    .format(key=key, msg=msg), hookenv.WARNING)
+    sptiming.metric('sysctl_changed', len(res['changed']))
+    return res
 
 
 @reactive.when('storpool-common.package-installed')
@@ -275,6 +867,84 @@ def rewrite():
     reactive.remove_state('storpool-common.config-written')
 
 
+@reactive.when('storpool-common.config-written')
+@reactive.when_not('storpool-common.stopped')
+def check_log_forward():
+    """
+    Trigger a rewrite of the rsyslog configuration if the log forwarding
+    target has changed.
+    """
+    value = spconfig.m().get('storpool_log_forward', None)
+    if value != unitdata.kv().get(sprsyslog.KV_FORWARD):
+        rdebug('the StorPool log forwarding target has changed')
+        reactive.remove_state('storpool-common.config-written')
+
+
+@reactive.hook('update-status')
+def check_drift():
+    """
+    Check whether the cgroup limits and the interrupt affinity are still
+    the ones set up by install_package() and replan if the hardware has
+    changed.
+    """
+    if not reactive.helpers.is_state('storpool-common.package-installed') \
+       or reactive.helpers.is_state('storpool-common.stopped'):
+        return
+    with sptiming.handler('check_drift'):
+        plan = spdrift.recorded()
+        if plan is None:
+            rdebug('no recorded plan to check for drift against yet')
+            return
+        res = spdrift.check(plan)
+        if res['hardware']:
+            changed = ', '.join(res['hardware'])
+            hookenv.log('The hardware has changed ({changed}), replanning '
+                        'the StorPool configuration'
+                        .format(changed=changed), hookenv.INFO)
+            spstatus.npset('maintenance',
+                           'replanning after a hardware change: {changed}'
+                           .format(changed=changed))
+            replan()
+            return
+
+        kv = unitdata.kv()
+        desc = spdrift.describe(res)
+        if desc is not None:
+            hookenv.log('The StorPool configuration has drifted: {desc}'
+                        .format(desc=desc), hookenv.WARNING)
+            spstatus.npset('blocked', 'StorPool configuration drift: {desc}'
+                           .format(desc=desc))
+            kv.set(spdrift.KV_REPORTED, True)
+        elif kv.get(spdrift.KV_REPORTED):
+            rdebug('the StorPool configuration drift is gone')
+            kv.unset(spdrift.KV_REPORTED)
+            report_status()
+
+
+def replan():
+    """
+    Set the host up anew for the changed hardware without going through
+    the package installation again.
+
+    All the parts of the hardware snapshot feed the CPU and memory plans
+    that every host phase is built from, so all the phases are run; each
+    of them only rewrites the files and settings that actually change.
+    The configuration files are only rewritten if the memory plan that
+    the sysctl settings follow has changed.
+    """
+    sptiming.phase('inventory')
+    (inventory, _) = spinventory.load()
+    cg_backend = spcgroups.detect_backend()
+    (cmdline, _) = spplan.check_kernel(inventory['cmdline'], cg_backend)
+    mem_plan = spmemplan.recorded()
+    if not configure_host(inventory, cg_backend, cmdline):
+        return
+    if spmemplan.recorded() != mem_plan:
+        rdebug('the memory plan has changed, rewriting the sysctl settings')
+        reactive.remove_state('storpool-common.config-written')
+    report_status()
+
+
 @reactive.hook('install')
 def register():
     """
@@ -289,15 +959,41 @@ def remove_leftovers():
     """
     Clean up, remove the config files, uninstall the packages.
     """
-    rdebug('storpool-common.stop invoked')
-    reactive.remove_state('storpool-common.stop')
+    with sptiming.handler('remove_leftovers'):
+        rdebug('storpool-common.stop invoked')
+        reactive.remove_state('storpool-common.stop')
+
+        sptiming.phase('packages')
+        rdebug('removing any base StorPool packages')
+        sprepo.unrecord_packages('storpool-common')
+
+        sptiming.phase('power')
+        rdebug('restoring the CPU power management settings')
+        remove_settings(sppower)
+
+        sptiming.phase('mempolicy')
+        rdebug('restoring the memory management policy settings')
+        remove_settings(spmempolicy)
+
+        sptiming.phase('hugepages')
+        remove_hugepages()
+
+        sptiming.phase('irqs')
+        remove_irqs()
+
+        sptiming.phase('nics')
+        remove_nic_tuning()
+
+        sptiming.phase('block-queues')
+        remove_block_tuning()
 
-    rdebug('removing any base StorPool packages')
-    sprepo.unrecord_packages('storpool-common')
+        sptiming.phase('slice-metrics')
+        remove_slice_metrics()
 
-    rdebug('letting storpool-config know')
-    reactive.set_state('l-storpool-config.stop')
+        sptiming.phase('states')
+        rdebug('letting storpool-config know')
+        reactive.set_state('l-storpool-config.stop')
 
-    reactive.set_state('storpool-common.stopped')
-    for state in STATES_REDO['set'] + STATES_REDO['unset']:
-        reactive.remove_state(state)
+        reactive.set_state('storpool-common.stopped')
+        for state in STATES_REDO['set'] + STATES_REDO['unset']:
+            reactive.remove_state(state)
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+"""
+Plan the storpool-common configuration of a whole fleet of hosts without
+touching any of them.
+
+Each host is described by a snapshot of its /proc, sysfs and /etc trees,
+either a directory or a tar archive (optionally compressed) with paths
+relative to the host's root directory, e.g. "proc/cpuinfo".  The host is
+named after the snapshot with the archive extension stripped.
+
+The snapshots are planned in parallel by spcharms.plan.plan_host() and
+the plan of each host is written as a JSON file to the output directory.
+If a baseline directory with the plans produced by an earlier version of
+the charm is specified, the hosts whose plans have changed are listed.
+
+Run this from the top-level directory of the layer, e.g. via
+"tox -e fleet-plan -- -o /tmp/plans snapshots/*.tar.gz".
+"""
+
+from __future__ import print_function
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+
+import yaml
+
+lib_path = os.path.realpath('lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import plan as spplan
+
+ARCHIVE_SUFFIX = re.compile(r'\.(tar|tar\.gz|tgz|tar\.bz2|tbz2|tar\.xz|txz)$')
+
+# The plan keys to compare against the baseline.
+COMPARE_KEYS = ('error', 'backend', 'kernel', 'node', 'cpusets', 'memory',
+                'cgroups', 'files')
+
+
+def host_name(path):
+    """
+    Name a host after its snapshot.
+    """
+    return ARCHIVE_SUFFIX.sub('', os.path.basename(path.rstrip('/')))
+
+
+def within(path, dest):
+    """
+    Check that a path, with all the symlinks already extracted resolved,
+    stays within the snapshot root.
+    """
+    real = os.path.realpath(path)
+    root = os.path.realpath(dest)
+    return real == root or real.startswith(root + os.sep)
+
+
+def safe_members(archive, dest):
+    """
+    Only extract the regular files, directories and links that stay
+    within the snapshot root being extracted to `dest`.  The members are
+    checked one by one as they are extracted, so that a link may not be
+    followed out of the root by the ones that come after it.
+    """
+    for member in archive:
+        path = os.path.join(dest, member.name)
+        if os.path.isabs(member.name) or not within(path, dest):
+            continue
+        if member.issym():
+            target = os.path.join(os.path.dirname(path), member.linkname)
+            if os.path.isabs(member.linkname) or not within(target, dest):
+                continue
+        elif member.islnk():
+            target = os.path.join(dest, member.linkname)
+            if os.path.isabs(member.linkname) or not within(target, dest):
+                continue
+        elif not (member.isfile() or member.isdir()):
+            continue
+        member.mode = member.mode & 0o755 | 0o600
+        yield member
+
+
+def extract(path, dest):
+    """
+    Extract a snapshot archive, also letting the tarfile module reject
+    anything outside of `dest` if it knows how to.
+    """
+    with tarfile.open(path, mode='r:*') as archive:
+        members = safe_members(archive, dest)
+        if hasattr(tarfile, 'data_filter'):
+            archive.extractall(dest, members=members, filter='data')
+        else:
+            archive.extractall(dest, members=members)
+
+
+def parse_bypassed(value):
+    """
+    Split the bypassed_checks config value into the bypass names.
+    """
+    return sorted(set(word for word in re.split(r'[\s,]+', value or '')
+                      if word and word != 'none'))
+
+
+def load_config(fname):
+    """
+    Build the charm configuration from the config.yaml defaults and the
+    overrides in the specified YAML (or JSON) file, if any.
+    """
+    with open('config.yaml', mode='r') as f:
+        options = yaml.safe_load(f)['options']
+    config = dict((name, opt.get('default'))
+                  for (name, opt) in options.items())
+    if fname is not None:
+        with open(fname, mode='r') as f:
+            config.update(yaml.safe_load(f) or {})
+    return config
+
+
+def plan_snapshot(job):
+    """
+    Plan a single host, extracting its snapshot first if needed.
+
+    Return a tuple with the host name and the plan.
+    """
+    (path, config, bypassed, own_hugepages_mb, templates_dir) = job
+    name = host_name(path)
+    tempdir = None
+    try:
+        if os.path.isdir(path):
+            root = path
+        else:
+            tempdir = tempfile.mkdtemp(prefix='fleet-plan-')
+            extract(path, tempdir)
+            root = tempdir
+        res = spplan.plan_host(root, config, bypassed=bypassed,
+                               own_hugepages_mb=own_hugepages_mb,
+                               templates_dir=templates_dir)
+    except Exception as e:
+        res = {'ok': False, 'error': 'Could not plan the {path} snapshot: '
+               '{e}'.format(path=path, e=e)}
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir, ignore_errors=True)
+    return (name, res)
+
+
+def compare(baseline_dir, name, res):
+    """
+    Compare a host's plan with its baseline one.
+
+    Return the names of the changed keys, None if there is no baseline.
+    """
+    fname = os.path.join(baseline_dir, name + '.json')
+    if not os.path.isfile(fname):
+        return None
+    with open(fname, mode='r') as f:
+        base = json.load(f)
+    return [key for key in COMPARE_KEYS if base.get(key) != res.get(key)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Plan the storpool-common configuration of many hosts '
+                    'from snapshots of their /proc, sysfs and /etc trees')
+    parser.add_argument('-b', '--baseline', type=str,
+                        help='a directory with earlier plans to compare with')
+    parser.add_argument('-c', '--config', type=str,
+                        help='a YAML file with charm config overrides')
+    parser.add_argument('-H', '--own-hugepages', type=int, default=0,
+                        help='the megabytes of hugepages already reserved '
+                             'by the charm on the hosts')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='the number of hosts to plan in parallel')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='the directory to write the plans to')
+    parser.add_argument('-J', '--json', action='store_true',
+                        help='output the summary in JSON format')
+    parser.add_argument('snapshots', nargs='+',
+                        help='the host snapshot directories or archives')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    bypassed = parse_bypassed(config.get('bypassed_checks'))
+    templates_dir = os.path.realpath('templates')
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    summary = {'ok': [], 'error': {}, 'changed': {}, 'missing': {},
+               'recommended': {}}
+    jobs = [(path, config, bypassed, args.own_hugepages, templates_dir)
+            for path in args.snapshots]
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        results = executor.map(plan_snapshot, jobs,
+                               chunksize=max(1, len(jobs) // (args.jobs * 8)))
+        for (name, res) in results:
+            with open(os.path.join(args.output, name + '.json'),
+                      mode='w') as f:
+                json.dump(res, f, indent=2, sort_keys=True)
+            if res['ok']:
+                summary['ok'].append(name)
+            else:
+                summary['error'][name] = res['error']
+            for key in ('missing', 'recommended'):
+                for param in res.get('kernel', {}).get(key, []):
+                    summary[key].setdefault(param, []).append(name)
+            if args.baseline is not None:
+                changed = compare(args.baseline, name, res)
+                if changed:
+                    summary['changed'][name] = changed
+
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print('{ok} of {total} hosts planned'
+              .format(ok=len(summary['ok']), total=len(jobs)))
+        for (name, error) in sorted(summary['error'].items()):
+            print('{name}: {error}'.format(name=name, error=error))
+        for key in ('missing', 'recommended'):
+            for (param, names) in sorted(summary[key].items()):
+                print('{key} kernel parameter {param}: {count} hosts'
+                      .format(key=key, param=param, count=len(names)))
+        if args.baseline is not None:
+            print('{count} hosts changed since the baseline'
+                  .format(count=len(summary['changed'])))
+            for (name, keys) in sorted(summary['changed'].items()):
+                print('{name}: {keys}'.format(name=name, keys=', '.join(keys)))
+    return 1 if summary['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
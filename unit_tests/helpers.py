@@ -0,0 +1,86 @@
+"""
+The fixtures shared by the unit tests of the charm's helper modules.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from charmhelpers.core import unitdata
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import sysutil as spsysutil
+
+TB = 1000 * 1000 * 1000 * 1000
+
+
+def make_topology(drives, ifaces):
+    """
+    Describe a dual-socket host with 8 cores and 16 threads per socket
+    and the specified number of 4TB NVMe drives and NICs.
+    """
+    return {
+        'nodes': {
+            0: list(range(0, 8)) + list(range(16, 24)),
+            1: list(range(8, 16)) + list(range(24, 32)),
+        },
+        'cores': [[cpu, cpu + 16] for cpu in range(16)],
+        'ifaces': dict(('eth{idx}'.format(idx=idx), 1)
+                       for idx in range(ifaces)),
+        'drives': dict(('nvme{idx}n1'.format(idx=idx), 1)
+                       for idx in range(drives)),
+        'drive_sizes': dict(('nvme{idx}n1'.format(idx=idx), 4 * TB)
+                            for idx in range(drives)),
+    }
+
+
+class FakeRootTestCase(unittest.TestCase):
+    """
+    A test case that builds a fake /proc, sysfs and /etc tree in a
+    temporary directory and keeps the charm's unit data in memory.
+    """
+    prefix = 'sptest-'
+
+    def setUp(self):
+        super(FakeRootTestCase, self).setUp()
+        self.root = tempfile.mkdtemp(prefix=self.prefix)
+        self.addCleanup(shutil.rmtree, self.root)
+
+        self.kv = unitdata.Storage(':memory:')
+        patcher = mock.patch('charmhelpers.core.unitdata.kv',
+                             new=lambda: self.kv)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def path(self, path):
+        """
+        Return the full path of a file in the fake tree.
+        """
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def write(self, path, value):
+        """
+        Create a file in the fake tree, adding the final newline that
+        the kernel's files have if it is missing.
+        """
+        fname = self.path(path)
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        if value and not value.endswith('\n'):
+            value += '\n'
+        with open(fname, mode='w') as f:
+            f.write(value)
+
+    def read(self, path):
+        """
+        Read a value from the fake tree; for the files that list the
+        choices, return the selected one.
+        """
+        return spsysutil.read_value(self.path(path))
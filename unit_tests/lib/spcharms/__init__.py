@@ -1,7 +1,12 @@
 #!/usr/bin/python
 
+import os
+
 import mock
 
+# Let the tests reach the real modules that this layer adds to spcharms.
+__path__.append(os.path.realpath('lib/spcharms'))
+
 config = mock.Mock()
 repo = mock.Mock()
 states = mock.Mock()
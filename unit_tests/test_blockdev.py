@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool drive queue tuning.
+"""
+
+import os
+import sys
+
+from charmhelpers.core import templating
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import blockdev as spblockdev
+
+
+class TestBlockdev(helpers.FakeRootTestCase):
+    """
+    Test the block queue tuning against a fake sysfs tree.
+    """
+    prefix = 'spblockdev-'
+
+    def setUp(self):
+        super(TestBlockdev, self).setUp()
+        self.add_drive('nvme0n1', '0', '[none] mq-deadline', 'eui.0001')
+        self.add_drive('sda', '0', '[mq-deadline] none', None)
+        self.add_drive('sdb', '1', 'mq-deadline kyber [bfq] none',
+                       'naa.5000c500a1b2c3d4')
+        self.add_drive('sdc', '1', 'noop deadline [cfq]', None)
+        self.write('sys/block/nvme0n1/queue/nr_requests', '1023')
+
+    def add_drive(self, name, rotational, scheduler, wwid):
+        queue = 'sys/block/{name}/queue/'.format(name=name)
+        self.write(queue + 'rotational', rotational)
+        self.write(queue + 'scheduler', scheduler)
+        self.write(queue + 'nr_requests', '64')
+        self.write(queue + 'read_ahead_kb', '128')
+        self.write(queue + 'rq_affinity', '1')
+        if wwid is not None:
+            wpath = 'wwid' if name.startswith('nvme') else 'device/wwid'
+            self.write('sys/block/{name}/{wpath}'
+                       .format(name=name, wpath=wpath), wwid)
+
+    def test_plan(self):
+        """
+        Test the device classes and the scheduler selection.
+        """
+        tuning = spblockdev.plan(['nvme0n1', 'sda', 'sdb', 'sdc'], self.root)
+        self.assertEqual({
+            'nvme0n1': spblockdev.CLASS_NVME,
+            'sda': spblockdev.CLASS_SSD,
+            'sdb': spblockdev.CLASS_HDD,
+            'sdc': spblockdev.CLASS_HDD,
+        }, dict((name, data['class']) for (name, data) in tuning.items()))
+        self.assertEqual('eui.0001', tuning['nvme0n1']['wwid'])
+        self.assertIsNone(tuning['sda']['wwid'])
+        self.assertEqual(('scheduler', 'none'), tuning['sda']['settings'][0])
+        # The hardware queue depth is left alone without a scheduler.
+        self.assertNotIn('nr_requests', dict(tuning['nvme0n1']['settings']))
+        self.assertNotIn('nr_requests', dict(tuning['sda']['settings']))
+        self.assertEqual(('scheduler', 'mq-deadline'),
+                         tuning['sdb']['settings'][0])
+        self.assertEqual('128',
+                         dict(tuning['sdb']['settings'])['read_ahead_kb'])
+        # The legacy block layer only has the single-queue schedulers.
+        self.assertEqual(('scheduler', 'deadline'),
+                         tuning['sdc']['settings'][0])
+        self.write('sys/block/nvme0n1/queue/scheduler', '[noop] deadline')
+        tuning = spblockdev.plan(['nvme0n1'], self.root)
+        self.assertEqual('1023',
+                         dict(tuning['nvme0n1']['settings'])['nr_requests'])
+        # No usable scheduler, leave it alone.
+        self.write('sys/block/sdc/queue/scheduler', 'noop [cfq]')
+        tuning = spblockdev.plan(['sdc'], self.root)
+        self.assertNotIn('scheduler', dict(tuning['sdc']['settings']))
+
+    def test_apply(self):
+        """
+        Test that only the differing parameters are written.
+        """
+        tuning = spblockdev.plan(['nvme0n1', 'sdb'], self.root)
+        res = spblockdev.apply(tuning, self.root)
+        self.assertEqual([
+            ('nvme0n1', 'read_ahead_kb', '128', '0'),
+            ('nvme0n1', 'rq_affinity', '1', '2'),
+            ('sdb', 'scheduler', 'bfq', 'mq-deadline'),
+            ('sdb', 'nr_requests', '64', '128'),
+        ], res['changed'])
+        self.assertEqual([], res['errors'])
+        self.assertEqual('mq-deadline',
+                         self.read('sys/block/sdb/queue/scheduler'))
+
+        # Pretend that the kernel now reports the new scheduler.
+        self.write('sys/block/sdb/queue/scheduler',
+                   'mq-deadline kyber bfq [mq-deadline]')
+        res = spblockdev.apply(tuning, self.root)
+        self.assertEqual([], res['changed'])
+
+    def test_rules(self):
+        """
+        Test the generated udev rules.
+        """
+        tuning = spblockdev.plan(['nvme0n1', 'sda'], self.root)
+        rules = templating.render(
+            source='udev/storpool-block.rules', target=None,
+            context=spblockdev.rules_context(tuning),
+            templates_dir=os.path.realpath('templates'))
+        lines = [line for line in rules.split('\n')
+                 if line.startswith('ACTION')]
+        self.assertEqual(2, len(lines))
+        self.assertIn('ATTRS{wwid}=="eui.0001"', lines[0])
+        self.assertIn('ATTR{queue/scheduler}="none"', lines[0])
+        self.assertIn('KERNEL=="sda"', lines[1])
+        self.assertTrue(lines[1].endswith('ATTR{queue/rq_affinity}="2"'))
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the live cgroup reconciliation.
+"""
+
+import os
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import cgapply as spcgapply
+from spcharms import cgroups as spcgroups
+
+TDATA = {
+    'cpu_storpool': '8-9',
+    'cpu_rest': '0-7,10-15',
+    'mems_storpool': '1',
+    'mems_all': '0-1',
+    'storpool_groups': [
+        {'name': 'rdma', 'cpus': '8'},
+        {'name': 'beacon', 'cpus': '8'},
+        {'name': 'block', 'cpus': '9'},
+    ],
+    'mem_system': 4096,
+    'mem_user': 4096,
+    'mem_storpool': 2048,
+    'mem_machine': 16384,
+}
+
+MB = 1024 * 1024
+
+
+class TestCGApply(helpers.FakeRootTestCase):
+    """
+    Test the reconciliation against a fake cgroupfs tree.
+    """
+    prefix = 'spcgapply-'
+
+    def setUp(self):
+        super(TestCGApply, self).setUp()
+
+    def make_v1(self):
+        """
+        Build a cgroup v1 tree as left by the old fixed configuration,
+        with a running virtual machine pinned to a couple of CPUs.
+        """
+        for group in ('storpool.slice', 'storpool.slice/rdma',
+                      'storpool.slice/beacon', 'storpool.slice/block'):
+            self.write('cpuset/' + group + '/cpuset.mems', '0')
+        self.write('cpuset/storpool.slice/cpuset.cpus', '0-2')
+        self.write('cpuset/storpool.slice/rdma/cpuset.cpus', '0')
+        self.write('cpuset/storpool.slice/beacon/cpuset.cpus', '1')
+        self.write('cpuset/storpool.slice/block/cpuset.cpus', '2')
+        self.write('memory/storpool.slice/memory.limit_in_bytes',
+                   str(1024 * MB))
+        self.write('memory/storpool.slice/memory.memsw.limit_in_bytes',
+                   str(1024 * MB))
+        for name in ('machine', 'system', 'user'):
+            self.write('cpuset/{name}.slice/cpuset.cpus'.format(name=name),
+                       '3-15')
+            self.write('cpuset/{name}.slice/cpuset.mems'.format(name=name),
+                       '0')
+            self.write('memory/{name}.slice/memory.limit_in_bytes'
+                       .format(name=name), str(4096 * MB))
+            self.write('memory/{name}.slice/memory.memsw.limit_in_bytes'
+                       .format(name=name), str(4096 * MB))
+        self.write('memory/machine.slice/memory.limit_in_bytes',
+                   str(20480 * MB))
+        self.write('memory/machine.slice/memory.memsw.limit_in_bytes',
+                   str(20480 * MB))
+
+        vm = 'cpuset/machine.slice/machine-qemu-1.scope'
+        self.write(vm + '/cpuset.cpus', '3-15')
+        self.write(vm + '/cpuset.mems', '0')
+        self.write(vm + '/vcpu0/cpuset.cpus', '8')
+        self.write(vm + '/vcpu0/cpuset.mems', '0')
+        self.write(vm + '/vcpu1/cpuset.cpus', '4-5')
+        self.write(vm + '/vcpu1/cpuset.mems', '0')
+
+    def test_v1(self):
+        """
+        Test that only the changed attributes are written, that the VMs
+        are moved off the StorPool CPUs, and that a second pass is a no-op.
+        """
+        self.make_v1()
+        res = spcgapply.reconcile(spcgroups.desired_v1(TDATA), self.root)
+        self.assertEqual([], res['errors'])
+        self.assertEqual([], res['missing'])
+
+        self.assertEqual('8-9', self.read('cpuset/storpool.slice/cpuset.cpus'))
+        self.assertEqual('1', self.read('cpuset/storpool.slice/cpuset.mems'))
+        self.assertEqual('8',
+                         self.read('cpuset/storpool.slice/rdma/cpuset.cpus'))
+        self.assertEqual('9',
+                         self.read('cpuset/storpool.slice/block/cpuset.cpus'))
+        self.assertEqual(str(2048 * MB),
+                         self.read('memory/storpool.slice/'
+                                   'memory.memsw.limit_in_bytes'))
+
+        vm = 'cpuset/machine.slice/machine-qemu-1.scope'
+        self.assertEqual('0-7,10-15',
+                         self.read('cpuset/machine.slice/cpuset.cpus'))
+        self.assertEqual('0-7,10-15', self.read(vm + '/cpuset.cpus'))
+        self.assertEqual('0-1', self.read(vm + '/cpuset.mems'))
+        # The vCPU pinned to a StorPool CPU gets the whole VM set...
+        self.assertEqual('0-7,10-15', self.read(vm + '/vcpu0/cpuset.cpus'))
+        # ...while the other one keeps its pinning.
+        self.assertEqual('4-5', self.read(vm + '/vcpu1/cpuset.cpus'))
+
+        changed = [(path, attr) for (path, attr, _, _) in res['changed']]
+        self.assertIn((vm + '/vcpu0', 'cpuset.cpus'), changed)
+        self.assertNotIn((vm + '/vcpu1', 'cpuset.cpus'), changed)
+        self.assertNotIn(('memory/system.slice', 'memory.limit_in_bytes'),
+                         changed)
+        self.assertIn(('memory/machine.slice', 'memory.limit_in_bytes'),
+                      changed)
+
+        res = spcgapply.reconcile(spcgroups.desired_v1(TDATA), self.root)
+        self.assertEqual({'changed': [], 'missing': [], 'errors': []}, res)
+
+    def test_memory_order(self):
+        """
+        Test that the v1 memory and memory+swap limits are written in
+        an order that the kernel accepts.
+        """
+        attrs = [('memory.limit_in_bytes', str(2048 * MB)),
+                 ('memory.memsw.limit_in_bytes', str(2048 * MB))]
+        cgdir = os.path.join(self.root, 'memory/storpool.slice')
+        self.write('memory/storpool.slice/memory.limit_in_bytes',
+                   str(1024 * MB))
+        self.assertEqual('memory.memsw.limit_in_bytes',
+                         spcgapply.order_attrs(cgdir, attrs)[0][0])
+        self.write('memory/storpool.slice/memory.limit_in_bytes',
+                   str(4096 * MB))
+        self.assertEqual('memory.limit_in_bytes',
+                         spcgapply.order_attrs(cgdir, attrs)[0][0])
+
+    def test_v2(self):
+        """
+        Test the unified hierarchy, including cgroups that do not exist
+        yet and children that inherit their parent's cpuset.
+        """
+        self.write('storpool.slice/cpuset.cpus', '')
+        self.write('storpool.slice/cpuset.mems', '')
+        self.write('storpool.slice/memory.min', '0')
+        self.write('storpool.slice/memory.max', 'max')
+        self.write('storpool.slice/cpu.weight', '100')
+        self.write('storpool.slice/io.weight', 'default 100')
+        self.write('machine.slice/cpuset.cpus', '')
+        self.write('machine.slice/memory.high', 'max')
+        self.write('machine.slice/io.weight', 'default 100')
+        self.write('machine.slice/machine-qemu-1.scope/cpuset.cpus', '')
+
+        res = spcgapply.reconcile(spcgroups.desired_v2(TDATA), self.root)
+        self.assertEqual([], res['errors'])
+        self.assertEqual(['storpool.slice/storpool-beacon.slice',
+                          'storpool.slice/storpool-block.slice',
+                          'storpool.slice/storpool-rdma.slice',
+                          'system.slice', 'user.slice'], res['missing'])
+        self.assertEqual('8-9', self.read('storpool.slice/cpuset.cpus'))
+        self.assertEqual(str(2048 * MB),
+                         self.read('storpool.slice/memory.min'))
+        self.assertEqual('1000', self.read('storpool.slice/io.weight'))
+        self.assertEqual(str(16384 * MB),
+                         self.read('machine.slice/memory.high'))
+        self.assertEqual('', self.read('machine.slice/machine-qemu-1.scope/'
+                                       'cpuset.cpus'))
+
+        # "default 100" is the same as "100"
+        self.write('machine.slice/io.weight', 'default 100\n8:0 200')
+        res = spcgapply.reconcile(spcgroups.desired_v2(TDATA), self.root)
+        self.assertEqual([], res['changed'])
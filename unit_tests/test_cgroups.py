@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the cgroup backend helpers.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import jinja2
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import cgroups as spcgroups
+
+TDATA = {
+    'cpu_storpool': '8-10',
+    'cpu_rest': '0-7,11-15,24-31',
+    'mems_storpool': '1',
+    'mems_all': '0,1',
+    'storpool_groups': [
+        {'name': 'rdma', 'cpus': '8'},
+        {'name': 'beacon', 'cpus': '8'},
+        {'name': 'block', 'cpus': '9'},
+        {'name': 'server', 'cpus': '10'},
+    ],
+    'mem_system': 4096,
+    'mem_user': 2048,
+    'mem_storpool': 5120,
+    'mem_machine': 200000,
+}
+
+
+class TestCGroups(unittest.TestCase):
+    """
+    Test the cgroup backend selection and the systemd slice files.
+    """
+    def test_detect(self):
+        """
+        Test the detection of the unified cgroup hierarchy.
+        """
+        root = tempfile.mkdtemp(prefix='spcgroups-')
+        try:
+            os.makedirs(os.path.join(root, 'sys/fs/cgroup/unified'))
+            self.assertEqual(spcgroups.BACKEND_V1,
+                             spcgroups.detect_backend(root))
+            with open(os.path.join(root, 'sys/fs/cgroup/cgroup.controllers'),
+                      mode='w') as f:
+                f.write('cpuset cpu io memory pids\n')
+            self.assertEqual(spcgroups.BACKEND_V2,
+                             spcgroups.detect_backend(root))
+        finally:
+            shutil.rmtree(root)
+
+        params = ('swapaccount=1', 'nofb')
+        self.assertEqual(params, spcgroups.required_params(params, 'v1'))
+        self.assertEqual(('nofb',), spcgroups.required_params(params, 'v2'))
+
+    def test_v2_files(self):
+        """
+        Test the generation of the systemd slice units and drop-ins.
+        """
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(os.path.realpath('templates')))
+        files = dict(
+            (dst, env.get_template(source).render(context))
+            for (source, dst, context) in spcgroups.v2_files(TDATA)
+        )
+        self.assertEqual(sorted([
+            '/etc/systemd/system/storpool.slice',
+            '/etc/systemd/system/storpool-rdma.slice',
+            '/etc/systemd/system/storpool-beacon.slice',
+            '/etc/systemd/system/storpool-block.slice',
+            '/etc/systemd/system/storpool-server.slice',
+            '/etc/systemd/system/machine.slice.d/50-storpool-common.conf',
+            '/etc/systemd/system/system.slice.d/50-storpool-common.conf',
+            '/etc/systemd/system/user.slice.d/50-storpool-common.conf',
+        ]), sorted(files.keys()))
+
+        storpool = files['/etc/systemd/system/storpool.slice'].split('\n')
+        for line in ('AllowedCPUs=8-10', 'AllowedMemoryNodes=1',
+                     'MemoryMin=5120M', 'CPUWeight=1000', 'IOWeight=1000'):
+            self.assertIn(line, storpool)
+
+        block = files['/etc/systemd/system/storpool-block.slice'].split('\n')
+        self.assertIn('AllowedCPUs=9', block)
+
+        machine = files['/etc/systemd/system/machine.slice.d/'
+                        '50-storpool-common.conf'].split('\n')
+        for line in ('AllowedCPUs=0-7,11-15,24-31', 'AllowedMemoryNodes=0,1',
+                     'MemoryHigh=200000M', 'CPUWeight=100'):
+            self.assertIn(line, machine)
+        self.assertEqual([], [line for line in machine
+                              if line.startswith('MemoryMax=')])
+
+        user = files['/etc/systemd/system/user.slice.d/'
+                     '50-storpool-common.conf'].split('\n')
+        self.assertIn('MemoryMax=2048M', user)
+        self.assertNotIn('', user[:-1])
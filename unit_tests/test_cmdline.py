@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the kernel command line checks.
+"""
+
+import os
+import sys
+import unittest
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import cmdline as spcmdline
+
+CMDLINE = 'BOOT_IMAGE=/vmlinuz-4.15.0 root=UUID=abcd ro swapaccount=1 ' \
+          'nofb vga=normal nomodeset video=vesafb:off i915.modeset=0 ' \
+          'isolcpus=domain,managed_irq,2-3 nohz-full=2-5 ' \
+          'intel_idle.max_cstate=0 processor.max_cstate=3 ' \
+          'quiet="a b" -- init-arg=1\n'
+
+REQUIRED = ('swapaccount=1', 'vga=normal', 'nofb', 'nomodeset',
+            'video=vesafb:off', 'i915.modeset=0')
+
+
+class TestCmdline(unittest.TestCase):
+    """
+    Test the parsing and checking of the kernel command line.
+    """
+    def test_parse(self):
+        """
+        Test the key/value parsing of /proc/cmdline.
+        """
+        params = spcmdline.parse(CMDLINE)
+        self.assertEqual('UUID=abcd', params['root'])
+        self.assertIsNone(params['nofb'])
+        self.assertEqual('vesafb:off', params['video'])
+        self.assertEqual('2-5', params['nohz_full'])
+        self.assertEqual('a b', params['quiet'])
+        self.assertNotIn('init_arg', params)
+
+    def test_required(self):
+        """
+        Test that the required parameters are matched exactly.
+        """
+        params = spcmdline.parse(CMDLINE)
+        rules = spcmdline.required_rules(REQUIRED)
+        self.assertEqual([], spcmdline.check(params, rules))
+
+        params = spcmdline.parse(CMDLINE.replace('vga=normal', 'vga=791')
+                                 .replace('nofb ', ''))
+        missing = spcmdline.check(params, rules)
+        self.assertEqual(['vga', 'nofb'], [prob['key'] for prob in missing])
+        self.assertEqual('791', missing[0]['current'])
+        self.assertEqual('required', missing[0]['severity'])
+        self.assertEqual('vga=normal nofb', spcmdline.suggestion(missing))
+
+    def test_recommended(self):
+        """
+        Test the CPU list and C-state matching of the recommended
+        parameters and the suggested values.
+        """
+        params = spcmdline.parse(CMDLINE)
+        missing = spcmdline.check(params,
+                                  spcmdline.recommended_rules([2, 3, 4]))
+        self.assertEqual(['recommended'],
+                         list(set(prob['severity'] for prob in missing)))
+        # nohz_full and intel_idle.max_cstate are fine.
+        self.assertEqual('isolcpus=domain,managed_irq,2-4 rcu_nocbs=2-4 '
+                         'processor.max_cstate=1 iommu=pt',
+                         spcmdline.suggestion(missing))
+        self.assertEqual([True, False, True, False],
+                         [prob['present'] for prob in missing])
+
+        params = spcmdline.parse('root=/dev/sda1 isolcpus=2-4 '
+                                 'nohz_full=2-4 rcu_nocbs=0-7 iommu=pt '
+                                 'intel_idle.max_cstate=1 '
+                                 'processor.max_cstate=1')
+        self.assertEqual([], spcmdline.check(
+            params, spcmdline.recommended_rules([2, 3, 4])))
@@ -4,13 +4,15 @@
 A set of unit tests for the storpool-common layer.
 """
 
+import contextlib
+import itertools
 import os
 import sys
 import unittest
 
 import mock
 
-from charmhelpers.core import hookenv
+from charmhelpers.core import hookenv, unitdata
 
 root_path = os.path.realpath('.')
 if root_path not in sys.path:
@@ -20,8 +22,21 @@ lib_path = os.path.realpath('unit_tests/lib')
 if lib_path not in sys.path:
     sys.path.insert(0, lib_path)
 
+from spcharms import blockdev as spblockdev
 from spcharms import config as spconfig
+from spcharms import drift as spdrift
+from spcharms import hugepages as sphugepages
+from spcharms import irqs as spirqs
+from spcharms import manifest as spmanifest
+from spcharms import memplan as spmemplan
+from spcharms import mempolicy as spmempolicy
+from spcharms import netdev as spnetdev
+from spcharms import plan as spplan
+from spcharms import power as sppower
 from spcharms import repo as sprepo
+from spcharms import rsyslog as sprsyslog
+from spcharms import settings as spsettings
+from spcharms import slicemetrics as spslicemetrics
 from spcharms import status as spstatus
 from spcharms import txn
 from spcharms import utils as sputils
@@ -125,8 +140,23 @@ KERNEL_PARAMS = 'initrd=something swapaccount=1 root=something.else nofb ' \
                 'vga=normal nomodeset video=vesafb:off i915.modeset=0'
 COMBINED_LINE = 'MemTotal: 20000 M\nprocessor : 0\n'
 CGCONFIG_BASE = '/usr/share/doc/storpool/examples/cgconfig/ubuntu1604'
+TOPOLOGY = {'nodes': {0: [0]}, 'cores': [[0]], 'ifaces': {}, 'drives': {},
+            'drive_sizes': {}}
 OS_STAT_RESULT = os.stat('/etc/passwd')
 
+# The install_package() phases that configure the host from the plan.
+PHASES = (
+    'install_hugepages',
+    'install_cgconfig',
+    'install_slices',
+    'apply_cgroups',
+    'configure_irqs',
+    'configure_nics',
+    'configure_block_queues',
+    'configure_power',
+    'configure_mempolicy',
+)
+
 
 class TestStorPoolCommon(unittest.TestCase):
     """
@@ -141,18 +171,74 @@ class TestStorPoolCommon(unittest.TestCase):
         r_config.r_clear_config()
         sputils.err.side_effect = lambda *args: self.fail_on_err(*args)
 
+        # Keep the file manifest in memory.
+        self.kv = unitdata.Storage(':memory:')
+        self.start_patch(mock.patch('charmhelpers.core.unitdata.kv',
+                                    new=lambda: self.kv))
+        # The files on disk are the ones that we installed.
+        self.start_patch(mock.patch(
+            'spcharms.manifest.file_digest',
+            new=lambda path: self.kv.get(spmanifest.KV_PREFIX + path,
+                                         {}).get('digest')))
+        self.txn_install = self.start_patch(mock.patch.object(txn,
+                                                              'install'))
+        self.npset = self.start_patch(mock.patch.object(spstatus, 'npset'))
+        self.check_call = self.start_patch(
+            mock.patch('subprocess.check_call'))
+        # The directories of the installed files are already there.
+        self.start_patch(mock.patch('os.path.isdir', return_value=True))
+
+    def start_patch(self, patcher):
+        """
+        Start a patcher and stop it when the test is done.
+        """
+        res = patcher.start()
+        self.addCleanup(patcher.stop)
+        return res
+
+    def patch_phases(self):
+        """
+        Replace the install_package() phases that set up the host.
+        """
+        return dict((name, self.start_patch(mock.patch.object(testee, name)))
+                    for name in PHASES)
+
+    def installed(self):
+        """
+        List the files installed via txn.install since the last check.
+        """
+        res = [call[0][-1] for call in self.txn_install.call_args_list]
+        self.txn_install.reset_mock()
+        return res
+
+    def patch_open(self, mock_file):
+        """
+        Hand the same file contents to the layer and the inventory.
+        """
+        stack = contextlib.ExitStack()
+        for name in ('reactive.storpool_common.open',
+                     'spcharms.inventory.open'):
+            stack.enter_context(mock.patch(name, mock_file, create=True))
+        return stack
+
     def fail_on_err(self, msg):
         self.fail('sputils.err() invoked: {msg}'.format(msg=msg))
 
     @mock_reactive_states
-    @mock.patch('charmhelpers.core.templating.render')
-    @mock.patch('os.path.isdir')
-    @mock.patch('os.walk')
+    @mock.patch.object(sprepo, 'record_packages')
+    @mock.patch.object(sprepo, 'install_packages')
+    @mock.patch('spcharms.hugepages.total_mb')
+    @mock.patch('spcharms.inventory.fingerprint')
+    @mock.patch('spcharms.pkgcheck.installed_versions')
+    @mock.patch('spcharms.cgroups.detect_backend')
+    @mock.patch('spcharms.topology.get_topology')
     @mock.patch('os.stat')
     @mock.patch('subprocess.check_call')
     @mock.patch('charmhelpers.core.hookenv.log')
-    def test_install_package(self, h_log, check_call, os_stat, os_walk, isdir,
-                             render):
+    def test_install_package(self, h_log, check_call, os_stat, get_topology,
+                             detect_backend, installed_versions,
+                             inv_fingerprint, hp_total, install_packages,
+                             record_packages):
         """
         Test that the layer attempts to install packages correctly.
         """
@@ -161,25 +247,31 @@ class TestStorPoolCommon(unittest.TestCase):
         count_install = sprepo.install_packages.call_count
         count_record = sprepo.record_packages.call_count
         count_call = check_call.call_count
-        count_txn_install = txn.install.call_count
 
-        files_list = [
-            ('', ['etc', 'usr'], []),
-            ('/etc', ['cgconfig.d'], ['machine-cgsetup.conf']),
-            ('/etc/cgconfig.d', [], ['machine.slice.conf', 'something.else']),
-            ('/usr', [], []),
-        ]
-        os_walk.return_value = list(map(lambda i: (CGCONFIG_BASE + i[0],
-                                                   i[1],
-                                                   i[2]),
-                                        files_list))
+        install_hugepages = testee.install_hugepages
+        phases = self.patch_phases()
+        phases['install_hugepages'].return_value = None
+        phases['configure_irqs'].return_value = {}
+        # The kernel modules' dependency file exists.
         os_stat.return_value = OS_STAT_RESULT
-        isdir.return_value = True
+        get_topology.return_value = TOPOLOGY
+        installed_versions.return_value = {}
+        detect_backend.return_value = 'v1'
+        # Collect the inventory anew every time, the files change.
+        inv_fingerprint.side_effect = itertools.count()
+        hp_total.return_value = 0
+        release = os.uname().release
+
+        def reset():
+            for mocked in [h_log, self.npset, check_call,
+                           install_packages, record_packages] + \
+                    list(phases.values()):
+                mocked.reset_mock()
+            r_state.r_clear_states()
 
         # Missing kernel parameters, not bypassed, error.
         mock_file = mock.mock_open(read_data='no such parameters')
-        with mock.patch('reactive.storpool_common.open', mock_file,
-                        create=True):
+        with self.patch_open(mock_file):
             sputils.bypassed.return_value = False
             self.assertRaises(AssertionError, testee.install_package)
             self.assertEquals(count_npset, spstatus.npset.call_count)
@@ -192,8 +284,7 @@ class TestStorPoolCommon(unittest.TestCase):
 
         # Missing kernel parameters, bypassed, no StorPool version
         mock_file = mock.mock_open(read_data='no such parameters')
-        with mock.patch('reactive.storpool_common.open', mock_file,
-                        create=True):
+        with self.patch_open(mock_file):
             sputils.bypassed.return_value = True
             testee.install_package()
             self.assertEquals(count_npset + 1, spstatus.npset.call_count)
@@ -206,8 +297,7 @@ class TestStorPoolCommon(unittest.TestCase):
 
         # Correct kernel parameters, no StorPool version
         mock_file = mock.mock_open(read_data=KERNEL_PARAMS)
-        with mock.patch('reactive.storpool_common.open', mock_file,
-                        create=True):
+        with self.patch_open(mock_file):
             sputils.bypassed.return_value = False
             testee.install_package()
             self.assertEquals(count_npset + 2, spstatus.npset.call_count)
@@ -226,8 +316,7 @@ class TestStorPoolCommon(unittest.TestCase):
         # Fail to intall the packages
         r_config.r_set('storpool_version', '16.02', False)
         mock_file = mock.mock_open(read_data=COMBINED_LINE)
-        with mock.patch('reactive.storpool_common.open', mock_file,
-                        create=True):
+        with self.patch_open(mock_file):
             sprepo.install_packages.return_value = ('oops', [])
             testee.install_package()
             self.assertEquals(count_npset + 4, spstatus.npset.call_count)
@@ -250,8 +339,7 @@ class TestStorPoolCommon(unittest.TestCase):
         # Installed the package correctly, `depmod -a` failed.
         sprepo.install_packages.return_value = (None, ['storpool-beacon'])
         mock_file = mock.mock_open(read_data=COMBINED_LINE)
-        with mock.patch('reactive.storpool_common.open', mock_file,
-                        create=True):
+        with self.patch_open(mock_file):
             check_call.side_effect = raise_notimp
             self.assertRaises(WeirdError, testee.install_package)
             self.assertEquals(count_npset + 7, spstatus.npset.call_count)
@@ -263,47 +351,805 @@ class TestStorPoolCommon(unittest.TestCase):
             self.assertEquals(count_call + 1, check_call.call_count)
             self.assertEquals(set(), r_state.r_get_states())
 
-        # Right, we may not be running on a StorPool host at all,
-        # so make sure that we know whether install_package() will
-        # warn about missing kernel parameters...
-        warn_count = 0
-        try:
-            lines = open('/proc/cmdline', mode='r').readlines()
-            line = lines[0]
-            words = line.split()
-            for param in testee.KERNEL_REQUIRED_PARAMS:
-                if param not in words:
-                    warn_count = 1
-                    break
-        except Exception:
-            pass
-
         # Go on then...
+        reset()
         check_call.side_effect = None
         mock_file = mock.mock_open(read_data=COMBINED_LINE)
+        with self.patch_open(mock_file):
+            testee.install_package()
+        install_packages.assert_called_once_with(mock.ANY)
+        check_call.assert_called_once_with(['depmod', '-a', release])
+        self.assertEqual(set([INSTALLED_STATE]), r_state.r_get_states())
+        self.npset.assert_called_with('maintenance', '')
+
+        mem_plan = spmemplan.recorded()
+        phases['install_hugepages'].assert_called_once_with(
+            0, mem_plan['sp_hugepages'])
+        ((tdata,), _) = phases['install_cgconfig'].call_args
+        self.assertEqual('0', tdata['cpu_storpool'])
+        self.assertEqual(['rdma', 'beacon', 'block'],
+                         [grp['name'] for grp in tdata['storpool_groups']])
+        self.assertEqual(mem_plan['machine'], tdata['mem_machine'])
+        phases['install_slices'].assert_not_called()
+        phases['apply_cgroups'].assert_called_once_with('v1', tdata)
+        ((topology, cpu_plan), _) = phases['configure_irqs'].call_args
+        self.assertEqual(TOPOLOGY, topology)
+        self.assertEqual([0], cpu_plan['cpus'])
+        phases['configure_nics'].assert_called_once_with(TOPOLOGY, cpu_plan)
+        phases['configure_block_queues'].assert_called_once_with(TOPOLOGY)
+        phases['configure_power'].assert_called_once_with([0])
+        phases['configure_mempolicy'].assert_called_once_with()
+        h_log.assert_any_call(
+            'Recommended kernel parameters for StorPool, add to the '
+            'kernel command line: isolcpus=0 nohz_full=0 rcu_nocbs=0 '
+            'intel_idle.max_cstate=1 processor.max_cstate=1 iommu=pt',
+            hookenv.WARNING)
+
+        # The unified hierarchy is set up through systemd slices.
+        reset()
+        detect_backend.return_value = 'v2'
+        with self.patch_open(mock_file):
+            testee.install_package()
+        phases['install_cgconfig'].assert_not_called()
+        ((tdata,), _) = phases['install_slices'].call_args
+        phases['apply_cgroups'].assert_called_once_with('v2', tdata)
+        detect_backend.return_value = 'v1'
+
+        # Record the installed package versions; the kernel modules did
+        # not change, so no depmod...
+        reset()
+        installed_versions.side_effect = lambda names, root='/': \
+            dict((name, '16.02.1-1') for name in names)
+        with self.patch_open(mock_file):
+            testee.install_package()
+        install_packages.assert_called_once_with(mock.ANY)
+        check_call.assert_not_called()
+        phases['install_cgconfig'].assert_called_once_with(mock.ANY)
+        self.assertEqual(set([INSTALLED_STATE]), r_state.r_get_states())
+
+        # ...and do not invoke the package manager next time, but still
+        # configure the host.
+        reset()
+        with self.patch_open(mock_file):
+            testee.install_package()
+        install_packages.assert_not_called()
+        check_call.assert_not_called()
+        phases['install_cgconfig'].assert_called_once_with(mock.ANY)
+        self.assertEqual(set([INSTALLED_STATE]), r_state.r_get_states())
+
+        # A different StorPool version means a full installation.
+        reset()
+        r_config.r_set('storpool_version', '16.03', True)
+        with self.patch_open(mock_file):
+            testee.install_package()
+        install_packages.assert_called_once_with(mock.ANY)
+        check_call.assert_not_called()
+
+        # A new StorPool kernel module means a depmod for this kernel only.
+        reset()
+        install_packages.return_value = (None, ['kmod-storpool-' + release])
+        r_config.r_set('storpool_version', '16.04', True)
+        with self.patch_open(mock_file):
+            testee.install_package()
+        install_packages.assert_called_once_with(mock.ANY)
+        check_call.assert_called_once_with(['depmod', '-a', release])
+
+        # The kernel could only allocate some of the hugepages; the status
+        # is not cleared by the handler that runs next in the same hook...
+        reset()
+        phases['install_hugepages'].side_effect = install_hugepages
+        hp_apply = self.start_patch(mock.patch('spcharms.hugepages.apply'))
+        hp_apply.return_value = {0: {'wanted': 128, 'got': 100}}
+        self.start_patch(mock.patch('charmhelpers.core.templating.render',
+                                    return_value='contents\n'))
+        short = mock.call('blocked', 'StorPool hugepages only partially '
+                          'allocated: node 0: 200 of 256 MB')
+        with self.patch_open(mock_file):
+            testee.install_package()
+        self.assertEqual(short, self.npset.call_args)
+        self.assertEqual(set([INSTALLED_STATE]), r_state.r_get_states())
+        for name in ('install_rsyslog', 'install_sysctl',
+                     'install_slice_metrics'):
+            self.start_patch(mock.patch.object(testee, name,
+                                               return_value=False))
+        testee.copy_config_files()
+        self.assertEqual(short, self.npset.call_args)
+
+        # ...nor by the next hook...
+        reset()
+        with self.patch_open(mock_file):
+            testee.install_package()
+        testee.copy_config_files()
+        self.assertEqual(short, self.npset.call_args)
+
+        # ...until all the hugepages are allocated.
+        reset()
+        hp_apply.return_value = {0: {'wanted': 128, 'got': 128}}
+        with self.patch_open(mock_file):
+            testee.install_package()
+        self.npset.assert_called_with('maintenance', '')
+        testee.copy_config_files()
+        self.npset.assert_called_with('maintenance', '')
+        self.assertIsNone(self.kv.get(sphugepages.KV_SHORTFALL))
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('charmhelpers.core.host.service_resume')
+    @mock.patch('os.walk')
+    @mock.patch('os.stat')
+    def test_install_cgconfig(self, os_stat, os_walk, service_resume, render):
+        """
+        Test that the planned cgconfig files are generated, the rest copied
+        from the StorPool packages, and that the cgconfig service is only
+        started if they changed.
+        """
+        os_walk.return_value = [
+            (CGCONFIG_BASE, ['etc'], []),
+            (CGCONFIG_BASE + '/etc', ['cgconfig.d'],
+             ['machine-cgsetup.conf']),
+            (CGCONFIG_BASE + '/etc/cgconfig.d', [],
+             ['machine.slice.conf', 'something.else']),
+        ]
+        os_stat.return_value = OS_STAT_RESULT
+        render.return_value = 'contents\n'
+        tdata = {'cpu_storpool': '0'}
+
+        mock_file = mock.mock_open(read_data='copied\n')
         with mock.patch('reactive.storpool_common.open', mock_file,
                         create=True):
-            testee.install_package()
-            self.assertEquals(count_npset + 11, spstatus.npset.call_count)
-            self.assertEquals(count_log + 6, h_log.call_count)
-            self.assertEquals(count_install + 3,
-                              sprepo.install_packages.call_count)
-            self.assertEquals(count_record + 2,
-                              sprepo.record_packages.call_count)
-            self.assertEquals(count_call + 2 + warn_count,
-                              check_call.call_count)
-            self.assertEquals(count_txn_install + 3, txn.install.call_count)
-            self.assertEquals(set([INSTALLED_STATE]), r_state.r_get_states())
+            testee.install_cgconfig(tdata)
+            generated = [dst for (_, dst) in spplan.CGCONFIG_TEMPLATES]
+            self.assertEqual(generated + ['/etc/cgconfig.d/something.else'],
+                             self.installed())
+            self.assertEqual([src for (src, _) in spplan.CGCONFIG_TEMPLATES],
+                             [call[1]['source']
+                              for call in render.call_args_list])
+            self.assertEqual(tdata, render.call_args[1]['context'])
+            self.check_call.assert_called_once_with(
+                ['systemctl', 'daemon-reload'])
+            service_resume.assert_called_once_with('cgconfig')
+
+            # Nothing changed, nothing to do.
+            self.check_call.reset_mock()
+            testee.install_cgconfig(tdata)
+            self.assertEqual([], self.installed())
+            self.check_call.assert_not_called()
+            service_resume.assert_called_once_with('cgconfig')
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('os.makedirs')
+    @mock.patch('os.path.isdir')
+    def test_install_slices(self, isdir, makedirs, render):
+        """
+        Test that the layer sets up the unified hierarchy using systemd.
+        """
+        isdir.return_value = False
+        render.return_value = 'contents\n'
+
+        tdata = {
+            'cpu_storpool': '1-2',
+            'cpu_rest': '3-7',
+            'mems_storpool': '0',
+            'mems_all': '0',
+            'storpool_groups': [
+                {'name': 'rdma', 'cpus': '1'},
+                {'name': 'beacon', 'cpus': '1'},
+                {'name': 'block', 'cpus': '2'},
+            ],
+            'mem_system': 4096,
+            'mem_user': 4096,
+            'mem_storpool': 1024,
+            'mem_machine': 16384,
+        }
+        testee.install_slices(tdata)
+        installed = self.installed()
+        self.assertEqual(7, len(installed))
+        self.assertEqual('/etc/systemd/system/user.slice.d/'
+                         '50-storpool-common.conf', installed[-1])
+        makedirs.assert_any_call('/etc/systemd/system/machine.slice.d',
+                                 mode=0o755)
+        self.assertEqual('systemd/storpool-group.slice',
+                         render.call_args_list[1][1]['source'])
+        self.check_call.assert_called_once_with(['systemctl',
+                                                 'daemon-reload'])
+
+        # Nothing changed, nothing to do.
+        self.check_call.reset_mock()
+        testee.install_slices(tdata)
+        self.assertEqual([], self.installed())
+        self.check_call.assert_not_called()
+
+        # Only one file changed.
+        tdata['storpool_groups'][2]['cpus'] = '3'
+        render.side_effect = lambda **kwargs: \
+            'changed\n' if kwargs['context'].get('group', {}).get('cpus') \
+            == '3' else 'contents\n'
+        testee.install_slices(tdata)
+        self.assertEqual(['/etc/systemd/system/storpool-block.slice'],
+                         self.installed())
+        self.check_call.assert_called_once_with(['systemctl',
+                                                 'daemon-reload'])
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('spcharms.hugepages.others')
+    @mock.patch('spcharms.hugepages.apply')
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_install_hugepages(self, h_log, hp_apply, hp_others, render):
+        """
+        Test that the hugepages are reserved right now and at boot time.
+        """
+        render.return_value = 'contents\n'
+        hp_others.return_value = 20
+        hp_apply.return_value = {1: {'wanted': 128, 'got': 128}}
+        self.assertIsNone(testee.install_hugepages(1, 256))
+        hp_apply.assert_called_once_with({1: 128})
+        self.assertEqual({'hugepages': [
+            {'node': 1, 'pages': 128, 'path': sphugepages.nr_path(1),
+             'target': 148}]},
+            render.call_args[1]['context'])
+        self.assertEqual([sphugepages.SERVICE_FILE], self.installed())
+        self.assertEqual([
+            mock.call(['systemctl', 'daemon-reload']),
+            mock.call(['systemctl', 'enable', sphugepages.SERVICE_NAME]),
+        ], self.check_call.call_args_list)
+        h_log.assert_not_called()
+
+        # The unit has not changed; the kernel could not allocate them all.
+        self.check_call.reset_mock()
+        hp_apply.return_value = {1: {'wanted': 128, 'got': 100}}
+        self.assertEqual('node 1: 200 of 256 MB',
+                         testee.install_hugepages(1, 256))
+        self.assertEqual([], self.installed())
+        self.check_call.assert_not_called()
+        h_log.assert_called_once_with(
+            'Could not allocate all the StorPool hugepages, only got '
+            'node 1: 200 of 256 MB', hookenv.WARNING)
+        self.assertEqual('node 1: 200 of 256 MB',
+                         self.kv.get(sphugepages.KV_SHORTFALL))
+
+        # A later allocation succeeds, the shortfall is forgotten.
+        hp_apply.return_value = {1: {'wanted': 128, 'got': 128}}
+        self.assertIsNone(testee.install_hugepages(1, 256))
+        self.assertIsNone(self.kv.get(sphugepages.KV_SHORTFALL))
+
+    @mock.patch('os.unlink')
+    @mock.patch('os.path.exists')
+    @mock.patch('subprocess.call')
+    @mock.patch('spcharms.hugepages.release')
+    def test_remove_hugepages(self, hp_release, call, exists, unlink):
+        """
+        Test that the boot-time reservation is removed and the hugepages
+        given back.
+        """
+        hp_release.return_value = {0: {'wanted': 0, 'got': 0}}
+        exists.return_value = True
+        self.kv.set(sphugepages.KV_SHORTFALL, 'node 0: 200 of 256 MB')
+        testee.remove_hugepages()
+        self.assertEqual([
+            mock.call(['systemctl', 'disable', sphugepages.SERVICE_NAME]),
+            mock.call(['systemctl', 'daemon-reload']),
+        ], call.call_args_list)
+        unlink.assert_called_once_with(sphugepages.SERVICE_FILE)
+        hp_release.assert_called_once_with()
+        self.assertIsNone(self.kv.get(sphugepages.KV_SHORTFALL))
+
+        # Already removed, only release the pages.
+        call.reset_mock()
+        exists.return_value = False
+        testee.remove_hugepages()
+        call.assert_not_called()
+        self.assertEqual(1, unlink.call_count)
+        self.assertEqual(2, hp_release.call_count)
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('os.path.isdir')
+    @mock.patch('spcharms.irqs.irqbalance_overrides')
+    @mock.patch('spcharms.irqs.apply')
+    @mock.patch('spcharms.irqs.plan_irqs')
+    @mock.patch('spcharms.irqs.read_interrupts')
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_configure_irqs(self, h_log, read_interrupts, plan_irqs,
+                            irqs_apply, overrides, isdir, render):
+        """
+        Test that the interrupts are pinned, irqbalance is kept away from
+        them and the unmovable ones are not reported as pinned.
+        """
+        read_interrupts.return_value = {'cpus': [0, 1, 2, 3], 'irqs': {}}
+        plan_irqs.return_value = {30: [2], 31: [3]}
+        irqs_apply.return_value = {'changed': [(30, '0-3', '2')],
+                                   'errors': [(31, 'Input/output error')]}
+        isdir.return_value = True
+        render.return_value = 'contents\n'
+        overrides.return_value = []
+        cpu_plan = {'cpus': [2, 3], 'idle': [6, 7],
+                    'groups': {'rdma': [2], 'server': [3]}}
+
+        self.assertEqual({30: [2]}, testee.configure_irqs(TOPOLOGY, cpu_plan))
+        plan_irqs.assert_called_once_with(TOPOLOGY, cpu_plan,
+                                          read_interrupts.return_value)
+        irqs_apply.assert_called_once_with(plan_irqs.return_value)
+        self.assertEqual({'banned_cpulist': '2-3,6-7',
+                          'banned_cpumask': '000000cc',
+                          'banned_irqs': [30, 31]},
+                         render.call_args[1]['context'])
+        self.assertEqual([spirqs.IRQBALANCE_DROPIN], self.installed())
+        self.assertEqual([
+            mock.call(['systemctl', 'daemon-reload']),
+            mock.call(['systemctl', 'try-restart', 'irqbalance.service']),
+        ], self.check_call.call_args_list)
+
+        # irqbalance is only restarted if its settings changed.
+        self.check_call.reset_mock()
+        testee.configure_irqs(TOPOLOGY, cpu_plan)
+        self.assertEqual([], self.installed())
+        self.check_call.assert_not_called()
+        h_log.assert_not_called()
+
+        # The irqbalance environment file overrides the drop-in.
+        overrides.return_value = ['IRQBALANCE_ARGS']
+        testee.configure_irqs(TOPOLOGY, cpu_plan)
+        h_log.assert_called_once_with(
+            '/etc/default/irqbalance sets IRQBALANCE_ARGS, so irqbalance '
+            'may still move interrupts to the StorPool CPUs',
+            hookenv.WARNING)
+
+    @mock.patch('os.unlink')
+    @mock.patch('os.path.exists')
+    @mock.patch('subprocess.call')
+    @mock.patch('spcharms.irqs.restore')
+    def test_remove_irqs(self, irqs_restore, call, exists, unlink):
+        """
+        Test that the interrupts get their original affinity back and
+        irqbalance is let back onto the StorPool CPUs.
+        """
+        irqs_restore.return_value = {'changed': [(30, '2', '0-3')],
+                                     'errors': [(31, 'No such file')]}
+        exists.return_value = True
+        testee.remove_irqs()
+        irqs_restore.assert_called_once_with()
+        unlink.assert_called_once_with(spirqs.IRQBALANCE_DROPIN)
+        self.assertEqual([
+            mock.call(['systemctl', 'daemon-reload']),
+            mock.call(['systemctl', 'try-restart', 'irqbalance.service']),
+        ], call.call_args_list)
+
+        # The drop-in is already gone.
+        call.reset_mock()
+        exists.return_value = False
+        testee.remove_irqs()
+        self.assertEqual(2, irqs_restore.call_count)
+        self.assertEqual(1, unlink.call_count)
+        call.assert_not_called()
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('os.unlink')
+    @mock.patch('os.path.exists')
+    @mock.patch('os.path.isdir')
+    @mock.patch('spcharms.netdev.hooks')
+    @mock.patch('spcharms.netdev.apply')
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_configure_nics(self, h_log, nic_apply, nic_hooks, isdir,
+                            exists, unlink, render):
+        """
+        Test that the NIC tuning program, its settings and the link up
+        hooks of the installed network tools are installed and the
+        settings applied right away.
+        """
+        nic_hooks.return_value = list(spnetdev.HOOKS[:1])
+        exists.return_value = False
+        nic_apply.return_value = {
+            'changed': [('ens1', 'rx', 1024, 4096)],
+            'errors': [('ens1', 'adaptive-rx', 'Operation not supported')],
+        }
+        isdir.return_value = True
+        render.return_value = 'hook\n'
+        topology = dict(TOPOLOGY, ifaces={'ens1': 0})
+        cpu_plan = {'cpus': [2, 3], 'groups': {'rdma': [2]}}
+
+        testee.configure_nics(topology, cpu_plan)
+        nic_apply.assert_called_once_with(spnetdev.plan(['ens1'], [2]))
+        self.assertEqual(
+            [spnetdev.PROGRAM, spnetdev.SETTINGS_FILE, spnetdev.HOOKS[0]],
+            self.installed())
+        unlink.assert_not_called()
+        self.assertEqual({'program': spnetdev.PROGRAM,
+                          'settings': spnetdev.SETTINGS_FILE},
+                         render.call_args[1]['context'])
+        h_log.assert_called_once_with(
+            'Could not tune adaptive-rx for ens1: Operation not supported',
+            hookenv.WARNING)
+
+        # Nothing changed, nothing is reinstalled.
+        testee.configure_nics(topology, cpu_plan)
+        self.assertEqual([], self.installed())
+        self.assertEqual(2, nic_apply.call_count)
+
+        # networkd-dispatcher took over, the ifupdown hook is removed.
+        nic_hooks.return_value = list(spnetdev.HOOKS[1:])
+        exists.return_value = True
+        testee.configure_nics(topology, cpu_plan)
+        self.assertEqual(list(spnetdev.HOOKS[1:]), self.installed())
+        unlink.assert_called_once_with(spnetdev.HOOKS[0])
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('spcharms.blockdev.apply')
+    @mock.patch('spcharms.blockdev.plan')
+    def test_configure_block_queues(self, bd_plan, bd_apply, render):
+        """
+        Test that the udev rules are installed and reloaded and the queue
+        parameters applied right away.
+        """
+        bd_plan.return_value = {
+            'nvme0n1': {'class': 'nvme', 'wwid': 'eui.0001',
+                        'settings': [('scheduler', 'none'),
+                                     ('read_ahead_kb', '0')]},
+        }
+        bd_apply.return_value = {'changed': [], 'errors': []}
+        render.return_value = 'contents\n'
+        topology = dict(TOPOLOGY, drives={'nvme0n1': 0})
+
+        testee.configure_block_queues(topology)
+        bd_plan.assert_called_once_with(topology['drives'].keys())
+        bd_apply.assert_called_once_with(bd_plan.return_value)
+        self.assertEqual([spblockdev.UDEV_RULES], self.installed())
+        self.assertEqual([
+            mock.call(['udevadm', 'control', '--reload']),
+            mock.call(['udevadm', 'trigger', '--action=change',
+                       '--subsystem-match=block',
+                       '--sysname-match=nvme0n1']),
+        ], self.check_call.call_args_list)
+
+        # The rules have not changed, udev is left alone.
+        self.check_call.reset_mock()
+        testee.configure_block_queues(topology)
+        self.assertEqual([], self.installed())
+        self.check_call.assert_not_called()
+
+    @mock.patch('os.unlink')
+    @mock.patch('os.path.exists')
+    @mock.patch('subprocess.call')
+    def test_remove_block_tuning(self, call, exists, unlink):
+        """
+        Test that the udev rules are removed and udev reloaded.
+        """
+        exists.return_value = True
+        testee.remove_block_tuning()
+        unlink.assert_called_once_with(spblockdev.UDEV_RULES)
+        call.assert_called_once_with(['udevadm', 'control', '--reload'])
+
+        # Already removed.
+        call.reset_mock()
+        exists.return_value = False
+        testee.remove_block_tuning()
+        self.assertEqual(1, unlink.call_count)
+        call.assert_not_called()
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('spcharms.settings.apply')
+    @mock.patch('spcharms.power.plan')
+    def test_configure_power(self, power_plan, settings_apply, render):
+        """
+        Test that the power management settings are applied right now
+        and at boot time.
+        """
+        power_plan.return_value = {
+            'sys/devices/system/cpu/cpu0/cpufreq/scaling_governor':
+            'performance',
+        }
+        settings_apply.return_value = {'changed': [], 'errors': []}
+        render.return_value = 'contents\n'
+
+        testee.configure_power([0])
+        power_plan.assert_called_once_with([0])
+        settings_apply.assert_called_once_with(sppower.KV_KEY,
+                                               power_plan.return_value)
+        self.assertEqual(spsettings.SERVICE_TEMPLATE,
+                         render.call_args[1]['source'])
+        self.assertEqual(sppower.DESCRIPTION,
+                         render.call_args[1]['context']['description'])
+        self.assertEqual([sppower.SERVICE_FILE], self.installed())
+        self.assertEqual([
+            mock.call(['systemctl', 'daemon-reload']),
+            mock.call(['systemctl', 'enable', sppower.SERVICE_NAME]),
+        ], self.check_call.call_args_list)
+
+        # The boot-time service has not changed.
+        self.check_call.reset_mock()
+        testee.configure_power([0])
+        self.assertEqual([], self.installed())
+        self.check_call.assert_not_called()
+        self.assertEqual(2, settings_apply.call_count)
+
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('spcharms.settings.apply')
+    @mock.patch('spcharms.mempolicy.plan')
+    @mock.patch('spcharms.topology.parse_storpool_conf')
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_configure_mempolicy(self, h_log, parse_conf, mp_plan,
+                                 settings_apply, render):
+        """
+        Test that the memory management policy is set by the node role.
+        """
+        parse_conf.return_value = {'SP_OURID': '2'}
+        mp_plan.return_value = {'proc/sys/kernel/numa_balancing': '1'}
+        settings_apply.return_value = {'changed': [], 'errors': []}
+        render.return_value = 'contents\n'
+
+        # No StorPool server, so a compute node.
+        testee.configure_mempolicy()
+        mp_plan.assert_called_once_with('compute')
+        settings_apply.assert_called_once_with(spmempolicy.KV_KEY,
+                                               mp_plan.return_value)
+        self.assertEqual(spmempolicy.DESCRIPTION,
+                         render.call_args[1]['context']['description'])
+        self.assertEqual([spmempolicy.SERVICE_FILE], self.installed())
+        self.assertEqual([
+            mock.call(['systemctl', 'daemon-reload']),
+            mock.call(['systemctl', 'enable', spmempolicy.SERVICE_NAME]),
+        ], self.check_call.call_args_list)
+
+        # An unknown role leaves the policy alone.
+        r_config.r_set('storpool_node_role', 'whatever', True)
+        self.assertIsNone(testee.configure_mempolicy())
+        self.assertEqual(1, settings_apply.call_count)
+        self.assertEqual(hookenv.WARNING, h_log.call_args[0][1])
+
+    @mock.patch('os.unlink')
+    @mock.patch('os.path.exists')
+    @mock.patch('subprocess.call')
+    @mock.patch('spcharms.settings.restore')
+    def test_remove_settings(self, settings_restore, call, exists, unlink):
+        """
+        Test that the boot-time service is removed and the original values
+        restored.
+        """
+        settings_restore.return_value = {'changed': [], 'errors': []}
+        exists.return_value = True
+        testee.remove_settings(sppower)
+        self.assertEqual([
+            mock.call(['systemctl', 'disable', sppower.SERVICE_NAME]),
+            mock.call(['systemctl', 'daemon-reload']),
+        ], call.call_args_list)
+        unlink.assert_called_once_with(sppower.SERVICE_FILE)
+        settings_restore.assert_called_once_with(sppower.KV_KEY)
+
+        # Already removed, only restore the values.
+        call.reset_mock()
+        exists.return_value = False
+        testee.remove_settings(spmempolicy)
+        call.assert_not_called()
+        self.assertEqual(1, unlink.call_count)
+        settings_restore.assert_called_with(spmempolicy.KV_KEY)
 
     @mock_reactive_states
+    @mock.patch('os.makedirs')
+    @mock.patch('os.path.isdir')
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('spcharms.sysctl.nic_speed')
+    @mock.patch('spcharms.sysctl.apply')
+    @mock.patch('spcharms.rsyslog.validate')
     @mock.patch('charmhelpers.core.host.service_restart')
-    def test_copy_config_files(self, service_restart):
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_copy_config_files(self, h_log, service_restart,
+                               rsyslog_validate, sysctl_apply, nic_speed,
+                               render, isdir, makedirs):
         """
         Test that the layer enables the system startup service.
         """
-        count_txn_install = txn.install.call_count
+        rsyslog_validate.return_value = None
+        sysctl_apply.return_value = {'changed': [], 'errors': []}
+        nic_speed.return_value = 25000
+        render.return_value = 'contents\n'
+        isdir.return_value = False
+        metrics_units = [
+            os.path.join('/etc/systemd/system', name)
+            for name in (spslicemetrics.SERVICE_NAME,
+                         spslicemetrics.TIMER_NAME)]
 
-        testee.copy_config_files()
-        self.assertEqual(count_txn_install + 2, txn.install.call_count)
-        service_restart.assert_called_once_with('rsyslog')
-        self.assertEquals(set([COPIED_STATE]), r_state.r_get_states())
+        mock_file = mock.mock_open(read_data='vm.swappiness = 30\n')
+        with mock.patch('reactive.storpool_common.open', mock_file,
+                        create=True):
+            testee.copy_config_files()
+            self.assertEqual([sprsyslog.CONF_FILE, spplan.SYSCTL_FILE,
+                              spslicemetrics.PROGRAM] + metrics_units,
+                             self.installed())
+            service_restart.assert_called_once_with('rsyslog')
+            rsyslog_validate.assert_called_once_with('contents\n',
+                                                     sprsyslog.CONF_FILE)
+            self.assertEqual('rsyslog/storpool.conf',
+                             render.call_args_list[0][1]['source'])
+            self.assertIsNone(
+                render.call_args_list[0][1]['context']['forward'])
+            self.assertEquals(set([COPIED_STATE]), r_state.r_get_states())
+            makedirs.assert_any_call('/var/lib/prometheus/node-exporter',
+                                     mode=0o755)
+            self.assertEqual([
+                mock.call(['systemctl', 'daemon-reload']),
+                mock.call(['systemctl', 'enable', '--now',
+                           spslicemetrics.TIMER_NAME]),
+            ], self.check_call.call_args_list)
+            # No memory plan yet, only the vendor settings.
+            sysctl_apply.assert_called_once_with({'vm.swappiness': '30'})
+
+            # The files have not changed, so rsyslog is left alone.
+            self.check_call.reset_mock()
+            r_state.r_clear_states()
+            testee.copy_config_files()
+            self.assertEqual([], self.installed())
+            service_restart.assert_called_once_with('rsyslog')
+            self.assertEqual(1, rsyslog_validate.call_count)
+            self.check_call.assert_not_called()
+            self.assertEquals(set([COPIED_STATE]), r_state.r_get_states())
+
+            # With a memory plan, the computed settings override the vendor
+            # ones and only the sysctl file is reinstalled.
+            spmemplan.record({'total': 262144, 'machine': 200000,
+                              'system': 4096})
+            r_state.r_clear_states()
+            testee.copy_config_files()
+            self.assertEqual([spplan.SYSCTL_FILE], self.installed())
+            service_restart.assert_called_once_with('rsyslog')
+            settings = sysctl_apply.call_args[0][0]
+            self.assertEqual('1', settings['vm.swappiness'])
+            self.assertEqual(str(262144 * 1024 // 200 + 2 * 16 * 1024),
+                             settings['vm.min_free_kbytes'])
+
+            # A configuration that rsyslogd rejects is not installed.
+            render.side_effect = lambda **kwargs: \
+                'rejected\n' if kwargs['source'] == 'rsyslog/storpool.conf' \
+                else 'contents\n'
+            rsyslog_validate.return_value = 'error during parsing'
+            r_state.r_clear_states()
+            testee.copy_config_files()
+            self.assertEqual([], self.installed())
+            rsyslog_validate.assert_called_with('rejected\n',
+                                                sprsyslog.CONF_FILE)
+            service_restart.assert_called_once_with('rsyslog')
+            h_log.assert_any_call('Not installing the rejected rsyslog '
+                                  'configuration: error during parsing',
+                                  hookenv.WARNING)
+            self.assertEquals(set([COPIED_STATE]), r_state.r_get_states())
+
+    @mock_reactive_states
+    @mock.patch('os.unlink')
+    @mock.patch('os.path.exists')
+    @mock.patch('charmhelpers.core.templating.render')
+    @mock.patch('spcharms.rsyslog.validate')
+    def test_install_rsyslog(self, rsyslog_validate, render, exists, unlink):
+        """
+        Test that the old vendor configuration is removed and that a change
+        of the log forwarding target triggers a rewrite.
+        """
+        rsyslog_validate.return_value = None
+        render.return_value = 'contents\n'
+        exists.return_value = True
+        r_config.r_set('storpool_log_forward', 'logs.example', False)
+        self.assertTrue(testee.install_rsyslog())
+        self.assertEqual([sprsyslog.CONF_FILE], self.installed())
+        unlink.assert_called_once_with(sprsyslog.OLD_CONF_FILES[0])
+        self.assertEqual('logs.example',
+                         render.call_args[1]['context']['forward']['host'])
+
+        # The configuration is up to date, only the old file is removed.
+        self.assertTrue(testee.install_rsyslog())
+        self.assertEqual([], self.installed())
+        exists.return_value = False
+        self.assertFalse(testee.install_rsyslog())
+
+        r_state.set_state(COPIED_STATE)
+        testee.check_log_forward()
+        self.assertEqual(set([COPIED_STATE]), r_state.r_get_states())
+        r_config.r_set('storpool_log_forward', 'udp://logs.example', True)
+        testee.check_log_forward()
+        self.assertEqual(set(), r_state.r_get_states())
+
+    @mock.patch('os.unlink')
+    @mock.patch('os.path.exists')
+    @mock.patch('subprocess.call')
+    def test_remove_slice_metrics(self, call, exists, unlink):
+        """
+        Test that the timer is stopped and the exporter's files removed.
+        """
+        exists.return_value = True
+        testee.remove_slice_metrics()
+        self.assertEqual([
+            mock.call(['systemctl', 'disable', '--now',
+                       spslicemetrics.TIMER_NAME]),
+            mock.call(['systemctl', 'daemon-reload']),
+        ], call.call_args_list)
+        self.assertEqual([
+            os.path.join('/etc/systemd/system', spslicemetrics.TIMER_NAME),
+            os.path.join('/etc/systemd/system', spslicemetrics.SERVICE_NAME),
+            spslicemetrics.PROGRAM,
+            '/var/lib/prometheus/node-exporter/storpool_slices.prom',
+        ], [args[0] for (args, _) in unlink.call_args_list])
+
+        # Nothing left to remove.
+        call.reset_mock()
+        unlink.reset_mock()
+        exists.return_value = False
+        testee.remove_slice_metrics()
+        call.assert_called_once_with(['systemctl', 'daemon-reload'])
+        unlink.assert_not_called()
+
+    @mock_reactive_states
+    @mock.patch('spcharms.drift.check')
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_check_drift(self, h_log, drift_check):
+        """
+        Test that the update-status check reports the drift and replans
+        after a hardware change.
+        """
+        no_drift = {'hardware': [], 'cgroups': [], 'irqs': []}
+        drift_check.return_value = no_drift
+        count_npset = spstatus.npset.call_count
+
+        # Nothing installed yet, nothing to check.
+        testee.check_drift()
+        self.assertEqual(0, drift_check.call_count)
+
+        r_state.r_set_states([INSTALLED_STATE])
+        testee.check_drift()
+        self.assertEqual(0, drift_check.call_count)
+
+        spdrift.record({}, {}, {'cpus': '0-3'})
+        testee.check_drift()
+        self.assertEqual(1, drift_check.call_count)
+        self.assertEqual(count_npset, spstatus.npset.call_count)
+
+        drift_check.return_value = dict(
+            no_drift, irqs=[(30, '2', '0-3')])
+        testee.check_drift()
+        spstatus.npset.assert_called_with(
+            'blocked', 'StorPool configuration drift: IRQ affinity: 30')
+        h_log.assert_called_with(
+            'The StorPool configuration has drifted: IRQ affinity: 30',
+            hookenv.WARNING)
+
+        # The drift is gone, so is the status message.
+        drift_check.return_value = no_drift
+        testee.check_drift()
+        spstatus.npset.assert_called_with('maintenance', '')
+        count_npset = spstatus.npset.call_count
+        testee.check_drift()
+        self.assertEqual(count_npset, spstatus.npset.call_count)
+
+        # A hot-plugged CPU means replanning the host, but not installing
+        # the packages again.
+        r_state.r_set_states([INSTALLED_STATE, COPIED_STATE])
+        drift_check.return_value = dict(no_drift, hardware=['cpus'])
+        inventory = {'cmdline': KERNEL_PARAMS}
+        with mock.patch('spcharms.inventory.load',
+                        return_value=(inventory, False)), \
+                mock.patch('spcharms.cgroups.detect_backend',
+                           return_value='v2'), \
+                mock.patch.object(testee, 'configure_host') as conf_host:
+            def replanned(*args):
+                spmemplan.record({'total': 262144, 'system': 4096})
+                return True
+
+            conf_host.side_effect = replanned
+            testee.check_drift()
+            spstatus.npset.assert_any_call(
+                'maintenance', 'replanning after a hardware change: cpus')
+            spstatus.npset.assert_called_with('maintenance', '')
+            ((conf_inventory, conf_backend, cmdline), _) = \
+                conf_host.call_args
+            self.assertIs(inventory, conf_inventory)
+            self.assertEqual('v2', conf_backend)
+            self.assertEqual(spplan.check_kernel(KERNEL_PARAMS, 'v2')[0],
+                             cmdline)
+            self.assertEqual(set([INSTALLED_STATE]), r_state.r_get_states())
+
+            # The same memory plan, the sysctl settings are left alone.
+            r_state.r_set_states([INSTALLED_STATE, COPIED_STATE])
+            testee.check_drift()
+            self.assertEqual(2, conf_host.call_count)
+            self.assertEqual(set([INSTALLED_STATE, COPIED_STATE]),
+                             r_state.r_get_states())
+
+            # StorPool does not fit on the new hardware.
+            conf_host.side_effect = None
+            conf_host.return_value = False
+            testee.check_drift()
+            self.assertEqual(set([INSTALLED_STATE, COPIED_STATE]),
+                             r_state.r_get_states())
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool CPU planner.
+"""
+
+import os
+import sys
+import unittest
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import cpuplan as spcpuplan
+
+
+def summary(services):
+    """
+    Convert a list of planned services into (name, cpus, shares) tuples.
+    """
+    return [(svc['name'], svc['cpus'], svc['shares']) for svc in services]
+
+
+class TestCPUPlan(unittest.TestCase):
+    """
+    Test the sizing of the StorPool services.
+    """
+    def test_compute_node(self):
+        """
+        Test that a compute-only node does not waste a core on the beacon.
+        """
+        topology = helpers.make_topology(0, 1)
+        services = spcpuplan.plan_services(topology, {})
+        self.assertEqual([('rdma', 1, None), ('beacon', 0, 'rdma'),
+                          ('block', 1, None)], summary(services))
+        self.assertEqual(3, spcpuplan.required_cpus(services))
+
+        plan = spcpuplan.plan_cpus(topology, 1, services, range(32))
+        self.assertEqual({'rdma': [8], 'beacon': [8], 'block': [9]},
+                         plan['groups'])
+        self.assertEqual([8, 9], plan['cpus'])
+        self.assertEqual([24, 25], plan['idle'])
+        self.assertFalse(plan['smt_fallback'])
+        self.assertEqual(sorted(set(range(32)) - set([8, 9, 24, 25])),
+                         plan['rest'])
+
+    def test_storage_node(self):
+        """
+        Test that a storage node gets more CPUs for more drives and NICs.
+        """
+        topology = helpers.make_topology(24, 4)
+        services = spcpuplan.plan_services(topology, {})
+        self.assertEqual([('rdma', 2, None), ('beacon', 1, None),
+                          ('block', 1, None), ('server', 1, None),
+                          ('server_1', 1, None), ('server_2', 1, None)],
+                         summary(services))
+
+        plan = spcpuplan.plan_cpus(topology, 1, services, range(32))
+        self.assertEqual({'rdma': [8, 9], 'beacon': [10], 'block': [11],
+                          'server': [12], 'server_1': [13],
+                          'server_2': [14]}, plan['groups'])
+
+        services = spcpuplan.plan_services(topology, {
+            'storpool_drives_per_server_cpu': 2,
+            'storpool_max_server_cpus': 3,
+            'storpool_nics_per_rdma_cpu': 0,
+            'storpool_block_cpus': 0,
+        })
+        self.assertEqual([('rdma', 1, None), ('beacon', 1, None),
+                          ('block', 0, 'rdma'), ('server', 1, None),
+                          ('server_1', 1, None), ('server_2', 1, None)],
+                         summary(services))
+
+        self.assertRaises(ValueError, spcpuplan.plan_services, topology,
+                          {'storpool_max_server_cpus': -1})
+        self.assertRaises(ValueError, spcpuplan.plan_services, topology,
+                          {'storpool_block_cpus': 'many'})
+
+    def test_smt_fallback(self):
+        """
+        Test the fallback to SMT threads and the "very_few_cpus" padding.
+        """
+        topology = {
+            'nodes': {0: [0, 1, 2, 3]},
+            'cores': [[0, 2], [1, 3]],
+            'ifaces': {},
+            'drives': {},
+        }
+        services = spcpuplan.plan_services(topology, {})
+        plan = spcpuplan.plan_cpus(topology, 0, services, [0, 1, 2, 3])
+        self.assertTrue(plan['smt_fallback'])
+        self.assertEqual({'rdma': [0], 'beacon': [0], 'block': [1]},
+                         plan['groups'])
+        self.assertEqual([2, 3], plan['rest'])
+
+        topology = {'nodes': {0: [0]}, 'cores': [[0]],
+                    'ifaces': {}, 'drives': {}}
+        plan = spcpuplan.plan_cpus(topology, 0, services, [0], pad=True)
+        self.assertEqual({'rdma': [0], 'beacon': [0], 'block': [0]},
+                         plan['groups'])
+        self.assertEqual([0], plan['rest'])
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool configuration drift detection.
+"""
+
+import os
+import shutil
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import drift as spdrift
+
+DESIRED = {
+    'cpuset/storpool.slice': [('cpuset.cpus', '2-3'),
+                              ('cpuset.mems', '0')],
+    'memory/storpool.slice': [('memory.limit_in_bytes', '1048576'),
+                              ('memory.memsw.limit_in_bytes', '1048576')],
+    'cpuset/machine.slice': [('cpuset.cpus', '0-1'),
+                             ('cpuset.mems', '0')],
+    'cpuset/vms.slice': [('cpuset.cpus', '0-1')],
+}
+
+
+class TestDrift(helpers.FakeRootTestCase):
+    """
+    Test the drift detection against a fake cgroupfs, /proc and sysfs.
+    """
+    prefix = 'spdrift-'
+
+    def setUp(self):
+        super(TestDrift, self).setUp()
+        self.cgroot = os.path.join(self.root, 'sys/fs/cgroup')
+        self.write('proc/meminfo', 'MemTotal:       65536000 kB\n'
+                                   'MemFree:        1000 kB\n')
+        self.write('sys/devices/system/cpu/online', '0-3')
+        self.write('sys/devices/system/node/online', '0')
+        for name in ('loop0', 'nvme0n1', 'sda'):
+            os.makedirs(os.path.join(self.root, 'sys/block', name))
+        for (path, attrs) in DESIRED.items():
+            if path == 'cpuset/vms.slice':
+                continue
+            for (attr, value) in attrs:
+                self.write(os.path.join('sys/fs/cgroup', path, attr), value)
+        self.write('proc/irq/30/smp_affinity_list', '2')
+        self.write('proc/irq/31/smp_affinity_list', '3')
+
+        spdrift.record(DESIRED, {30: [2], 31: [3]},
+                       spdrift.hardware(self.root), ['cpuset/vms.slice'])
+
+    def check(self):
+        return spdrift.check(spdrift.recorded(), self.root, self.cgroot)
+
+    def test_hardware(self):
+        """
+        Test the hardware snapshot.
+        """
+        self.assertEqual({
+            'cpus': '0-3',
+            'nodes': '0',
+            'memory': '65536000',
+            'drives': ['nvme0n1', 'sda'],
+        }, spdrift.hardware(self.root))
+        self.assertNotIn('memory.memsw.limit_in_bytes',
+                         dict(spdrift.recorded()['cgroups']
+                              ['memory/storpool.slice']))
+
+    def test_check(self):
+        """
+        Test the detection of the cgroup, interrupt and hardware changes.
+        """
+        res = self.check()
+        self.assertEqual({'hardware': [], 'cgroups': [], 'irqs': []}, res)
+        self.assertIsNone(spdrift.describe(res))
+
+        # A cgconfig restart with the distribution's defaults.
+        self.write('sys/fs/cgroup/cpuset/storpool.slice/cpuset.cpus', '0-3')
+        shutil.rmtree(os.path.join(self.cgroot, 'cpuset/machine.slice'))
+        # The same CPUs, written differently.
+        self.write('proc/irq/30/smp_affinity_list', '2-2')
+        self.write('proc/irq/31/smp_affinity_list', '0-3')
+        res = self.check()
+        self.assertEqual([
+            ('cpuset/machine.slice', None, None, None),
+            ('cpuset/storpool.slice', 'cpuset.cpus', '2-3', '0-3'),
+        ], res['cgroups'])
+        self.assertEqual([(31, '3', '0-3')], res['irqs'])
+        self.assertEqual('cpuset/machine.slice missing; '
+                         'cpuset/storpool.slice cpuset.cpus; '
+                         'IRQ affinity: 31',
+                         spdrift.describe(res))
+
+        # A cgroup that was never set up is only checked once it appears.
+        self.write('sys/fs/cgroup/cpuset/vms.slice/cpuset.cpus', '0-3')
+        self.assertEqual(('cpuset/vms.slice', 'cpuset.cpus', '0-1', '0-3'),
+                         self.check()['cgroups'][-1])
+
+        # A hot-plugged CPU and a new drive.
+        self.write('sys/devices/system/cpu/online', '0-4')
+        os.makedirs(os.path.join(self.root, 'sys/block/nvme1n1'))
+        self.assertEqual(['cpus', 'drives'], self.check()['hardware'])
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool hugepage reservation.
+"""
+
+import os
+import sys
+
+import mock
+
+from charmhelpers.core import templating
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import hugepages as sphugepages
+from spcharms import sysutil as spsysutil
+
+
+class TestHugepages(helpers.FakeRootTestCase):
+    """
+    Test the per-node hugepage accounting against a fake sysfs tree.
+    """
+    prefix = 'sphugepages-'
+
+    def setUp(self):
+        super(TestHugepages, self).setUp()
+        # Some hugepages for the virtual machines on both nodes.
+        for node in (0, 1):
+            self.set_nr(node, 100)
+        os.makedirs(os.path.join(self.root, 'proc/sys/vm'))
+        # The kernel cannot allocate more than 500 pages per node.
+        self.limit = 500
+        self.compacted = 0
+
+        orig_write = sphugepages.write_nr
+
+        def write_nr(path, count):
+            if path.endswith('compact_memory'):
+                self.compacted += 1
+            else:
+                count = min(count, self.limit)
+            orig_write(path, count)
+
+        patcher = mock.patch('spcharms.hugepages.write_nr', new=write_nr)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def set_nr(self, node, count):
+        self.write(sphugepages.nr_path(node, '/'), str(count))
+
+    def get_nr(self, node):
+        return spsysutil.read_int(sphugepages.nr_path(node, self.root))
+
+    def test_plan(self):
+        """
+        Test the conversion of the reservation into hugepages.
+        """
+        self.assertEqual({1: 640}, sphugepages.plan(1, 1280))
+        self.assertEqual({0: 2}, sphugepages.plan(0, 3))
+        self.assertEqual({}, sphugepages.plan(0, 0))
+        ctx = sphugepages.unit_context({1: 640}, self.root)
+        self.assertEqual(640, ctx['hugepages'][0]['pages'])
+        self.assertEqual(740, ctx['hugepages'][0]['target'])
+        self.assertTrue(ctx['hugepages'][0]['path'].startswith(
+            '/sys/devices/system/node/node1/hugepages/hugepages-2048kB/'))
+
+    def test_apply(self):
+        """
+        Test that the other hugepages are left alone, that the reservation
+        may be moved between nodes, and that a partial allocation is
+        reported.
+        """
+        res = sphugepages.apply({0: 300}, self.root)
+        self.assertEqual({0: {'wanted': 300, 'got': 300}}, res)
+        self.assertIsNone(sphugepages.shortfall(res))
+        self.assertEqual(400, self.get_nr(0))
+        self.assertEqual(600, sphugepages.recorded_mb())
+        self.assertEqual(0, self.compacted)
+
+        # Nothing changes the second time.
+        res = sphugepages.apply({0: 300}, self.root)
+        self.assertEqual(400, self.get_nr(0))
+        self.assertEqual({0: 300}, sphugepages.recorded())
+
+        # The boot-time target does not count our own pages twice.
+        ctx = sphugepages.unit_context({0: 300}, self.root)
+        self.assertEqual(400, ctx['hugepages'][0]['target'])
+        lines = templating.render(
+            source='systemd/storpool-hugepages.service', target=None,
+            context=ctx, templates_dir=os.path.realpath('templates'))
+        self.assertIn("ExecStart=/bin/sh -c "
+                      "'[ \"$$(cat {path})\" -ge 400 ] || "
+                      "echo 400 > {path}'"
+                      .format(path=sphugepages.nr_path(0)),
+                      lines.split('\n'))
+
+        # Move to node 1 and ask for more than the kernel can give.
+        res = sphugepages.apply({1: 450}, self.root)
+        self.assertEqual({0: {'wanted': 0, 'got': 0},
+                          1: {'wanted': 450, 'got': 400}}, res)
+        self.assertEqual(100, self.get_nr(0))
+        self.assertEqual(500, self.get_nr(1))
+        self.assertEqual(1, self.compacted)
+        self.assertEqual('node 1: 800 of 900 MB',
+                         sphugepages.shortfall(res))
+        self.assertEqual({1: 400}, sphugepages.recorded())
+
+        # Only the pages that were actually reserved are given back.
+        res = sphugepages.release(self.root)
+        self.assertEqual({1: {'wanted': 0, 'got': 0}}, res)
+        self.assertEqual(100, self.get_nr(1))
+        self.assertEqual({}, sphugepages.recorded())
+
+    def test_missing(self):
+        """
+        Test a kernel without hugepage support for a node.
+        """
+        res = sphugepages.apply({2: 10}, self.root)
+        self.assertEqual('node 2: 0 of 20 MB', sphugepages.shortfall(res))
+
+    def test_total(self):
+        """
+        Test the accounting of the hugepages of all sizes.
+        """
+        self.assertEqual(0, sphugepages.total_mb(self.root))
+        hpdir = os.path.join(self.root, 'sys/kernel/mm/hugepages')
+        for (size, count) in (('2048kB', 300), ('1048576kB', 2)):
+            os.makedirs(os.path.join(hpdir, 'hugepages-' + size))
+            with open(os.path.join(hpdir, 'hugepages-' + size,
+                                   'nr_hugepages'), mode='w') as f:
+                f.write('{count}\n'.format(count=count))
+        self.assertEqual(600 + 2048, sphugepages.total_mb(self.root))
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool hardware inventory cache.
+"""
+
+import os
+import sys
+
+import mock
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import inventory as spinventory
+
+CPUINFO = '''processor\t: 0
+model name\t: Something
+physical id\t: 0
+
+processor\t: 1
+model name\t: Something
+physical id\t: 1
+'''
+
+
+class TestInventory(helpers.FakeRootTestCase):
+    """
+    Test the hardware inventory against a fake /proc and sysfs tree.
+    """
+    prefix = 'spinventory-'
+
+    def setUp(self):
+        super(TestInventory, self).setUp()
+        self.write('proc/cmdline', 'root=/dev/sda1 swapaccount=1\n')
+        self.write('proc/cpuinfo', CPUINFO)
+        self.write('proc/meminfo', 'MemTotal:       65536000 kB\n'
+                                   'MemFree:        1000 kB\n')
+        self.write('proc/sys/kernel/random/boot_id', 'boot-1\n')
+        self.write('sys/devices/system/cpu/online', '0-1\n')
+        for (node, cpu) in ((0, 0), (1, 1)):
+            self.write('sys/devices/system/node/node{node}/cpulist'
+                       .format(node=node), '{cpu}\n'.format(cpu=cpu))
+        self.write('etc/hostname', 'storage1\n')
+        self.write('etc/storpool.conf', 'SP_IFACE=ens1\n')
+
+        orig_collect = spinventory.collect
+        self.collected = 0
+
+        def collect(root):
+            self.collected += 1
+            return orig_collect(root)
+
+        patcher = mock.patch('spcharms.inventory.collect', new=collect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_collect(self):
+        """
+        Test that the facts survive the trip through the unit data.
+        """
+        (inv, cached) = spinventory.load(self.root)
+        self.assertFalse(cached)
+        self.assertEqual('root=/dev/sda1 swapaccount=1\n', inv['cmdline'])
+        self.assertEqual([0, 1], inv['cpus'])
+        self.assertEqual((65536000, 'kB'), inv['mem_total'])
+        self.assertEqual({0: [0], 1: [1]}, inv['topology']['nodes'])
+        self.assertEqual({'ens1': None}, inv['topology']['ifaces'])
+
+        (cached_inv, cached) = spinventory.load(self.root)
+        self.assertTrue(cached)
+        self.assertEqual(inv, cached_inv)
+        self.assertEqual(1, self.collected)
+
+    def test_fingerprint(self):
+        """
+        Test that the inventory is collected anew after a reboot, a CPU
+        hotplug or a StorPool configuration change.
+        """
+        spinventory.load(self.root)
+        spinventory.load(self.root)
+        self.assertEqual(1, self.collected)
+
+        self.write('proc/sys/kernel/random/boot_id', 'boot-2\n')
+        spinventory.load(self.root)
+        self.assertEqual(2, self.collected)
+
+        self.write('sys/devices/system/cpu/online', '0\n')
+        spinventory.load(self.root)
+        self.assertEqual(3, self.collected)
+
+        os.makedirs(os.path.join(self.root, 'etc/storpool.conf.d'))
+        spinventory.load(self.root)
+        self.assertEqual(4, self.collected)
+        spinventory.load(self.root)
+        self.assertEqual(4, self.collected)
+
+    def test_block_devices(self):
+        """
+        Test that the inventory is collected anew when a block device
+        appears, gets used by another device or gets mounted.
+        """
+        self.write('sys/block/sda/sda1/partition', '1\n')
+        self.write('proc/mounts', '/dev/sda1 / ext4 rw 0 0\n')
+        spinventory.load(self.root)
+        self.assertEqual(1, self.collected)
+
+        self.write('sys/block/loop0/size', '0\n')
+        spinventory.load(self.root)
+        self.assertEqual(2, self.collected)
+
+        os.makedirs(os.path.join(self.root, 'sys/block/sda/sda1/holders',
+                                 'dm-0'))
+        self.assertEqual({'loop0': [], 'sda': [], 'sda1': ['dm-0']},
+                         spinventory.block_holders(self.root))
+        spinventory.load(self.root)
+        self.assertEqual(3, self.collected)
+
+        self.write('proc/mounts', '/dev/sda1 / ext4 rw 0 0\n'
+                                  '/dev/sdb /srv xfs rw 0 0\n')
+        spinventory.load(self.root)
+        self.assertEqual(4, self.collected)
+        spinventory.load(self.root)
+        self.assertEqual(4, self.collected)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool interrupt affinity.
+"""
+
+import os
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import irqs as spirqs
+
+INTERRUPTS = '''\
+        CPU0   CPU1   CPU2   CPU3
+   0:     40      0      0      0  IR-IO-APIC    2-edge     timer
+  24:      0    100      0      0  IR-PCI-MSI 524288-edge  nvme0q0
+  25:      0      0   2000      0  IR-PCI-MSI 524289-edge  nvme0q1
+  30:     10     20     30     40  IR-PCI-MSI 1048576-edge ens1-TxRx-0
+  31:      1      2      3      4  IR-PCI-MSI 1048577-edge ens1-TxRx-1
+  32:      5      5      5      5  IR-PCI-MSI 1048578-edge ens10-TxRx-0
+ NMI:      0      0      0      0  Non-maskable interrupts
+ LOC:   1000   1000   1000   1000  Local timer interrupts
+'''
+
+CPU_PLAN = {
+    'groups': {'rdma': [2], 'beacon': [2], 'block': [3],
+               'server': [3]},
+    'cpus': [2, 3],
+    'idle': [],
+    'rest': [0, 1],
+}
+
+
+class TestIRQs(helpers.FakeRootTestCase):
+    """
+    Test the interrupt discovery and pinning against a fake /proc and
+    sysfs tree.
+    """
+    prefix = 'spirqs-'
+
+    def setUp(self):
+        super(TestIRQs, self).setUp()
+        self.write('proc/interrupts', INTERRUPTS)
+        for irq in (0, 24, 25, 30, 31, 32, 40, 41):
+            self.write('proc/irq/{irq}/smp_affinity_list'.format(irq=irq),
+                       '0-3\n')
+        # The second NIC is a PCI device with MSI-X interrupts.
+        for irq in (40, 41):
+            self.write('sys/class/net/ens2/device/msi_irqs/{irq}'
+                       .format(irq=irq), 'msix\n')
+
+    def test_parse(self):
+        """
+        Test the parsing of /proc/interrupts.
+        """
+        interrupts = spirqs.read_interrupts(self.root)
+        self.assertEqual([0, 1, 2, 3], interrupts['cpus'])
+        self.assertEqual([0, 24, 25, 30, 31, 32],
+                         sorted(interrupts['irqs'].keys()))
+        self.assertEqual('nvme0q1', interrupts['irqs'][25]['name'])
+        self.assertEqual([10, 20, 30, 40],
+                         spirqs.irq_counts(interrupts['irqs'][30],
+                                           [0, 1, 2, 3]))
+        self.assertEqual([30], spirqs.irq_counts(interrupts['irqs'][30], [2]))
+        self.assertEqual({'cpus': [], 'irqs': {}},
+                         spirqs.read_interrupts('/nonexistent'))
+
+    def test_pin(self):
+        """
+        Test that the NIC interrupts go to the RDMA CPU, the NVMe ones to
+        the server CPU, and that only the changed ones are written.
+        """
+        topology = {
+            'ifaces': {'ens1': 0, 'ens2': 0},
+            'drives': {'nvme0n1': 0, 'sda': 0},
+        }
+        plan = spirqs.plan_irqs(topology, CPU_PLAN,
+                                spirqs.read_interrupts(self.root), self.root)
+        self.assertEqual({24: [3], 25: [3], 30: [2], 31: [2], 40: [2],
+                          41: [2]}, plan)
+
+        res = spirqs.apply(plan, self.root)
+        self.assertEqual([], res['errors'])
+        self.assertEqual(6, len(res['changed']))
+        self.assertEqual('2', self.read('proc/irq/30/smp_affinity_list'))
+        self.assertEqual('3', self.read('proc/irq/25/smp_affinity_list'))
+        self.assertEqual('0-3', self.read('proc/irq/32/smp_affinity_list'))
+
+        self.assertEqual({'changed': [], 'errors': []},
+                         spirqs.apply(plan, self.root))
+        plan[99] = [2]
+        self.assertEqual([99], [irq for (irq, _) in
+                                spirqs.apply(plan, self.root)['errors']])
+        self.assertEqual([24, 25, 30, 31, 40, 41],
+                         sorted(spirqs.recorded().keys()))
+
+        # The interrupts that are no longer pinned get their original
+        # affinity back, and so do the rest on a restore.
+        self.write('proc/irq/25/smp_affinity_list', '3')
+        del plan[99]
+        del plan[30]
+        plan[25] = [2]
+        res = spirqs.apply(plan, self.root)
+        self.assertEqual([(25, '3', '2'), (30, '2', '0-3')], res['changed'])
+        self.assertEqual('0-3', spirqs.recorded()[25])
+        self.assertNotIn(30, spirqs.recorded())
+
+        res = spirqs.restore(self.root)
+        self.assertEqual(5, len(res['changed']))
+        self.assertEqual('0-3', self.read('proc/irq/25/smp_affinity_list'))
+        self.assertEqual('0-3', self.read('proc/irq/40/smp_affinity_list'))
+        self.assertEqual({}, spirqs.recorded())
+
+    def test_irqbalance(self):
+        """
+        Test the irqbalance context and the foreign interrupt accounting.
+        """
+        ctx = spirqs.irqbalance_context([2, 3], [31, 30])
+        self.assertEqual({'banned_cpulist': '2-3',
+                          'banned_cpumask': '0000000c',
+                          'banned_irqs': [30, 31]}, ctx)
+
+        interrupts = spirqs.read_interrupts(self.root)
+        self.assertEqual(2005, spirqs.foreign_interrupts(
+            interrupts, [2], {30: [2], 31: [2]}))
+        self.assertIsNone(spirqs.foreign_rate(2005, 100.0))
+        self.assertEqual(10.0, spirqs.foreign_rate(2105, 110.0))
+        self.assertIsNone(spirqs.foreign_rate(5, 120.0))
+
+    def test_irqbalance_overrides(self):
+        """
+        Test the detection of the irqbalance environment file settings
+        that override the drop-in ones.
+        """
+        self.assertEqual([], spirqs.irqbalance_overrides(self.root))
+        self.write('etc/default/irqbalance',
+                   '#IRQBALANCE_BANNED_CPUS=\n'
+                   'IRQBALANCE_ONESHOT=0\n')
+        self.assertEqual([], spirqs.irqbalance_overrides(self.root))
+        self.write('etc/default/irqbalance',
+                   'IRQBALANCE_ARGS="--policyscript=/bin/true"\n'
+                   'export IRQBALANCE_BANNED_CPUS=00000001\n')
+        self.assertEqual(['IRQBALANCE_BANNED_CPUS', 'IRQBALANCE_ARGS'],
+                         spirqs.irqbalance_overrides(self.root))
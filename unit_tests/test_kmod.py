@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the targeted kernel module dependency updates.
+"""
+
+import os
+import sys
+
+import mock
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import kmod as spkmod
+
+RELEASE = '4.15.0-20-generic'
+PACKAGE = 'kmod-storpool-' + RELEASE
+MODDIR = 'lib/modules/' + RELEASE
+
+
+class TestKMod(helpers.FakeRootTestCase):
+    """
+    Test the detection of changed StorPool kernel modules.
+    """
+    prefix = 'spkmod-'
+
+    def setUp(self):
+        super(TestKMod, self).setUp()
+        self.write('var/lib/dpkg/info/{pkg}:amd64.list'.format(pkg=PACKAGE),
+                   '/.\n/lib\n/{d}/updates\n/{d}/updates/storpool_rdma.ko\n'
+                   '/{d}/updates/storpool_bd.ko.xz\n/usr/share/doc\n'
+                   .format(d=MODDIR))
+        self.write(MODDIR + '/updates/storpool_rdma.ko', 'rdma')
+        self.write(MODDIR + '/updates/storpool_bd.ko.xz', 'bd')
+
+    def test_module_files(self):
+        """
+        Test that the module files are found in the dpkg database.
+        """
+        self.assertEqual([
+            '/{d}/updates/storpool_bd.ko.xz'.format(d=MODDIR),
+            '/{d}/updates/storpool_rdma.ko'.format(d=MODDIR),
+        ], spkmod.module_files(PACKAGE, self.root))
+        self.assertEqual([], spkmod.module_files('no-such', self.root))
+
+    @mock.patch('subprocess.check_call')
+    def test_depmod(self, check_call):
+        """
+        Test that depmod only runs when the modules have changed.
+        """
+        (needed, fprint) = spkmod.depmod_needed(RELEASE, PACKAGE, self.root)
+        self.assertTrue(needed)
+        spkmod.depmod(RELEASE, fprint)
+        check_call.assert_called_once_with(['depmod', '-a', RELEASE])
+
+        # No modules.dep yet.
+        self.assertTrue(spkmod.depmod_needed(RELEASE, PACKAGE, self.root)[0])
+        self.write(MODDIR + '/modules.dep', '')
+        self.assertFalse(spkmod.depmod_needed(RELEASE, PACKAGE, self.root)[0])
+
+        # Same mtime and size, different contents.
+        fname = os.path.join(self.root, MODDIR, 'updates/storpool_rdma.ko')
+        st = os.stat(fname)
+        self.write(MODDIR + '/updates/storpool_rdma.ko', 'RDMA')
+        os.utime(fname, (st.st_atime, st.st_mtime))
+        self.assertTrue(spkmod.depmod_needed(RELEASE, PACKAGE, self.root)[0])
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool memory planner.
+"""
+
+import os
+import sys
+import unittest
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import cpuplan as spcpuplan
+from spcharms import memplan as spmemplan
+
+MEMINFO = [
+    'MemTotal:       263856116 kB\n',
+    'MemFree:        200000000 kB\n',
+    'HugePages_Total:    4096\n',
+    'HugePages_Free:     4096\n',
+    'Hugepagesize:       2048 kB\n',
+]
+
+
+class TestMemPlan(unittest.TestCase):
+    """
+    Test the memory sizing of the cgroups.
+    """
+    def test_meminfo(self):
+        """
+        Test the parsing of /proc/meminfo.
+        """
+        meminfo = spmemplan.parse_meminfo(MEMINFO)
+        self.assertEqual(257671, spmemplan.meminfo_mb(meminfo, 'MemTotal'))
+        self.assertEqual(8192, spmemplan.hugepages_mb(meminfo))
+        self.assertEqual(0, spmemplan.hugepages_mb({}))
+
+        meminfo = spmemplan.parse_meminfo(['MemTotal: 20 G\n',
+                                           'processor : 0\n'])
+        self.assertEqual({'MemTotal': (20, 'G')}, meminfo)
+        self.assertEqual(20480, spmemplan.meminfo_mb(meminfo, 'MemTotal'))
+        meminfo = spmemplan.parse_meminfo(['MemTotal: 20 T\n'])
+        self.assertRaises(ValueError, spmemplan.meminfo_mb, meminfo,
+                          'MemTotal')
+
+    def test_plan(self):
+        """
+        Test that storage nodes get more StorPool memory than compute ones.
+        """
+        topology = helpers.make_topology(0, 1)
+        services = spcpuplan.plan_services(topology, {})
+        plan = spmemplan.plan_memory(65536, 0, topology, services, {})
+        self.assertEqual({
+            'total': 65536,
+            'hugepages': 0,
+            'kernel': 2621,
+            'system': 4096,
+            'user': 4096,
+            'storpool': 1152,
+            'sp_hugepages': 256,
+            'reserved': 12221,
+            'machine': 53315,
+        }, plan)
+        self.assertEqual('total 65536M: kernel 2621M, system 4096M, '
+                         'user 4096M, storpool 1152M, storpool hugepages '
+                         '256M, other hugepages 0M, machine 53315M',
+                         spmemplan.format_plan(plan))
+
+        topology = helpers.make_topology(24, 2)
+        services = spcpuplan.plan_services(topology, {})
+        plan = spmemplan.plan_memory(1048576, 8192, topology, services, {
+            'storpool_memory_per_tb': 128,
+            'memory_kernel_percent': 2,
+            'memory_kernel_max': 32768,
+        })
+        # 1024 base + 2 NICs + 3 servers + 96TB (87.3TiB) of drives
+        self.assertEqual(1024 + 256 + 6144 + 11176, plan['storpool'])
+        self.assertEqual(20971, plan['kernel'])
+        # The default percentage is capped on large hosts.
+        plan = spmemplan.plan_memory(1048576, 8192, topology, services, {})
+        self.assertEqual(10240, plan['kernel'])
+        self.assertEqual(8192, plan['hugepages'])
+        # The hugepages for the beacon, block and RDMA and 3 servers
+        self.assertEqual(256 + 3072, plan['sp_hugepages'])
+        self.assertEqual(1048576 - plan['reserved'], plan['machine'])
+
+        plan = spmemplan.plan_memory(4096, 0, topology, services, {},
+                                     little=True)
+        self.assertEqual(4096 - 1900 - 512 - 1024 - 512 - 256,
+                         plan['machine'])
+
+        plan = spmemplan.plan_memory(8192, 0, topology, services, {})
+        self.assertTrue(plan['machine'] <= 0)
+
+        self.assertRaises(ValueError, spmemplan.plan_memory, 65536, 0,
+                          topology, services, {'memory_user': -1})
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool memory management policy.
+"""
+
+import os
+import shutil
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import mempolicy as spmempolicy
+from spcharms import settings as spsettings
+
+
+class TestMemPolicy(helpers.FakeRootTestCase):
+    """
+    Test the memory management policy against a fake sysfs tree.
+    """
+    prefix = 'spmempolicy-'
+
+    def setUp(self):
+        super(TestMemPolicy, self).setUp()
+        self.write(spmempolicy.THP_DEFRAG,
+                   'always defer defer+madvise [madvise] never')
+        self.write(spmempolicy.KHUGEPAGED_DEFRAG, '1')
+        self.write(spmempolicy.KSM_RUN, '0')
+        self.write(spmempolicy.KSM_PAGES, '100')
+        self.write(spmempolicy.KSM_SLEEP, '20')
+        self.write(spmempolicy.NUMA_BALANCING, '1')
+
+    def apply(self, role):
+        return spsettings.apply(spmempolicy.KV_KEY,
+                                spmempolicy.plan(role, self.root),
+                                self.root)
+
+    def test_node_role(self):
+        """
+        Test the choice of the node role.
+        """
+        server = {'SP_OURID': '1', 'SP_CACHE_SIZE': '8192'}
+        servers = {'SP_OURID': '1', 'SP_SERVER1_CACHE_SIZE': '4096'}
+        client = {'SP_OURID': '2', 'SP_NODE_NON_VOTING': '1'}
+        self.assertEqual('compute',
+                         spmempolicy.node_role('auto', client, self.root))
+        self.assertEqual('storage',
+                         spmempolicy.node_role(None, server, self.root))
+        self.write('dev/kvm', '')
+        self.assertEqual('hyperconverged',
+                         spmempolicy.node_role('', servers, self.root))
+        self.assertEqual('compute',
+                         spmempolicy.node_role('auto', client, self.root))
+        self.assertEqual('storage',
+                         spmempolicy.node_role('storage', client, self.root))
+        self.assertRaises(ValueError, spmempolicy.node_role, 'gateway',
+                          server, self.root)
+
+    def test_plan(self):
+        """
+        Test that only the supported settings are planned.
+        """
+        self.assertEqual('madvise', self.read(spmempolicy.THP_DEFRAG))
+
+        storage = spmempolicy.plan('storage', self.root)
+        self.assertEqual({
+            spmempolicy.THP_DEFRAG: 'madvise',
+            spmempolicy.KHUGEPAGED_DEFRAG: '0',
+            spmempolicy.KSM_RUN: '0',
+            spmempolicy.NUMA_BALANCING: '0',
+        }, storage)
+
+        # An older kernel without "defer+madvise" and without KSM.
+        self.write(spmempolicy.THP_DEFRAG, '[always] defer madvise never')
+        shutil.rmtree(os.path.join(self.root, 'sys/kernel/mm/ksm'))
+        compute = spmempolicy.plan('compute', self.root)
+        self.assertEqual({
+            spmempolicy.THP_DEFRAG: 'madvise',
+            spmempolicy.KHUGEPAGED_DEFRAG: '1',
+            spmempolicy.NUMA_BALANCING: '1',
+        }, compute)
+
+    def test_ksm_rate(self):
+        """
+        Test that KSM does not scan faster than on the hyperconverged
+        nodes or than the kernel's default.
+        """
+        def rate(role):
+            settings = spmempolicy.plan(role, self.root)
+            return int(settings[spmempolicy.KSM_PAGES]) * 1000 // \
+                int(settings[spmempolicy.KSM_SLEEP])
+
+        self.assertLessEqual(rate('compute'), rate('hyperconverged'))
+        self.assertLessEqual(rate('hyperconverged'), 100 * 1000 // 20)
+
+    def test_apply_restore(self):
+        """
+        Test that the original values are remembered and restored.
+        """
+        res = self.apply('hyperconverged')
+        self.assertEqual([], res['errors'])
+        self.assertIn((spmempolicy.THP_DEFRAG, 'madvise', 'defer+madvise'),
+                      res['changed'])
+        self.assertEqual('1', self.read(spmempolicy.KSM_RUN))
+        self.assertEqual('200', self.read(spmempolicy.KSM_SLEEP))
+        self.assertEqual('0', self.read(spmempolicy.NUMA_BALANCING))
+
+        # A role change restores the settings that are no longer planned.
+        res = self.apply('storage')
+        self.assertEqual('0', self.read(spmempolicy.KSM_RUN))
+        self.assertEqual('100', self.read(spmempolicy.KSM_PAGES))
+        self.assertEqual('20', self.read(spmempolicy.KSM_SLEEP))
+        self.assertEqual('madvise', self.read(spmempolicy.THP_DEFRAG))
+        self.assertEqual('0', spsettings.recorded(
+            spmempolicy.KV_KEY)[spmempolicy.KSM_RUN])
+
+        spsettings.restore(spmempolicy.KV_KEY, self.root)
+        self.assertEqual('madvise', self.read(spmempolicy.THP_DEFRAG))
+        self.assertEqual('1', self.read(spmempolicy.KHUGEPAGED_DEFRAG))
+        self.assertEqual('1', self.read(spmempolicy.NUMA_BALANCING))
+        self.assertEqual({}, spsettings.recorded(spmempolicy.KV_KEY))
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool network interface tuning.
+"""
+
+import json
+import os
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import netdev as spnetdev
+
+# A stand-in for ethtool that keeps the device settings in a JSON file.
+FAKE_ETHTOOL = '''#!{python}
+import json
+import sys
+
+with open({state!r}, mode='r') as f:
+    state = json.load(f)
+(opt, iface, args) = (sys.argv[1], sys.argv[2], sys.argv[3:])
+state['calls'].append(sys.argv[1:])
+dev = state['devices'].get(iface)
+if dev is None:
+    sys.stderr.write('Cannot get device settings: No such device\\n')
+    sys.exit(75)
+if opt == '-g':
+    print('Ring parameters for ' + iface + ':')
+    print('Pre-set maximums:')
+    print('RX:\\t\\t{{}}\\nRX Mini:\\tn/a\\nTX:\\t\\t{{}}'.format(
+        dev['max']['rx'], dev['max']['tx']))
+    print('Current hardware settings:')
+    print('RX:\\t\\t{{}}\\nRX Mini:\\tn/a\\nTX:\\t\\t{{}}'.format(
+        dev['rings']['rx'], dev['rings']['tx']))
+elif opt == '-c':
+    print('Coalesce parameters for ' + iface + ':')
+    print('Adaptive RX: {{}}  TX: n/a'.format(dev['coalesce']['adaptive-rx']))
+    print('stats-block-usecs: n/a')
+    for key in ('rx-usecs', 'rx-frames', 'tx-usecs'):
+        print('{{}}: {{}}'.format(key, dev['coalesce'][key]))
+elif opt in ('-G', '-C'):
+    what = dev['rings'] if opt == '-G' else dev['coalesce']
+    for (key, value) in zip(args[0::2], args[1::2]):
+        if key not in what:
+            sys.stderr.write('Operation not supported\\n')
+            sys.exit(76)
+        what[key] = int(value) if opt == '-G' else value
+with open({state!r}, mode='w') as f:
+    json.dump(state, f)
+'''
+
+
+class TestNetdev(helpers.FakeRootTestCase):
+    """
+    Test the network interface tuning against a fake sysfs tree and
+    ethtool.
+    """
+    prefix = 'spnetdev-'
+
+    def setUp(self):
+        super(TestNetdev, self).setUp()
+        self.state = os.path.join(self.root, 'ethtool.json')
+        self.save({
+            'calls': [],
+            'devices': {
+                'ens1': {
+                    'max': {'rx': 8192, 'tx': 8192},
+                    'rings': {'rx': 1024, 'tx': 1024},
+                    'coalesce': {'adaptive-rx': 'on', 'rx-usecs': '50',
+                                 'rx-frames': '0', 'tx-usecs': '8'},
+                },
+                'ens2': {
+                    'max': {'rx': 2048, 'tx': 1024},
+                    'rings': {'rx': 512, 'tx': 1024},
+                    'coalesce': {'adaptive-rx': 'off', 'rx-usecs': '8',
+                                 'rx-frames': '0', 'tx-usecs': '8'},
+                },
+            },
+        })
+        self.ethtool = os.path.join(self.root, 'ethtool')
+        with open(self.ethtool, mode='w') as f:
+            f.write(FAKE_ETHTOOL.format(python=sys.executable,
+                                        state=self.state))
+        os.chmod(self.ethtool, 0o755)
+
+        for (iface, rx, tx) in (('ens1', 2, 4), ('ens2', 1, 1)):
+            for queue in range(rx):
+                self.write('sys/class/net/{iface}/queues/rx-{q}/rps_cpus'
+                           .format(iface=iface, q=queue), '00000000')
+            for queue in range(tx):
+                self.write('sys/class/net/{iface}/queues/tx-{q}/xps_cpus'
+                           .format(iface=iface, q=queue), '00000000')
+
+    def save(self, state):
+        with open(self.state, mode='w') as f:
+            json.dump(state, f)
+
+    def load(self):
+        with open(self.state, mode='r') as f:
+            return json.load(f)
+
+    def test_parse(self):
+        """
+        Test the parsing of the ethtool output and the CPU masks.
+        """
+        self.assertEqual(
+            ({'rx': 4096, 'tx': 4096}, {'rx': 256, 'tx': 512}),
+            spnetdev.parse_rings('Ring parameters for ens1:\n'
+                                 'Pre-set maximums:\n'
+                                 'RX:\t\t4096\n'
+                                 'RX Mini:\tn/a\n'
+                                 'RX Jumbo:\t0\n'
+                                 'TX:\t\t4096\n'
+                                 'Current hardware settings:\n'
+                                 'RX:\t\t256\n'
+                                 'RX Mini:\tn/a\n'
+                                 'TX:\t\t512\n'
+                                 'RX Buf Len:\tn/a\n'))
+        self.assertEqual(
+            {'adaptive-rx': 'off', 'rx-usecs': '3', 'tx-usecs': '0'},
+            spnetdev.parse_coalesce('Coalesce parameters for ens1:\n'
+                                    'Adaptive RX: off  TX: n/a\n'
+                                    'stats-block-usecs: n/a\n'
+                                    'rx-usecs: 3\n'
+                                    'tx-usecs: 0\n'))
+
+        self.assertEqual('00000000', spnetdev.cpu_mask([]))
+        self.assertEqual('00000005', spnetdev.cpu_mask([0, 2]))
+        self.assertEqual('00000002,00000001', spnetdev.cpu_mask([0, 33]))
+        self.assertEqual(set([0, 33]), spnetdev.parse_mask('2,00000001'))
+        self.assertEqual(set(), spnetdev.parse_mask('0'))
+
+    def test_hooks(self):
+        """
+        Test that only the hooks of the installed network tools are used.
+        """
+        self.assertEqual([], spnetdev.hooks(self.root))
+        self.write('usr/bin/networkd-dispatcher', '')
+        self.assertEqual(list(spnetdev.HOOKS[1:]),
+                         spnetdev.hooks(self.root))
+        self.write('sbin/ifup', '')
+        self.assertEqual(list(spnetdev.HOOKS), spnetdev.hooks(self.root))
+
+    def test_queue_masks(self):
+        """
+        Test that the transmit queues share the CPUs out.
+        """
+        qdir = os.path.join(self.root, 'sys/class/net/ens1/queues')
+        masks = spnetdev.queue_masks('ens1', [2, 3, 4, 5, 6], self.root)
+        self.assertEqual({
+            qdir + '/rx-0/rps_cpus': '0000007c',
+            qdir + '/rx-1/rps_cpus': '0000007c',
+            qdir + '/tx-0/xps_cpus': '00000044',
+            qdir + '/tx-1/xps_cpus': '00000008',
+            qdir + '/tx-2/xps_cpus': '00000010',
+            qdir + '/tx-3/xps_cpus': '00000020',
+        }, masks)
+
+        masks = spnetdev.queue_masks('ens1', [2, 3], self.root)
+        self.assertEqual(['00000004', '00000008', '00000004', '00000008'],
+                         [masks[qdir + '/tx-{q}/xps_cpus'.format(q=q)]
+                          for q in range(4)])
+        self.assertEqual({}, spnetdev.queue_masks('ens1', [], self.root))
+        self.assertEqual({}, spnetdev.queue_masks('ens9', [2], self.root))
+
+    def test_apply(self):
+        """
+        Test that only the settings that differ are changed.
+        """
+        settings = spnetdev.plan(['ens2', 'ens1', 'ens9'], [3, 1])
+        self.assertEqual(['ens1', 'ens2', 'ens9'], sorted(settings))
+        self.assertEqual([1, 3], settings['ens1']['cpus'])
+
+        res = spnetdev.apply(settings, self.root, self.ethtool)
+        self.assertEqual([('ens9', 'device', 'no such interface')],
+                         res['errors'])
+        state = self.load()
+        self.assertEqual({'rx': 4096, 'tx': 4096},
+                         state['devices']['ens1']['rings'])
+        self.assertEqual({'rx': 2048, 'tx': 1024},
+                         state['devices']['ens2']['rings'])
+        self.assertEqual({'adaptive-rx': 'off', 'rx-usecs': '8',
+                          'rx-frames': '0', 'tx-usecs': '8'},
+                         state['devices']['ens1']['coalesce'])
+        self.assertIn(['-G', 'ens1', 'rx', '4096', 'tx', '4096'],
+                      state['calls'])
+        self.assertIn(['-C', 'ens1', 'adaptive-rx', 'off', 'rx-usecs', '8'],
+                      state['calls'])
+        self.assertIn(['-G', 'ens2', 'rx', '2048'], state['calls'])
+        self.assertNotIn('-C', [call[0] for call in state['calls']
+                                if call[1] == 'ens2'])
+        self.assertIn(('ens1', 'ring-rx', 1024, 4096), res['changed'])
+
+        self.assertEqual('0000000a', self.read(
+            'sys/class/net/ens1/queues/rx-1/rps_cpus'))
+        self.assertEqual('00000002', self.read(
+            'sys/class/net/ens1/queues/tx-0/xps_cpus'))
+        self.assertEqual('00000008', self.read(
+            'sys/class/net/ens1/queues/tx-3/xps_cpus'))
+        self.assertEqual('0000000a', self.read(
+            'sys/class/net/ens2/queues/tx-0/xps_cpus'))
+
+        # Everything is in place now, only ethtool queries.
+        state['calls'] = []
+        self.save(state)
+        res = spnetdev.apply(settings, self.root, self.ethtool)
+        self.assertEqual([], res['changed'])
+        self.assertEqual(['-c', '-c', '-g', '-g'],
+                         sorted(call[0] for call in self.load()['calls']))
+
+    def test_apply_errors(self):
+        """
+        Test that the ethtool failures are reported.
+        """
+        state = self.load()
+        del state['devices']['ens2']
+        self.save(state)
+        res = spnetdev.apply(spnetdev.plan(['ens2'], [1]), self.root,
+                             self.ethtool)
+        self.assertEqual(
+            [('ens2', 'ring', 'Cannot get device settings: No such device'),
+             ('ens2', 'coalesce',
+              'Cannot get device settings: No such device')],
+            res['errors'])
+        # The RPS/XPS masks are still set.
+        self.assertEqual(2, len(res['changed']))
+
+        res = spnetdev.apply(spnetdev.plan(['ens1'], [1]), self.root,
+                             os.path.join(self.root, 'no-ethtool'))
+        self.assertEqual(['ring', 'coalesce'],
+                         [what for (_, what, _) in res['errors']])
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool package verification.
+"""
+
+import os
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import pkgcheck as sppkgcheck
+
+DPKG_STATUS = '''Package: storpool-cli
+Status: install ok installed
+Priority: optional
+Version: 16.02.25.744ebef-1ubuntu1
+Description: StorPool command-line tool
+ A multi-line
+ description.
+
+Package: storpool-common
+Status: deinstall ok config-files
+Version: 16.02.25.744ebef-1ubuntu1
+
+Package: python-storpool
+Status: install ok installed
+Version: 4.0.0-1
+Depends: python'''
+
+PACKAGES = {
+    'storpool-cli': '16.02',
+    'python-storpool': '16.02',
+}
+
+
+class TestPkgCheck(helpers.FakeRootTestCase):
+    """
+    Test the parsing of the dpkg status database.
+    """
+    prefix = 'sppkgcheck-'
+
+    def setUp(self):
+        super(TestPkgCheck, self).setUp()
+        os.makedirs(os.path.join(self.root, 'var/lib/dpkg'))
+        self.write_status(DPKG_STATUS)
+
+    def write_status(self, contents):
+        with open(os.path.join(self.root, 'var/lib/dpkg/status'),
+                  mode='w') as f:
+            f.write(contents)
+
+    def test_installed(self):
+        """
+        Test that only fully installed packages are reported.
+        """
+        self.assertEqual({
+            'storpool-cli': '16.02.25.744ebef-1ubuntu1',
+            'python-storpool': '4.0.0-1',
+        }, sppkgcheck.installed_versions(['storpool-cli', 'storpool-common',
+                                          'python-storpool', 'no-such'],
+                                         self.root))
+        self.assertEqual({}, sppkgcheck.installed_versions(
+            ['storpool-cli'], os.path.join(self.root, 'nonexistent')))
+
+    def test_verify(self):
+        """
+        Test that the verification only passes for the recorded versions.
+        """
+        self.assertFalse(sppkgcheck.verify('16.02', PACKAGES, self.root))
+        sppkgcheck.record('16.02', PACKAGES, self.root)
+        self.assertTrue(sppkgcheck.verify('16.02', PACKAGES, self.root))
+        self.assertFalse(sppkgcheck.verify('16.03', PACKAGES, self.root))
+        self.assertFalse(sppkgcheck.verify(
+            '16.02', dict(PACKAGES, **{'storpool-common': '16.02'}),
+            self.root))
+
+        self.write_status(DPKG_STATUS.replace('4.0.0-1', '4.0.1-1'))
+        self.assertFalse(sppkgcheck.verify('16.02', PACKAGES, self.root))
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the side-effect-free StorPool host planning.
+"""
+
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+tools_path = os.path.realpath('tools')
+if tools_path not in sys.path:
+    sys.path.insert(0, tools_path)
+
+from spcharms import blockdev as spblockdev
+from spcharms import cgroups as spcgroups
+from spcharms import hugepages as sphugepages
+from spcharms import irqs as spirqs
+from spcharms import mempolicy as spmempolicy
+from spcharms import netdev as spnetdev
+from spcharms import plan as spplan
+from spcharms import power as sppower
+from spcharms import slicemetrics as spslicemetrics
+from spcharms import sysctl as spsysctl
+
+import fleet_plan
+
+CMDLINE = 'BOOT_IMAGE=/vmlinuz root=/dev/sda1 ro swapaccount=1 ' \
+          'nofb vga=normal nomodeset video=vesafb:off i915.modeset=0\n'
+
+CPUS = 16
+CORES = 8
+
+
+class TestPlan(helpers.FakeRootTestCase):
+    """
+    Test the host planning against a fake host snapshot.
+    """
+    prefix = 'spplan-'
+
+    def setUp(self):
+        super(TestPlan, self).setUp()
+        self.write('proc/cmdline', CMDLINE)
+        self.write('proc/cpuinfo', ''.join(
+            'processor\t: {cpu}\n\n'.format(cpu=cpu) for cpu in range(CPUS)))
+        self.write('proc/meminfo', 'MemTotal:       67108864 kB\n')
+        self.write('proc/interrupts', '           CPU0\n')
+        self.write('sbin/ifup', '')
+        self.write('usr/bin/networkd-dispatcher', '')
+        self.write('sys/devices/system/cpu/online',
+                   '0-{last}\n'.format(last=CPUS - 1))
+        self.write('sys/devices/system/node/node0/cpulist',
+                   '0-{last}\n'.format(last=CPUS - 1))
+        for cpu in range(CPUS):
+            core = cpu % CORES
+            topodir = 'sys/devices/system/cpu/cpu{cpu}/topology/' \
+                .format(cpu=cpu)
+            self.write(topodir + 'core_id', '{core}\n'.format(core=core))
+            self.write(topodir + 'thread_siblings_list',
+                       '{core},{sibling}\n'.format(core=core,
+                                                   sibling=core + CORES))
+        self.write('etc/hostname', 'storage1\n')
+        self.write('etc/storpool.conf',
+                   'SP_CLUSTER_ID=test\n'
+                   '[storage1]\n'
+                   'SP_IFACE1_CFG=1:sp0:ens1:-:10.0.0.1:b:s:P\n'
+                   '[storage2]\n'
+                   'SP_IFACE1_CFG=1:sp0:ens2:-:10.0.0.2:b:s:P\n')
+        self.write('sys/class/net/ens1/speed', '25000\n')
+
+    def plan(self, **kwargs):
+        return spplan.plan_host(self.root, {},
+                                templates_dir=os.path.realpath('templates'),
+                                **kwargs)
+
+    def test_plan_host(self):
+        """
+        Test the plan of a host that satisfies all the requirements.
+        """
+        res = self.plan()
+        self.assertTrue(res['ok'], res['error'])
+        self.assertEqual(spcgroups.BACKEND_V1, res['backend'])
+        self.assertEqual([], res['kernel']['missing'])
+        self.assertNotEqual([], res['kernel']['recommended'])
+        self.assertEqual(0, res['node'])
+        self.assertEqual(['beacon', 'block', 'rdma', 'rest', 'storpool'],
+                         sorted(res['cpusets'].keys()))
+        self.assertEqual(65536, res['memory']['total'])
+        self.assertGreater(res['memory']['machine'], 0)
+        self.assertEqual([['cpuset.cpus', '0-1'], ['cpuset.mems', '0']],
+                         res['cgroups']['cpuset/storpool.slice'])
+        self.assertEqual('2-7,10-15', res['cpusets']['rest'])
+
+        files = res['files']
+        self.assertIn('/etc/cgconfig.d/storpool.slice.conf', files)
+        self.assertIn(res['cpusets']['storpool'],
+                      files['/etc/cgconfig.d/storpool.slice.conf'])
+        # The interface in the snapshot host's own storpool.conf section
+        # is the 25 Gbit/s one.
+        self.assertIn('queue.size=', files['/etc/rsyslog.d/49-StorPool.conf'])
+        nics = json.loads(files['/etc/storpool-common/nic-tuning.json'])
+        self.assertEqual(['ens1'], list(nics.keys()))
+        self.assertEqual([0], nics['ens1']['cpus'])
+        sysctl = spsysctl.parse(files[spplan.SYSCTL_FILE].split('\n'))
+        self.assertEqual('6250', sysctl['net.core.netdev_max_backlog'])
+
+        # The same files that the charm installs.
+        for path in (sphugepages.SERVICE_FILE, spirqs.IRQBALANCE_DROPIN,
+                     spblockdev.UDEV_RULES, sppower.SERVICE_FILE,
+                     spmempolicy.SERVICE_FILE, spnetdev.PROGRAM,
+                     spslicemetrics.PROGRAM) + spnetdev.HOOKS:
+            self.assertIn(path, files)
+        self.assertIn(spnetdev.PROGRAM, files[spnetdev.HOOKS[0]])
+        timer = files[os.path.join(spcgroups.SYSTEMD_DIR,
+                                   spslicemetrics.TIMER_NAME)]
+        self.assertIn('OnUnitActiveSec=30s', timer)
+
+    def test_plan_host_v2(self):
+        """
+        Test the plan of a host with the unified cgroup hierarchy.
+        """
+        self.write('sys/fs/cgroup/cgroup.controllers', 'cpuset memory\n')
+        res = self.plan()
+        self.assertTrue(res['ok'], res['error'])
+        self.assertEqual(spcgroups.BACKEND_V2, res['backend'])
+        self.assertIn('/etc/systemd/system/storpool.slice', res['files'])
+        self.assertNotIn('/etc/cgconfig.d/storpool.slice.conf',
+                         res['files'])
+
+    def test_plan_host_errors(self):
+        """
+        Test that the planning stops at the first problem.
+        """
+        self.write('proc/cmdline', 'root=/dev/sda1 ro\n')
+        res = self.plan()
+        self.assertFalse(res['ok'])
+        self.assertTrue(res['error'].startswith('Missing kernel parameters'))
+        self.assertIn('swapaccount=1', res['kernel']['missing'])
+        self.assertEqual({}, res['files'])
+
+        res = self.plan(bypassed=['kernel_parameters'])
+        self.assertTrue(res['ok'], res['error'])
+
+        self.write('proc/cmdline', CMDLINE)
+        self.write('proc/meminfo', 'MemTotal:       8388608 kB\n')
+        res = self.plan()
+        self.assertFalse(res['ok'])
+        self.assertTrue(res['error'].startswith('Not enough memory'))
+        self.assertIsNone(res['memory'])
+
+        res = self.plan(bypassed=['very_little_memory'])
+        self.assertTrue(res['ok'], res['error'])
+
+        # The host name is needed to find its storpool.conf section.
+        os.unlink(self.path('etc/hostname'))
+        res = self.plan(bypassed=['very_little_memory'])
+        self.assertFalse(res['ok'])
+        self.assertTrue(res['error'].startswith('No etc/hostname'))
+
+    def test_snapshot_archive(self):
+        """
+        Test that a snapshot archive is planned just like the directory
+        and that nothing is extracted outside of the snapshot root.
+        """
+        tempdir = tempfile.mkdtemp(prefix='spplan-archive-')
+        self.addCleanup(shutil.rmtree, tempdir)
+        fname = os.path.join(tempdir, 'storage1.tar.gz')
+        with tarfile.open(fname, mode='w:gz') as archive:
+            archive.add(self.root, arcname='.')
+            for (name, link) in (('../escape', None),
+                                 ('/tmp/escape', None),
+                                 ('etc/escape', '/etc/passwd'),
+                                 ('etc/escape2', '../../etc/passwd')):
+                info = tarfile.TarInfo(name)
+                if link is None:
+                    info.size = 1
+                    archive.addfile(info, io.BytesIO(b'x'))
+                else:
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = link
+                    archive.addfile(info)
+
+        with tarfile.open(fname, mode='r:*') as archive:
+            names = [member.name for member in
+                     fleet_plan.safe_members(archive, tempdir)]
+        self.assertIn('./proc/cmdline', names)
+        self.assertEqual([], [name for name in names if 'escape' in name])
+
+        job = (fname, {}, [], 0, os.path.realpath('templates'))
+        (name, res) = fleet_plan.plan_snapshot(job)
+        self.assertEqual('storage1', name)
+        self.assertEqual(self.plan(), res)
+
+    def test_snapshot_chained_links(self):
+        """
+        Test that a link may not lead the later members out of the
+        snapshot root through an earlier link.
+        """
+        tempdir = tempfile.mkdtemp(prefix='spplan-chain-')
+        self.addCleanup(shutil.rmtree, tempdir)
+        fname = os.path.join(tempdir, 'chain.tar')
+        with tarfile.open(fname, mode='w') as archive:
+            # Each link is within the root on its own.
+            for (name, link) in (('etc/a', '..'), ('etc/a/b', '..')):
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.SYMTYPE
+                info.linkname = link
+                archive.addfile(info)
+            info = tarfile.TarInfo('etc/a/b/escape')
+            info.size = 1
+            archive.addfile(info, io.BytesIO(b'x'))
+
+        # Check the member filter on its own and with the tarfile one.
+        for (idx, use_extract) in enumerate((False, True)):
+            dest = os.path.join(tempdir, 'root{idx}'.format(idx=idx))
+            os.mkdir(dest)
+            if use_extract:
+                fleet_plan.extract(fname, dest)
+            else:
+                with tarfile.open(fname, mode='r') as archive:
+                    archive.extractall(
+                        dest, members=fleet_plan.safe_members(archive, dest))
+            self.assertEqual(dest, os.path.realpath(
+                os.path.join(dest, 'etc/a')))
+            link = os.path.join(dest, 'b')
+            if os.path.lexists(link):
+                self.assertTrue(fleet_plan.within(link, dest))
+        self.assertEqual(['chain.tar', 'root0', 'root1'],
+                         sorted(os.listdir(tempdir)))
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool CPU power management settings.
+"""
+
+import os
+import shutil
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import power as sppower
+from spcharms import settings as spsettings
+
+
+GOVERNOR = 'sys/devices/system/cpu/cpu{cpu}/cpufreq/scaling_governor'
+IDLE = 'sys/devices/system/cpu/cpu{cpu}/cpuidle/state{state}/disable'
+
+
+class TestPower(helpers.FakeRootTestCase):
+    """
+    Test the cpufreq and cpuidle settings against a fake sysfs tree.
+    """
+    prefix = 'sppower-'
+
+    def setUp(self):
+        super(TestPower, self).setUp()
+        for cpu in range(4):
+            self.write(GOVERNOR.format(cpu=cpu), 'powersave')
+            self.write(os.path.join(os.path.dirname(GOVERNOR.format(cpu=cpu)),
+                                    'scaling_available_governors'),
+                       'performance powersave')
+            for state in range(4):
+                self.write(IDLE.format(cpu=cpu, state=state), '0')
+        # No cpufreq driver for CPU 3.
+        shutil.rmtree(os.path.join(
+            self.root, os.path.dirname(GOVERNOR.format(cpu=3))))
+
+    def apply(self, cpus):
+        return spsettings.apply(sppower.KV_KEY,
+                                sppower.plan(cpus, self.root), self.root)
+
+    def test_plan(self):
+        """
+        Test that only the StorPool CPUs and the deep idle states are
+        touched.
+        """
+        settings = sppower.plan([1, 3], self.root)
+        self.assertEqual({
+            GOVERNOR.format(cpu=1): 'performance',
+            IDLE.format(cpu=1, state=2): '1',
+            IDLE.format(cpu=1, state=3): '1',
+            IDLE.format(cpu=3, state=2): '1',
+            IDLE.format(cpu=3, state=3): '1',
+        }, settings)
+
+    def test_apply(self):
+        """
+        Test that the original values are restored for the CPUs that are
+        no longer StorPool ones and when the charm is removed.
+        """
+        res = self.apply([0, 1])
+        self.assertEqual(6, len(res['changed']))
+        self.assertEqual([], res['errors'])
+        self.assertEqual('performance', self.read(GOVERNOR.format(cpu=1)))
+        self.assertEqual('1', self.read(IDLE.format(cpu=1, state=3)))
+        self.assertEqual('powersave', self.read(GOVERNOR.format(cpu=2)))
+        self.assertEqual('0', self.read(IDLE.format(cpu=1, state=1)))
+
+        # Nothing changes the second time.
+        res = self.apply([0, 1])
+        self.assertEqual([], res['changed'])
+
+        # CPU 0 goes back to the virtual machines.
+        res = self.apply([1, 2])
+        self.assertEqual('powersave', self.read(GOVERNOR.format(cpu=0)))
+        self.assertEqual('0', self.read(IDLE.format(cpu=0, state=2)))
+        self.assertEqual('performance', self.read(GOVERNOR.format(cpu=2)))
+
+        res = spsettings.restore(sppower.KV_KEY, self.root)
+        self.assertEqual(6, len(res['changed']))
+        for cpu in range(3):
+            self.assertEqual('powersave', self.read(GOVERNOR.format(cpu=cpu)))
+            self.assertEqual('0', self.read(IDLE.format(cpu=cpu, state=3)))
+        self.assertEqual({}, spsettings.recorded(sppower.KV_KEY))
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool rsyslog configuration.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from charmhelpers.core import templating
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import rsyslog as sprsyslog
+
+
+class TestRsyslog(unittest.TestCase):
+    """
+    Test the generation of the rsyslog configuration.
+    """
+    def render(self, context):
+        return templating.render(
+            source='rsyslog/storpool.conf', target=None, context=context,
+            templates_dir=os.path.realpath('templates'))
+
+    def test_parse_target(self):
+        """
+        Test the parsing of the log forwarding targets.
+        """
+        self.assertIsNone(sprsyslog.parse_target(''))
+        self.assertIsNone(sprsyslog.parse_target(None))
+        self.assertEqual({'protocol': 'tcp', 'host': 'logs.example',
+                          'port': 514},
+                         sprsyslog.parse_target('logs.example'))
+        self.assertEqual({'protocol': 'udp', 'host': '10.1.2.3',
+                          'port': 1514},
+                         sprsyslog.parse_target('udp://10.1.2.3:1514'))
+        self.assertEqual({'protocol': 'tcp', 'host': 'fd00::1',
+                          'port': 6514},
+                         sprsyslog.parse_target('tcp://[fd00::1]:6514'))
+        self.assertEqual({'protocol': 'tcp', 'host': 'fd00::1',
+                          'port': 514},
+                         sprsyslog.parse_target('[fd00::1]'))
+        for value in ('http://logs.example', 'logs.example:', 'fd00::1',
+                      'logs.example:port', 'logs.example:70000',
+                      '[fd00::1', '[fd00::1]514', ':514'):
+            self.assertRaises(ValueError, sprsyslog.parse_target, value)
+
+    def test_plan(self):
+        """
+        Test the sizing of the queues.
+        """
+        res = sprsyslog.plan(None)
+        self.assertEqual(128 * 1024 * 1024 // sprsyslog.MESSAGE_SIZE,
+                         res['queue_size'])
+        self.assertLess(res['low_watermark'], res['high_watermark'])
+        self.assertLess(res['high_watermark'], res['queue_size'])
+        self.assertEqual(1024, res['batch_size'])
+        self.assertEqual(res['queue_size'] // 4, res['ratelimit_burst'])
+
+        small = sprsyslog.plan({'system': 256})
+        self.assertEqual(16 * 1024 * 1024 // sprsyslog.MESSAGE_SIZE,
+                         small['queue_size'])
+        self.assertEqual(128, small['batch_size'])
+        large = sprsyslog.plan({'system': 65536})
+        self.assertEqual(256 * 1024 * 1024 // sprsyslog.MESSAGE_SIZE,
+                         large['queue_size'])
+
+    def test_render(self):
+        """
+        Test that the forwarding action is only generated when needed.
+        """
+        conf = self.render(sprsyslog.plan(None))
+        self.assertIn('type="omfile"', conf)
+        self.assertIn('queue.size="65536"', conf)
+        self.assertIn('string="/var/log/storpool/%programname%.log"', conf)
+        self.assertNotIn('omfwd', conf)
+        self.assertIn('queue.timeoutEnqueue="2000"', conf)
+        self.assertNotIn('discard', conf)
+        lines = [line.strip() for line in conf.split('\n')]
+        call = lines.index('call storpool')
+        self.assertEqual('stop', lines[call + 1])
+
+        conf = self.render(sprsyslog.plan(
+            None, sprsyslog.parse_target('udp://logs.example')))
+        self.assertIn('type="omfwd"', conf)
+        self.assertIn('target="logs.example"', conf)
+        self.assertIn('protocol="udp"', conf)
+        self.assertIn('queue.filename="storpool-forward"', conf)
+        self.assertIn('ratelimit.interval="5"', conf)
+        self.assertIn('ratelimit.burst="16384"', conf)
+
+    @mock.patch('subprocess.check_output')
+    def test_validate(self, check_output):
+        """
+        Test that the full configuration is checked with the new file in
+        place and that the previous one is put back if it is rejected.
+        """
+        tempd = tempfile.mkdtemp(prefix='sprsyslog-')
+        self.addCleanup(shutil.rmtree, tempd)
+        path = os.path.join(tempd, '49-StorPool.conf')
+
+        def read():
+            with open(path, mode='r') as f:
+                return f.read()
+
+        seen = []
+        check_output.side_effect = lambda *args, **kwargs: \
+            seen.append(read()) or b''
+        self.assertIsNone(sprsyslog.validate('# first\n', path))
+        self.assertEqual(['rsyslogd', '-N1'], check_output.call_args[0][0])
+        self.assertEqual(['# first\n'], seen)
+        self.assertEqual('# first\n', read())
+
+        check_output.side_effect = subprocess.CalledProcessError(
+            1, ['rsyslogd', '-N1'], output=b'rsyslogd: error during parsing\n')
+        self.assertEqual('rsyslogd: error during parsing',
+                         sprsyslog.validate('# second\n', path))
+        self.assertEqual('# first\n', read())
+
+        os.unlink(path)
+        check_output.side_effect = OSError('No such file or directory')
+        self.assertEqual('No such file or directory',
+                         sprsyslog.validate('# third\n', path))
+        self.assertEqual([], os.listdir(tempd))
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the remembered sysfs and procfs settings.
+"""
+
+import os
+import sys
+
+from charmhelpers.core import templating
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import settings as spsettings
+
+KV_FIRST = 'storpool-common.test.first'
+KV_SECOND = 'storpool-common.test.second'
+
+ENABLED = 'sys/kernel/mm/something/enabled'
+COUNT = 'sys/kernel/mm/something/count'
+MISSING = 'sys/kernel/mm/something/missing'
+
+
+class TestSettings(helpers.FakeRootTestCase):
+    """
+    Test the application and restoration of the settings against a fake
+    sysfs tree.
+    """
+    prefix = 'spsettings-'
+
+    def setUp(self):
+        super(TestSettings, self).setUp()
+        self.write(ENABLED, 'always [madvise] never')
+        self.write(COUNT, '100')
+
+    def test_apply_restore(self):
+        """
+        Test that only the differing values are written, that the original
+        ones are remembered separately for each key, and restored.
+        """
+        res = spsettings.apply(KV_FIRST, {ENABLED: 'never', MISSING: '1'},
+                               self.root)
+        self.assertEqual([(ENABLED, 'madvise', 'never')], res['changed'])
+        self.assertEqual([(MISSING, 'cannot read the current value')],
+                         res['errors'])
+        self.assertEqual('never', self.read(ENABLED))
+        self.assertEqual({ENABLED: 'madvise'}, spsettings.recorded(KV_FIRST))
+
+        res = spsettings.apply(KV_SECOND, {COUNT: '100'}, self.root)
+        self.assertEqual([], res['changed'])
+        self.assertEqual({COUNT: '100'}, spsettings.recorded(KV_SECOND))
+
+        # The original value is kept across the changes.
+        self.write(ENABLED, 'always madvise [never]')
+        spsettings.apply(KV_FIRST, {ENABLED: 'always'}, self.root)
+        self.assertEqual('always', self.read(ENABLED))
+        self.assertEqual({ENABLED: 'madvise'}, spsettings.recorded(KV_FIRST))
+
+        res = spsettings.restore(KV_FIRST, self.root)
+        self.assertEqual([(ENABLED, 'always', 'madvise')], res['changed'])
+        self.assertEqual('madvise', self.read(ENABLED))
+        self.assertEqual({}, spsettings.recorded(KV_FIRST))
+        self.assertEqual({COUNT: '100'}, spsettings.recorded(KV_SECOND))
+
+    def test_unit(self):
+        """
+        Test the boot-time service.
+        """
+        ctx = spsettings.unit_context('Do something', {COUNT: '200',
+                                                       ENABLED: 'never'})
+        self.assertEqual({
+            'description': 'Do something',
+            'settings': [{'path': '/' + COUNT, 'value': '200'},
+                         {'path': '/' + ENABLED, 'value': 'never'}],
+        }, ctx)
+        lines = templating.render(
+            source=spsettings.SERVICE_TEMPLATE, target=None, context=ctx,
+            templates_dir=os.path.realpath('templates')).split('\n')
+        self.assertIn('Description=Do something', lines)
+        self.assertIn("ExecStart=-/bin/sh -c 'echo 200 > /{count}'"
+                      .format(count=COUNT), lines)
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the StorPool slice metrics exporter.
+"""
+
+import os
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import slicemetrics as spslicemetrics
+
+PRESSURE = 'some avg10=0.00 avg60=0.00 avg300=0.00 total=1500000\n' \
+           'full avg10=0.00 avg60=0.00 avg300=0.00 total=500000\n'
+
+
+class TestSliceMetrics(helpers.FakeRootTestCase):
+    """
+    Test the slice metrics collection against fake cgroupfs trees.
+    """
+    prefix = 'spslicemetrics-'
+
+    def setUp(self):
+        super(TestSliceMetrics, self).setUp()
+
+    def samples(self):
+        return dict(((metric, tuple(sorted(labels.items()))), value)
+                    for (metric, labels, value)
+                    in spslicemetrics.collect(self.root))
+
+    def test_v2(self):
+        """
+        Test the unified hierarchy.
+        """
+        self.write('cgroup.controllers', 'cpuset cpu io memory\n')
+        for path in ('storpool.slice', 'storpool.slice/storpool-rdma.slice',
+                     'machine.slice'):
+            self.write(path + '/memory.current', '1048576\n')
+            self.write(path + '/memory.max', 'max\n')
+            self.write(path + '/memory.events',
+                       'low 0\nhigh 3\nmax 1\noom 0\noom_kill 0\n')
+            self.write(path + '/cpu.stat',
+                       'usage_usec 2500000\nuser_usec 1\nsystem_usec 1\n'
+                       'nr_periods 10\nnr_throttled 2\n'
+                       'throttled_usec 300000\n')
+            self.write(path + '/memory.pressure', PRESSURE)
+        self.write('storpool.slice/storpool-rdma.slice/memory.max',
+                   '536870912\n')
+        # The virtual machines' cgroups are not looked into.
+        self.write('machine.slice/machine-qemu.scope/memory.current', '1\n')
+
+        samples = self.samples()
+        rdma = (('slice', 'storpool.slice/rdma'),)
+        self.assertEqual(1048576, samples[('memory_usage_bytes', rdma)])
+        self.assertEqual(536870912, samples[('memory_limit_bytes', rdma)])
+        self.assertIsNone(samples[('memory_limit_bytes',
+                                   (('slice', 'storpool.slice'),))])
+        self.assertEqual(3, samples[('memory_events_total',
+                                     (('event', 'high'),) + rdma)])
+        self.assertEqual(2.5, samples[('cpu_usage_seconds_total', rdma)])
+        self.assertEqual(0.3, samples[('cpu_throttled_seconds_total',
+                                       rdma)])
+        self.assertEqual(0.5, samples[('pressure_stall_seconds_total',
+                                       (('kind', 'full'),
+                                        ('resource', 'memory')) + rdma)])
+        self.assertNotIn(('memory_usage_bytes',
+                          (('slice', 'machine.slice/machine-qemu.scope'),)),
+                         samples)
+
+        out = os.path.join(self.root, 'out.prom')
+        self.assertEqual(0, spslicemetrics.main(['-r', self.root,
+                                                 '-o', out]))
+        with open(out, mode='r') as f:
+            lines = f.read().split('\n')
+        self.assertIn('# TYPE storpool_slice_memory_usage_bytes gauge', lines)
+        self.assertIn('storpool_slice_memory_usage_bytes'
+                      '{slice="storpool.slice/rdma"} 1048576', lines)
+        self.assertIn('storpool_slice_pressure_stall_seconds_total'
+                      '{kind="some",resource="memory",'
+                      'slice="machine.slice"} 1.5', lines)
+        self.assertNotIn('storpool_slice_memory_limit_bytes'
+                         '{slice="storpool.slice"} None', lines)
+
+    def test_v1(self):
+        """
+        Test the cgroup v1 controllers.
+        """
+        self.write('memory/storpool.slice/memory.usage_in_bytes', '4096\n')
+        self.write('memory/storpool.slice/memory.limit_in_bytes', '8192\n')
+        self.write('memory/storpool.slice/memory.failcnt', '7\n')
+        self.write('memory/storpool.slice/block/memory.failcnt', '1\n')
+        self.write('cpuacct/storpool.slice/cpuacct.usage', '3000000000\n')
+        self.write('cpu/user.slice/cpu.stat',
+                   'nr_periods 5\nnr_throttled 1\nthrottled_time 2000000\n')
+
+        samples = self.samples()
+        sp = (('slice', 'storpool.slice'),)
+        self.assertEqual(4096, samples[('memory_usage_bytes', sp)])
+        self.assertEqual(7, samples[('memory_failcnt_total', sp)])
+        self.assertEqual(1, samples[('memory_failcnt_total',
+                                     (('slice', 'storpool.slice/block'),))])
+        self.assertEqual(3.0, samples[('cpu_usage_seconds_total', sp)])
+        self.assertEqual(1, samples[('cpu_throttled_periods_total',
+                                     (('slice', 'user.slice'),))])
+        self.assertNotIn(('pressure_stall_seconds_total', sp), samples)
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the computed StorPool sysctl settings.
+"""
+
+import os
+import sys
+
+import mock
+
+from charmhelpers.core import unitdata
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import sysctl as spsysctl
+
+
+class TestSysctl(helpers.FakeRootTestCase):
+    """
+    Test the generation and application of the sysctl settings.
+    """
+    prefix = 'spsysctl-'
+
+    def setUp(self):
+        super(TestSysctl, self).setUp()
+        self.kv = unitdata.Storage(':memory:')
+        patcher = mock.patch('charmhelpers.core.unitdata.kv',
+                             new=lambda: self.kv)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generate(self):
+        """
+        Test that the settings follow the host's memory and link speed.
+        """
+        small = dict(spsysctl.generate({'total': 8192, 'machine': 0}, 1000))
+        self.assertEqual(str(64 * 1024), small['vm.min_free_kbytes'])
+        self.assertEqual('20', small['vm.dirty_ratio'])
+        self.assertEqual('10', small['vm.dirty_background_ratio'])
+        self.assertEqual('10', small['vm.swappiness'])
+        self.assertEqual(str(16 * spsysctl.MB), small['net.core.rmem_max'])
+
+        big = dict(spsysctl.generate({'total': 524288, 'machine': 480000},
+                                     100000))
+        self.assertEqual(str(2 * 1024 * 1024), big['vm.min_free_kbytes'])
+        self.assertEqual('4', big['vm.dirty_ratio'])
+        self.assertEqual('2', big['vm.dirty_background_ratio'])
+        self.assertEqual('1', big['vm.swappiness'])
+        self.assertEqual(str(25000000), big['net.core.wmem_max'])
+        self.assertEqual('4096 87380 25000000', big['net.ipv4.tcp_rmem'])
+        self.assertEqual('25000', big['net.core.netdev_max_backlog'])
+
+    def test_nic_speed(self):
+        """
+        Test the link speed detection.
+        """
+        self.write('sys/class/net/eth0/speed', '25000')
+        self.write('sys/class/net/eth1/speed', '-1')
+        self.assertEqual(25000, spsysctl.nic_speed(['eth0', 'eth1'],
+                                                   self.root))
+        self.assertEqual(spsysctl.DEFAULT_SPEED,
+                         spsysctl.nic_speed(['eth1', 'eth2'], self.root))
+
+    def test_layer(self):
+        """
+        Test that the computed settings override the vendor ones.
+        """
+        content = spsysctl.layer(
+            '# vendor\nvm.swappiness = 30\n-net.core.rmem_max=1\n',
+            [('vm.swappiness', '1'), ('net.ipv4.tcp_rmem', '1  2 3')])
+        self.assertTrue(content.startswith('# vendor\n'))
+        self.assertEqual({
+            'vm.swappiness': '1',
+            'net.core.rmem_max': '1',
+            'net.ipv4.tcp_rmem': '1 2 3',
+        }, spsysctl.parse(content.split('\n')))
+        self.assertEqual({'vm.swappiness': '1'},
+                         spsysctl.parse(['vm/swappiness=1']))
+
+    def test_apply(self):
+        """
+        Test that only the changed values are written.
+        """
+        self.write('proc/sys/vm/swappiness', '60')
+        self.write('proc/sys/net/ipv4/tcp_rmem', '4096\t87380\t6291456')
+        settings = {
+            'vm.swappiness': '1',
+            'net.ipv4.tcp_rmem': '4096 87380 6291456',
+            'vm.no_such_setting': '1',
+        }
+        res = spsysctl.apply(settings, self.root)
+        self.assertEqual([('vm.swappiness', '60', '1')], res['changed'])
+        self.assertEqual(['vm.no_such_setting'],
+                         [key for (key, msg) in res['errors']])
+        with open(spsysctl.proc_path('vm.swappiness', self.root),
+                  mode='r') as f:
+            self.assertEqual('1\n', f.read())
+        self.assertEqual({'vm.swappiness': '1',
+                          'net.ipv4.tcp_rmem': '4096 87380 6291456'},
+                         self.kv.get(spsysctl.KV_KEY))
+
+        res = spsysctl.apply(settings, self.root)
+        self.assertEqual([], res['changed'])
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the shared sysfs and formatting helpers.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import sysutil as spsysutil
+
+
+class TestSysutil(unittest.TestCase):
+    """
+    Test the shared helpers.
+    """
+    def test_read(self):
+        """
+        Test reading the values of the sysfs files.
+        """
+        root = tempfile.mkdtemp(prefix='spsysutil-')
+        self.addCleanup(shutil.rmtree, root)
+        for (name, value) in (('count', '42\n'),
+                              ('scheduler', 'mq-deadline [none]\n'),
+                              ('multi', 'default 100\n8:0 200\n'),
+                              ('word', 'performance\n')):
+            with open(os.path.join(root, name), mode='w') as f:
+                f.write(value)
+
+        self.assertEqual(42, spsysutil.read_int(os.path.join(root, 'count')))
+        self.assertIsNone(spsysutil.read_int(os.path.join(root, 'word')))
+        self.assertIsNone(spsysutil.read_int(os.path.join(root, 'none')))
+        self.assertEqual('default 100\n8:0 200\n',
+                         spsysutil.read_text(os.path.join(root, 'multi')))
+        self.assertEqual('default 100',
+                         spsysutil.read_line(os.path.join(root, 'multi')))
+        self.assertIsNone(spsysutil.read_line(os.path.join(root, 'none')))
+        self.assertEqual('none', spsysutil.read_value(
+            os.path.join(root, 'scheduler')))
+        self.assertEqual('performance', spsysutil.read_value(
+            os.path.join(root, 'word')))
+        self.assertIsNone(spsysutil.read_value(os.path.join(root, 'none')))
+
+    def test_parse_choices(self):
+        """
+        Test the parsing of the bracketed selections.
+        """
+        self.assertEqual(('bfq', ['mq-deadline', 'kyber', 'bfq', 'none']),
+                         spsysutil.parse_choices(
+                             'mq-deadline kyber [bfq] none'))
+        self.assertEqual((None, ['madvise', 'never']),
+                         spsysutil.parse_choices('madvise never'))
+        self.assertEqual((None, []), spsysutil.parse_choices(None))
+
+    def test_format(self):
+        """
+        Test the CPU masks and the clamping.
+        """
+        self.assertEqual('0000000c', spsysutil.format_cpumask([2, 3]))
+        self.assertEqual('00000001,00000000,80000000',
+                         spsysutil.format_cpumask([31, 64]))
+        self.assertEqual('00000000', spsysutil.format_cpumask([]))
+        self.assertEqual(16, spsysutil.clamp(3, 16, 256))
+        self.assertEqual(256, spsysutil.clamp(1000, 16, 256))
+        self.assertEqual(100, spsysutil.clamp(100, 16, 256))
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the hook phase timing.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mock
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from spcharms import timing as sptiming
+
+
+class TestTiming(unittest.TestCase):
+    """
+    Test the phase and subprocess accounting.
+    """
+    def setUp(self):
+        super(TestTiming, self).setUp()
+        self.root = tempfile.mkdtemp(prefix='sptiming-')
+        sptiming._timeline = None
+
+    def tearDown(self):
+        sptiming._timeline = None
+        shutil.rmtree(self.root)
+        super(TestTiming, self).tearDown()
+
+    @mock.patch('charmhelpers.core.hookenv.local_unit',
+                return_value='storpool-common/0')
+    @mock.patch('charmhelpers.core.hookenv.hook_name',
+                return_value='upgrade-charm')
+    @mock.patch('charmhelpers.core.hookenv.atexit')
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_timeline(self, log, atexit, hook_name, local_unit):
+        """
+        Test that the subprocesses are counted in the right phases,
+        that the subprocess functions are restored, and that the timeline
+        is written out at the end of the hook.
+        """
+        orig_call = subprocess.check_call
+        with mock.patch('subprocess.check_call') as check_call:
+            sptiming.phase('outside')
+            with sptiming.handler('install_package'):
+                self.assertIsNot(check_call, subprocess.check_call)
+                sptiming.phase('packages')
+                subprocess.check_call(['true'])
+                subprocess.check_call(['true'])
+                sptiming.phase('cgroups')
+                with sptiming.handler('nested'):
+                    subprocess.check_call(['true'])
+            self.assertIs(check_call, subprocess.check_call)
+            self.assertEqual(3, check_call.call_count)
+
+            check_call.side_effect = subprocess.CalledProcessError(1, 'x')
+            with self.assertRaises(subprocess.CalledProcessError):
+                with sptiming.handler('copy_config_files'):
+                    subprocess.check_call(['false'])
+            self.assertIs(check_call, subprocess.check_call)
+        self.assertIs(orig_call, subprocess.check_call)
+        atexit.assert_called_once_with(sptiming.finish)
+
+        data = sptiming.timeline().as_dict()
+        self.assertEqual('upgrade-charm', data['hook'])
+        self.assertEqual('storpool-common/0', data['unit'])
+        self.assertEqual(['install_package', 'copy_config_files'],
+                         [h['name'] for h in data['handlers']])
+        install = data['handlers'][0]
+        self.assertEqual(3, install['subprocesses'])
+        self.assertEqual([('packages', 2), ('cgroups', 1)],
+                         [(p['name'], p['subprocesses'])
+                          for p in install['phases']])
+        self.assertEqual(1, data['handlers'][1]['subprocesses'])
+
+        path = os.path.join(self.root, 'timing', 'timeline.json')
+        with mock.patch('spcharms.timing.TIMELINE_FILE', new=path):
+            sptiming.finish()
+        with open(path, mode='r') as f:
+            self.assertEqual(data['handlers'], json.load(f)['handlers'])
+        self.assertEqual(1, log.call_count)
+        msg = log.call_args[0][0]
+        self.assertTrue(msg.startswith('Hook timing: upgrade-charm: '))
+        self.assertIn('install_package', msg)
+        self.assertIn('packages', msg)
+        self.assertIsNone(sptiming._timeline)
+
+    @mock.patch('charmhelpers.core.hookenv.hook_name',
+                return_value='update-status')
+    @mock.patch('charmhelpers.core.hookenv.atexit')
+    def test_phases(self, atexit, hook_name):
+        """
+        Test that the repeated and the nested handlers' phases add up to
+        the handler's time and subprocesses.
+        """
+        self.now = 100.0
+
+        def run(*args, **kwargs):
+            self.now += 2.0
+
+        with mock.patch('time.monotonic', new=lambda: self.now), \
+                mock.patch('subprocess.check_call', side_effect=run):
+            with sptiming.handler('check_drift'):
+                for name in ('inventory', 'irqs', 'inventory'):
+                    sptiming.phase(name)
+                    subprocess.check_call(['true'])
+                    self.now += 1.0
+                with sptiming.handler('nested'):
+                    sptiming.phase('irqs')
+                    subprocess.check_call(['true'])
+                    subprocess.check_call(['true'])
+
+        handler = sptiming.timeline().handlers[0]
+        self.assertEqual(['inventory', 'irqs', 'inventory', 'irqs'],
+                         [p['name'] for p in handler['phases']])
+        self.assertEqual([3.0, 3.0, 3.0, 4.0],
+                         [p['wall'] for p in handler['phases']])
+        self.assertEqual([1, 1, 1, 2],
+                         [p['subprocesses'] for p in handler['phases']])
+        self.assertEqual(13.0, handler['wall'])
+        self.assertEqual(5, handler['subprocesses'])
+        self.assertEqual(10.0, handler['subprocess_time'])
+        self.assertEqual(handler['subprocess_time'],
+                         sum(p['subprocess_time'] for p in handler['phases']))
+
+    @mock.patch('charmhelpers.core.hookenv.local_unit',
+                return_value='storpool-common/0')
+    @mock.patch('charmhelpers.core.hookenv.hook_name',
+                return_value='config-changed')
+    @mock.patch('charmhelpers.core.hookenv.atexit')
+    @mock.patch('charmhelpers.core.hookenv.log')
+    def test_failed_handler(self, log, atexit, hook_name, local_unit):
+        """
+        Test that a handler that fails restores the subprocess functions
+        and that the timeline is still written out.
+        """
+        saved = dict((fname, getattr(subprocess, fname))
+                     for fname in sptiming.SUBPROCESS_FUNCS
+                     if hasattr(subprocess, fname))
+        with self.assertRaises(RuntimeError):
+            with sptiming.handler('install_package'):
+                sptiming.phase('packages')
+                self.assertIsNot(saved['call'], subprocess.call)
+                raise RuntimeError('Could not install the packages')
+        for (fname, func) in saved.items():
+            self.assertIs(func, getattr(subprocess, fname))
+        self.assertIsNone(sptiming.timeline().handler)
+        self.assertIsNone(sptiming.timeline().phase)
+
+        path = os.path.join(self.root, 'timeline.json')
+        with mock.patch('spcharms.timing.TIMELINE_FILE', new=path):
+            atexit.call_args[0][0]()
+        with open(path, mode='r') as f:
+            data = json.load(f)
+        self.assertEqual('config-changed', data['hook'])
+        self.assertEqual(['install_package'],
+                         [h['name'] for h in data['handlers']])
+        self.assertEqual(['packages'],
+                         [p['name'] for p in data['handlers'][0]['phases']])
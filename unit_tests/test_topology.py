@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+"""
+A set of unit tests for the topology detection helpers.
+"""
+
+import os
+import sys
+
+lib_path = os.path.realpath('unit_tests/lib')
+if lib_path not in sys.path:
+    sys.path.insert(0, lib_path)
+
+from unit_tests import helpers
+from spcharms import topology as sptopology
+
+
+class TestTopology(helpers.FakeRootTestCase):
+    """
+    Test the CPU and NUMA topology detection.
+    """
+    prefix = 'sptopology-'
+
+    def make_host(self):
+        """
+        Build a fake dual-socket host with the StorPool NIC and most of the
+        drives attached to the second socket.
+        """
+        self.write('sys/devices/system/node/node0/cpulist', '0-3,8-11\n')
+        self.write('sys/devices/system/node/node1/cpulist', '4-7,12-15\n')
+        self.write('sys/devices/system/node/online', '0-1\n')
+        for cpu in range(16):
+            topodir = 'sys/devices/system/cpu/cpu{cpu}/topology/' \
+                .format(cpu=cpu)
+            self.write(topodir + 'physical_package_id',
+                       '{pkg}\n'.format(pkg=int(cpu % 8 >= 4)))
+            self.write(topodir + 'core_id',
+                       '{core}\n'.format(core=cpu % 4))
+            self.write(topodir + 'thread_siblings_list',
+                       '{first},{second}\n'.format(first=cpu % 8,
+                                                   second=cpu % 8 + 8))
+        self.write('sys/class/net/eth0/device/numa_node', '0\n')
+        self.write('sys/class/net/eth2/device/numa_node', '1\n')
+        self.write('sys/block/sda/device/numa_node', '0\n')
+        self.write('sys/block/nvme0n1/device/device/numa_node', '1\n')
+        self.write('sys/block/nvme1n1/device/device/numa_node', '1\n')
+        self.write('sys/block/nvme1n1/size', '3907029168\n')
+        self.write('sys/block/loop0/size', '0\n')
+        self.write('sys/block/sdb/device/numa_node', '0\n')
+        self.write('sys/block/sdb/sdb1/partition', '1\n')
+        self.write('sys/block/sdc/device/numa_node', '0\n')
+        self.write('sys/block/sdc/holders/dm-0', '')
+        self.write('proc/mounts', '/dev/sdb1 / ext4 rw 0 0\n'
+                                  'proc /proc proc rw 0 0\n')
+        self.write('etc/hostname', 'storage1\n')
+        self.write('etc/storpool.conf',
+                   '# a comment\n'
+                   'SP_OURID=1\n'
+                   '[some-other-host]\n'
+                   'SP_IFACE1_CFG=1:eth0:eth0:-:10.0.0.2:n:s:P\n'
+                   '[storage1]\n'
+                   'SP_IFACE1_CFG=1:eth2.100:eth2:100:10.0.0.1:n:s:P\n')
+
+    def test_cpulist(self):
+        """
+        Test the parsing and formatting of kernel CPU lists.
+        """
+        self.assertEqual([0, 1, 2, 3, 8, 10, 11],
+                         sptopology.parse_cpulist('0-3,8,10-11\n'))
+        self.assertEqual([], sptopology.parse_cpulist(''))
+        self.assertRaises(ValueError, sptopology.parse_cpulist, '0-a')
+        self.assertEqual('0-3,8,10-11',
+                         sptopology.format_cpulist([11, 0, 1, 2, 3, 8, 10]))
+        self.assertEqual('5', sptopology.format_cpulist([5, 5]))
+        self.assertEqual('', sptopology.format_cpulist([]))
+
+    def test_topology(self):
+        """
+        Test that StorPool is placed on the node local to its NIC.
+        """
+        self.make_host()
+        conf = sptopology.parse_storpool_conf(self.root, 'storage1.example')
+        self.assertEqual('1', conf['SP_OURID'])
+        self.assertEqual(['eth2'], sptopology.get_storpool_interfaces(conf))
+        # A snapshot must say which host it was taken on.
+        os.unlink(self.path('etc/hostname'))
+        self.assertRaises(ValueError, sptopology.parse_storpool_conf,
+                          self.root)
+        self.write('etc/hostname', 'storage1\n')
+
+        topology = sptopology.get_topology(range(14), self.root)
+        self.assertEqual({0: [0, 1, 2, 3, 8, 9, 10, 11],
+                          1: [4, 5, 6, 7, 12, 13]}, topology['nodes'])
+        self.assertEqual({'eth2': 1}, topology['ifaces'])
+        self.assertEqual({'sda': 0, 'nvme0n1': 1, 'nvme1n1': 1},
+                         topology['drives'])
+        self.assertEqual({'sda': 0, 'nvme0n1': 0, 'nvme1n1': 2000398934016},
+                         topology['drive_sizes'])
+        self.assertEqual(1, sptopology.select_storpool_node(topology))
+        self.assertEqual([[0, 8], [1, 9], [2, 10], [3, 11],
+                          [4, 12], [5, 13], [6], [7]], topology['cores'])
+
+        # Whole cores on the local node, their siblings kept idle.
+        self.assertEqual({
+            'service': [4, 5, 6],
+            'idle': [12, 13],
+            'rest': [0, 1, 2, 3, 7, 8, 9, 10, 11],
+        }, sptopology.allocate_cpus(topology, 1, 3))
+        self.assertEqual([4, 5, 6, 7, 0, 1, 2],
+                         sptopology.allocate_cpus(topology, 1, 7)['service'])
+        self.assertIsNone(sptopology.allocate_cpus(topology, 1, 8))
+
+        # Without any NIC information, the drives decide.
+        topology['ifaces'] = {}
+        topology['drives']['sdb'] = 0
+        topology['drives']['sdc'] = 0
+        self.assertEqual(0, sptopology.select_storpool_node(topology))
+
+    def test_no_numa(self):
+        """
+        Test the fallback to a single node on non-NUMA kernels.
+        """
+        self.write('etc/hostname', 'storage1\n')
+        topology = sptopology.get_topology([0, 1, 2, 3], self.root)
+        self.assertEqual({0: [0, 1, 2, 3]}, topology['nodes'])
+        self.assertEqual([[0], [1], [2], [3]], topology['cores'])
+        self.assertEqual({}, topology['ifaces'])
+        self.assertEqual({}, topology['drives'])
+        self.assertEqual(0, sptopology.select_storpool_node(topology))